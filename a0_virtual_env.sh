@@ -2,4 +2,8 @@
 python3.12 -m venv .venv
 source .venv/bin/activate
 pip install --upgrade pip
-pip install pandas==2.2.* plotly==5.22.* scikit-learn==1.5.* pyproj==3.6.* openpyxl==3.1.*
\ No newline at end of file
+pip install pandas==2.2.* plotly==5.22.* scikit-learn==1.5.* pyproj==3.6.* openpyxl==3.1.* orjson==3.10.*
+## optional: faster weather file parsing, and zstd (rather than gzip) for the raw station cache
+# pip install pyarrow==16.* zstandard==0.*
+## optional: headless render benchmark (c2_render_benchmark.py)
+# pip install playwright==1.* && python -m playwright install chromium
@@ -3,17 +3,35 @@
         to the portfolio project's code directory for upload to the github.io website.
         See params to True to generate the weather data and html divs used to build this page.
     Inputs:
-        PROGRESS.div, PROXIMITY.div, MAP.div, OCONUS.div: output files containing the data
-            displays that will be showcased on the project's main html page.
+        PROGRESS, PROXIMITY, MAP, OCONUS divs: the data displays that will be showcased on the
+            project's main html page.  When regenerate_divs is True, the panel modules hand
+            their divs over in memory; otherwise the cached io_mid/*.div files are read.
         roadtrips.css, roadtrips.html: the code for the project's main html page.  The div
-            outputs from other modules are injected into roadtrips.html
+            outputs from other modules are injected into roadtrips.html.  The css, along with
+            plotly.js, is published as a content-hashed static asset that roadtrips.html links to.
         roadtrips.png: a manual snapshot of roadtrips.html with a 3:5 aspect ratio.  Serves as
             the preview thumbnail for the project.
     Outputs:
         roadtrips.html: the project's main html page, with div element outputs from all other
             modules injected into it.
-        Note: roadtrips.html, css, and png are copied over to ../portfolio where will be uploaded
-            periodically to sjoshuam.github.io as part of my portfolio of work.
+        roadtrips.{hash}.css, plotly.{hash}.js: content-hashed static assets, written once and
+            shared by the dashboard and the io_mid debug pages.  Optionally minified and
+            pre-compressed (.gz / .br) for static hosting.
+        {PANEL}.{hash}.json, {PANEL}-{group}.{hash}.json, roadtrips-panels.{hash}.js: with
+            lazy_panels, each panel's figure (and its deferred trace groups, e.g. the proximity
+            panel's months) plus the script that fetches them, instead of figures in the page.
+        run_report.json: wall time, CPU time, memory, and row counts for every pipeline stage in
+            the run.  See a5_instrument.py.
+        size_report.json: bytes (raw, gzip, brotli) per panel, for the page, and for its assets,
+            plus trace and point counts per panel.  The build stops before exporting if any
+            measure is over its params['budget'].
+        Note: roadtrips.html, png, and the static assets are copied over to ../portfolio where
+            will be uploaded periodically to sjoshuam.github.io as part of my portfolio of work.
+    Watch mode: `python a1_execute_project.py watch` keeps one warm process running that polls
+        io_in and rebuilds only the stale panels whenever a file there changes.  Imports, parsed
+        spreadsheets, and panel divs stay in memory between rebuilds, and roadtrips.html is
+        replaced atomically, so a browser reload never catches a half-written page.  Watch mode
+        neither measures nor exports; run the script normally to publish.
     Open GitHub Issues:
         # None.  This file is good to go.
 """
@@ -22,52 +40,121 @@
 
 params = dict(
     download_weather_data = False,
-    regenerate_divs = True
+    regenerate_divs = True,
+    debug_html = False,
+    force_rebuild = False,
+    parallel_build = True,
+    minify_assets = True,
+    compress_assets = ('gzip', 'brotli'),
+    lazy_panels = False,    # fetch each panel's figure as json on scroll; see publish_panels()
+    ## css div class given to each panel's plotly div, tying it into roadtrips.css
+    panel_classes = dict(PROGRESS = 'progress_panel', MAP = 'main_panel',
+        OCONUS = 'oconus_panel', PROXIMITY = 'bottom_panel'),
+    measure_outputs = True,
+    export_outputs = True,
+    ## watch mode; see watch_dashboard()
+    watch_dir = 'io_in',
+    watch_interval = 0.2,   # seconds between polls of watch_dir
+    watch_settle = 0.1,     # a change must hold this long, so half-saved files are not read
+    ## size budgets in bytes, by measure_outputs() item and measure; any excess fails the build
+    budget = dict(
+        PAGE = dict(bytes = 1_500_000, gzip = 400_000),
+        TOTAL = dict(gzip = 1_600_000),
+        MAP = dict(bytes = 900_000),
+        PROXIMITY = dict(bytes = 500_000),
+        PROGRESS = dict(bytes = 150_000),
+        OCONUS = dict(bytes = 50_000)
+    )
 )
 
 ## functions needed to create assemble the data dashboard html
     ## abort if not running the right virtual environment
-import sys, shutil, os
+import sys, shutil, os, re, json, time
 if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')    
-import pandas as pd
-
-## functions needed to regenerate the div files injected into the data dashboard
-if params['download_weather_data']:
-    from a2_weather import download_weather_data
-if params['regenerate_divs']:
-    from b1_progress import draw_progress_panel
-    from b2_proximity import draw_proximity_panel
-    from b3_map import draw_map_panel
-    from b4_oconus import draw_oconus_panel
+from a3_render import write_chunks, write_text, read_text, read_sheet
+from a3_render import minify_css, publish_asset, publish_plotlyjs, measure_div, compressed_sizes
+from a3_render import split_div, remove_stale_assets, params as render_params
+
+## functions needed to regenerate the weather data and div files injected into the data dashboard;
+## a4_build imports each component's module only when that component needs rebuilding
+from a4_build import build_targets, start_pool, is_current, read_manifest
+from a5_instrument import instrument, write_report, records
+
+## with lazy_panels, runs once the page is parsed: draws each panel placeholder (a div with a
+## data-figure attribute) when it comes within rootMargin of the viewport, then runs the panel's
+## post script, if it registered one.  Trace groups the figure deferred (e.g. the proximity
+## panel's other months) are fetched the first time a slider step or restyle makes them visible.
+lazy_loader = '''
+(() => {
+    if (window.lazyPanels) return;
+    window.lazyPanels = true;
+    const fetchJSON = (src) => fetch(src).then((response) => {
+        if (!response.ok) throw new Error(src + ': HTTP ' + response.status);
+        return response.json();
+    });
+
+    const loadGroups = (gd) => Object.entries(gd.lazyGroups)
+        .filter(([src, rows]) => rows.some((row) => gd.data[row].visible !== false))
+        .forEach(([src, rows]) => {
+            delete gd.lazyGroups[src];
+            fetchJSON(src).then((traces) => {
+                rows.forEach((row, k) => {
+                    gd.data[row] = Object.assign(traces[k], {visible: gd.data[row].visible});
+                });
+                return Plotly.react(gd, gd.data, gd.layout);
+            }).catch((error) => { gd.lazyGroups[src] = rows; console.error(error); });
+        });
+
+    const loadPanel = (gd) => fetchJSON(gd.dataset.figure).then((figure) => {
+        gd.lazyGroups = figure.groups;
+        return Plotly.react(gd, figure.data, figure.layout, figure.config);
+    }).then(() => {
+        ['plotly_update', 'plotly_restyle'].forEach((name) => gd.on(name, () => loadGroups(gd)));
+        const hook = (window.lazyPanelHooks || {})[gd.id];
+        if (hook) hook();
+    }).catch((error) => console.error(error));
+
+    const panels = document.querySelectorAll('div[data-figure]');
+    if (!('IntersectionObserver' in window)) return panels.forEach(loadPanel);
+    const observer = new IntersectionObserver((entries) => entries.forEach((entry) => {
+        if (!entry.isIntersecting) return;
+        observer.unobserve(entry.target);
+        loadPanel(entry.target);
+    }), {rootMargin: '400px'});
+    panels.forEach((panel) => observer.observe(panel));
+})();
+'''
 
 ##########==========##########==========##########==========##########==========##########==========
 ## DEFINE COMPONENT FUNCTIONS
 
 
-def import_html(file_address = os.path.join('io_in', 'roadtrips.html')) -> str:
-    """ Reads in an html file as a text string. This html file is a blank set of divs with id
-    tags.  Those divs specify dashboard boxes into which other code can inject plotly html figures.
-    The html file also has the text narrating those figures.
+@instrument
+def compile_template(file_address = os.path.join('io_in', 'roadtrips.html')) -> list:
+    """ Reads in the dashboard's html template and tokenizes it once at its <insert> slots.  The
+    html file is a blank set of divs with id tags, plus an <insert> slot for each dashboard box
+    that a plotly html figure fills in.  The html file also has the text narrating those
+    figures, plus <insert> tags for statistics and static asset links.
 
     Input:  file_address = location of the html file that function will read in
-    Output: html_str = an str object containing the raw html code in the file
+    Output: template = list alternating literal html chunks (even positions) and slot names (odd
+                positions), ready for render_template()
     """
-    html_str = '\n'.join(open(file_address, 'rt').readlines())
-    return html_str
+    return re.split(r'<insert>(\w+)</insert>', read_text(file_address))
 
 
-def fill_in_statistics(html_str: str, city_list = os.path.join('io_in', 'city_list.xlsx')) -> str:
+@instrument
+def calculate_statistics(city_list = os.path.join('io_in', 'city_list.xlsx')) -> dict:
     """The explanatory text in the html cites statistics that will change over time as I complete
-    more trips.  This function calculates the statistics and injects them into the text.  In the
-    html file, the statistics are marked with <insert> tags, so replacement is a simple 
-    find-replace operation.
+    more trips.  This function calculates the statistics.  In the html file, the statistics are
+    marked with <insert> tags, which render_template() fills in.
 
-    Input:  html_str = html str ready for find-replace statistic injection.
-    Output: html_str = html str with statistics injected into the text
+    Input:  city_list = location of the city list xlsx file
+    Output: stats = dict of statistic strs keyed by <insert> slot name
     """
 
     ## extract city statistics
-    city_list = pd.read_excel(city_list)
+    city_list = read_sheet(city_list)
     stats = dict(
         GOAL = str(city_list.shape[0]),
         SOFAR = (~city_list['photo_date'].isna()).sum()
@@ -79,108 +166,392 @@ def fill_in_statistics(html_str: str, city_list = os.path.join('io_in', 'city_li
     is_a_state = ~city_list['state'].isin(['PR','DC'])
     is_photographed = ~city_list['photo_date'].isna()
     stats['STATES'] = str(len(set(city_list.loc[is_a_state & is_photographed, 'state'])))
+    return stats
 
-    ## inject statistics into file and return
-    for i in stats.keys():
-        html_str = html_str.replace(
-            '<insert>' + i + '</insert>',
-            stats[i]
-        )
-    return html_str
 
+@instrument
+def load_divs(divs = dict(), ids = ('PROGRESS', 'MAP', 'OCONUS', 'PROXIMITY')) -> dict:
+    """Plotly interactive figures can output as html divs.  Function collects the div for each
+    dashboard panel.  classify_panels() later ties each one into the dashboard's css style sheet.
+
+    Input:  divs: dict of div strs keyed by panel id, as returned by the panel modules
+            ids: the panel ids, which match the template's <insert> slot names and the cached
+                io_mid/{id}.div file names
+    Output: divs: dict with a div str for every panel id.  Panels missing from the input are
+                read from their io_mid/{id}.div file, once it is confirmed to match the hash
+                a4_build recorded for it, so a div cut short (e.g. by a crash) or edited since
+                never reaches the page.
+    """
+    manifest = read_manifest()
+    divs = {i: divs[i] for i in ids if i in divs}
+    for iter_id in [i for i in ids if i not in divs]:
+        file_address = os.path.join('io_mid', f'{iter_id}.div')
+        if not is_current(file_address, manifest = manifest):
+            raise RuntimeError(file_address + ' does not match io_mid/build_manifest.json; ' +
+                'rebuild it with regenerate_divs = True')
+        divs[iter_id] = read_text(file_address)
+    return {i: divs[i] for i in ids}
+
+
+@instrument
+def publish_assets(project_name = 'roadtrips', params = params) -> dict:
+    """Writes the dashboard's static assets (plotly.js and the css style sheet) to io_out once,
+    under content-hashed file names.  Every page and div references these shared copies, so page
+    loads and artifact storage do not grow with the number of panels.
+
+    Input:  project_name = base name of the css file in io_in
+            params = determines whether assets are minified and which pre-compressed variants
+                (gzip / brotli) are written alongside them.
+    Output: assets = dict of hashed file names keyed by the <insert> tag that references them
+    """
+    css = read_text(os.path.join('io_in', f'{project_name}.css'))
+    if params['minify_assets']: css = minify_css(css)
+    compress = tuple(params['compress_assets'])
+    return dict(
+        CSS = publish_asset(name = project_name, ext = 'css', text = css, compress = compress),
+        PLOTLYJS = publish_plotlyjs(compress = compress)
+    )
+
+
+@instrument
+def publish_panels(divs: dict, project_name = 'roadtrips', params = params) -> tuple:
+    """For the lazy_panels mode: moves each panel's figure out of the page into content-hashed
+    json assets, so the page's size and first paint no longer depend on how much data the panels
+    carry.  Each panel's slot gets an empty placeholder div that lazy_loader draws once it scrolls
+    near the viewport.  Traces with a 'group∆part' uid (e.g. the proximity panel's months) are
+    grouped, and each group with no trace visible at first is written to its own asset and left
+    as stub traces in the figure, to be fetched when a slider step first shows it.
+
+    Input:  divs = dict of div strs keyed by panel id, as returned by load_divs()
+            params = determines which pre-compressed variants are written with each asset
+    Output: placeholders = dict of placeholder divs keyed by panel id, for the template slots
+            assets = dict of hashed json (and loader) file names, keyed like publish_assets()
+    """
+    compress = tuple(params['compress_assets'])
+    placeholders, assets = dict(), dict()
+    for iter_name, iter_div in divs.items():
+        parts = split_div(iter_div)
+        data = parts['data']
+
+        ## defer each group of traces that starts out hidden
+        groups = dict()
+        for iter_row, iter_trace in enumerate(data):
+            if '∆' in str(iter_trace.get('uid', '')):
+                groups.setdefault(iter_trace['uid'].split('∆')[0], list()).append(iter_row)
+        deferred = dict()
+        for iter_group, iter_rows in groups.items():
+            if any(data[i].get('visible', True) is not False for i in iter_rows): continue
+            key = iter_name + '_' + re.sub(r'[^0-9A-Za-z]+', '_', iter_group).strip('_')
+            assets[key] = publish_asset(
+                name = key.replace('_', '-', 1), ext = 'json', compress = compress,
+                text = json.dumps([data[i] for i in iter_rows], separators = (',', ':')))
+            deferred[assets[key]] = iter_rows
+            for iter_row in iter_rows:
+                data[iter_row] = dict(
+                    type = data[iter_row].get('type', 'scatter'), uid = data[iter_row]['uid'],
+                    visible = False)
+
+        figure = dict(
+            data = data, layout = parts['layout'], config = parts['config'], groups = deferred)
+        assets[iter_name + '_JSON'] = publish_asset(
+            name = iter_name, ext = 'json', compress = compress,
+            text = json.dumps(figure, separators = (',', ':')))
+        hook = '' if not parts['post_script'] else ''.join([
+            '<script type="text/javascript">(window.lazyPanelHooks = window.lazyPanelHooks || {})',
+            '["', parts['id'], '"] = function () {\n', parts['post_script'], '\n};</script>'])
+        placeholders[iter_name] = ''.join([
+            '<div><div id="', parts['id'], '" class="plotly-graph-div" style="', parts['style'],
+            '" data-figure="', assets[iter_name + '_JSON'], '"></div>', hook, '</div>'])
+
+    ## the loader is deferred, so it runs once every placeholder and hook is in the page
+    assets['LOADER'] = publish_asset(
+        name = project_name + '-panels', ext = 'js', text = lazy_loader, compress = compress)
+    remove_stale_groups(directory = render_params['asset_dir'], assets = assets)
+    first = next(iter(placeholders), None)
+    if first is not None:
+        placeholders[first] = ''.join([
+            '<script src="', assets['LOADER'], '" defer></script>', placeholders[first]])
+    return placeholders, assets
+
+
+def classify_panels(panels: dict, classes = params['panel_classes']) -> dict:
+    """Sets the css class of each panel's outer div, tying it into the dashboard's css style
+    sheet.  Each panel takes the place of its template slot, so its outer div is the dashboard
+    box itself.
+
+    Input:  panels = dict of div strs (or lazy placeholders) keyed by panel id
+            classes = dict of css div classes keyed by panel id
+    Output: panels = dict of div strs, each outer <div> given its panel's class
+    """
+    return {
+        i: panels[i].replace('<div>', f'<div class="{classes[i]}">', 1) for i in panels}
+
+
+def remove_stale_groups(directory: str, assets: dict) -> None:
+    """Removes trace group assets (e.g. PROXIMITY-01_Jan_Mid.{hash}.json) that the current
+    build no longer defers, such as the month now shown first.  publish_asset() only replaces
+    older versions of assets that are still published, so these would otherwise linger.
+
+    Input:  directory = io_out, or the portfolio directory export_outputs() copies to
+            assets = dict of hashed file names, as returned by publish_panels()
+    """
+    current = [i.split('.')[0] for i in assets.values()]
+    panels = tuple(i[0:-len('_JSON')] + '-' for i in assets.keys() if i.endswith('_JSON'))
+    for iter_file in os.listdir(directory):
+        if iter_file.startswith(panels) and iter_file.split('.')[0] not in current:
+            os.remove(os.path.join(directory, iter_file))
+    return None
 
-def inject_div(id: str, html_str: str, div_class: str) -> str:
-    """Plotly interactive figures can output as html divs.  Function reads in Plotly figures
-    contained in divs and injects them into the main html file.  Functional also modifies the
-    class and id attributes, tying the divs into the dashboard's css style sheet.
 
-    Input:  id: indicates the div's file name and also which <insert> tag to replace with the
-                Plotly figure's code.
-            html_str: an html file with <insert> tags indicating slots for plotly divs
-            div_class: str indicating the css div class to be used for that figure.  Primary
-                        specifies height / width.
-    Output: html_str: the html data dashboard, now with Plotly figures
+@instrument
+def render_template(template: list, values: dict, file_address: str) -> str:
+    """Fills in a compiled template in a single linear pass, streaming each chunk to disk rather
+    than building the (~1 MB) page as one str.  The chunks go to a temporary file that then
+    replaces the destination, so the page is never seen half-written.
+
+    Input:  template = output of compile_template()
+            values = dict of strs keyed by <insert> slot name (statistics, asset file names, divs)
+            file_address = where to write the rendered html
+    Output: file_address, for convenience
+    """
+    missing = set(template[1::2]).difference(values.keys())
+    if missing:
+        raise KeyError('No value supplied for template slots: ' + ', '.join(sorted(missing)))
+    chunks = (values[j] if i % 2 else j for i, j in enumerate(template))
+    write_chunks(file_address + '.tmp', chunks)
+    os.replace(file_address + '.tmp', file_address)
+    return file_address
+
+
+@instrument
+def measure_outputs(divs: dict, file_address: str, assets = dict(),
+                    report = os.path.join('io_out', 'size_report.json')) -> dict:
+    """Measures what a visitor downloads: each panel div, the rendered page, and the static assets
+    it links to.  Prints a table with the change since the last build and writes size_report.json.
+
+    Input:  divs = dict of div strs keyed by panel id, as returned by load_divs()
+            file_address = the rendered html page
+            assets = dict of hashed asset file names, as returned by publish_assets()
+            report = where to write the measurements
+    Output: sizes = dict of measures (bytes, gzip, brotli, and for panels traces and points)
+                keyed by item: each panel id, PAGE, each asset, and TOTAL (page plus assets)
     """
-    find_string = f'<div class="{div_class}"><insert>{id}</insert></div>'
-    replace_string = '\n'.join(open(f'io_mid/{id}.div', 'rt').readlines())
-    html_str = html_str.replace(find_string, replace_string)
-    html_str = html_str.replace('<div>', f'<div class="{div_class}">')
-    return html_str
+    sizes = {i: measure_div(divs[i]) for i in divs.keys()}
+    with open(file_address, 'rb') as f: page = f.read()
+    sizes['PAGE'] = dict(bytes = len(page), **compressed_sizes(page))
+
+    ## assets are already written with their pre-compressed variants, when those are enabled
+    for iter_name, iter_asset in assets.items():
+        with open(os.path.join('io_out', iter_asset), 'rb') as f: data = f.read()
+        sizes[iter_name] = dict(bytes = len(data), **compressed_sizes(data))
+        for iter_key, iter_ext in [('gzip', '.gz'), ('brotli', '.br')]:
+            if os.path.exists(os.path.join('io_out', iter_asset + iter_ext)):
+                sizes[iter_name][iter_key] = os.path.getsize(
+                    os.path.join('io_out', iter_asset + iter_ext))
+    sizes['TOTAL'] = {
+        i: sum(sizes[j][i] for j in ['PAGE'] + list(assets.keys()))
+        if all(sizes[j][i] is not None for j in ['PAGE'] + list(assets.keys())) else None
+        for i in ['bytes', 'gzip', 'brotli']}
+
+    ## report, with the change in raw bytes since the previous build
+    previous = json.loads(read_text(report)) if os.path.exists(report) else dict()
+    width = max([10] + [len(i) + 1 for i in sizes.keys()])
+    print('{0:<{7}}{1:>11}{2:>11}{3:>11}{4:>11}{5:>8}{6:>9}'.format(
+        'item', 'bytes', 'change', 'gzip', 'brotli', 'traces', 'points', width))
+    for iter_name, iter_size in sizes.items():
+        change = iter_size['bytes'] - previous.get(iter_name, iter_size)['bytes']
+        print('{0:<{7}}{1:>11,}{2:>+11,}{3:>11}{4:>11}{5:>8}{6:>9}'.format(
+            iter_name, iter_size['bytes'], change,
+            *[format(iter_size[i], ',') if iter_size.get(i) is not None else '-'
+              for i in ['gzip', 'brotli', 'traces', 'points']], width))
+    write_text(report, json.dumps(sizes, indent = 1))
+    return sizes
+
+
+@instrument
+def check_budget(sizes: dict, budget = params['budget']) -> dict:
+    """Fails the build when any measured output is over budget, so page weight cannot grow
+    unnoticed.
+
+    Input:  sizes = output of measure_outputs()
+            budget = dict of limits keyed by item, then measure (e.g. PAGE -> gzip)
+    Output: sizes, unchanged, when everything is within budget
+    """
+    over = [
+        f'{i} {j} = {sizes[i][j]:,} > {budget[i][j]:,}'
+        for i in budget.keys() for j in budget[i].keys()
+        if (sizes.get(i, dict()).get(j) is not None) and (sizes[i][j] > budget[i][j])]
+    if over: raise RuntimeError('Output size budget exceeded: ' + '; '.join(over))
+    return sizes
 
 
-def export_outputs(html_str: str, project_name = 'roadtrips') -> str:
-    """Writes html file to disk, and then copies the html, css, png files to the portfolio
-    project directory.  This directory holds all of the files used to create the github.io
-    website, which showcases this project among others.
+@instrument
+def export_outputs(project_name = 'roadtrips', assets = dict()) -> str:
+    """Copies the html, png, and static asset files to the portfolio project directory.  This
+    directory holds all of the files used to create the github.io website, which showcases this
+    project among others.
 
     Files:
-        html: The html webpage that displays the data dashboard for this project.
-        css:  The css style sheet supporting the html file.
+        html: The html webpage that displays the data dashboard for this project.  Already
+                rendered to io_out by render_template().
         png:  A static preview file that represents this project on the github.io project
                 portfolio page.  This png must be created manually.  The project does not create
                 it.
+        assets: The content-hashed css and plotly.js files from publish_assets(), plus any
+                pre-compressed variants of them.  Older versions of each asset are removed from
+                the portfolio directory, as publish_asset() does for io_out, and so are trace
+                group assets that are no longer published (see remove_stale_groups()).
+    Output: the io_out address of the html file
     """
-    open('io_out/{0}.html'.format(project_name), 'wt').writelines(html_str)
-    shutil.copyfile('io_in/{0}.css'.format(project_name), 'io_out/{0}.css'.format(project_name))
     shutil.copyfile('io_in/{0}.png'.format(project_name), 'io_out/{0}.png'.format(project_name))
-    for iter_ext in ['html', 'png', 'css']:
+    for iter_ext in ['html', 'png']:
         shutil.copyfile(
             f'io_out/{project_name}.{iter_ext}', f'../portfolio/p/{project_name}.{iter_ext}')
-    return html_str
+    for iter_asset in assets.values():
+        remove_stale_assets(file_name = iter_asset, directory = '../portfolio/p')
+        for iter_ext in ['', '.gz', '.br']:
+            if not os.path.exists(f'io_out/{iter_asset}{iter_ext}'): continue
+            shutil.copyfile(
+                f'io_out/{iter_asset}{iter_ext}', f'../portfolio/p/{iter_asset}{iter_ext}')
+    remove_stale_groups(directory = '../portfolio/p', assets = assets)
+    return 'io_out/{0}.html'.format(project_name)
+
 
 ##########==========##########==========##########==========##########==========##########==========
 ## DEFINE TOP-LEVEL FUNCTIONS
 
 
-def regenerate_dashboard_components(params = params):
+@instrument
+def regenerate_dashboard_components(params = params, pool = None):
     """ Function regenerates the data and files that functions in this module use to construct
-    the data databoard
+    the data databoard.  a4_build skips any component whose inputs, code, and arguments are
+    unchanged since it was last built.
     Inputs: params = determines which components to generate
     Results:
         download_weather_data = downloads data from NOAA to the io_mid/weather_data directory
             and then calculates summary statistics to io_mid/weather_data.xlsx
         regenerate_divs = generates div-formatted Plotly figures used to construct the databoard
+        debug_html = also writes an io_mid/*.html debug page for each figure
+        force_rebuild = rebuilds the selected components even if they are up to date
+        parallel_build = builds independent components concurrently in a process pool
+    pool = optional running process pool to build in, rather than starting one
+    Output: divs = dict of div strs keyed by panel id, for the panels that were rebuilt
+    """
+    panels = ['PROGRESS', 'PROXIMITY', 'MAP', 'OCONUS']
+    targets = list()
+    if params['download_weather_data']: targets += ['WEATHER']
+    if params['regenerate_divs']: targets += panels
+    print('Regenerating stale components...')
+    divs = build_targets(
+        names = targets,
+        kwargs = {i: dict(debug_html = params['debug_html']) for i in panels},
+        force = params['force_rebuild'],
+        parallel = params['parallel_build'],
+        pool = pool
+        )
+    print('...Done')
+    return {i: divs[i] for i in divs.keys() if i in panels}
+
+
+@instrument
+def construct_roadtrip_dashboard(divs = dict(), project_name = 'roadtrips', params = params):
+    """Top-level executable function.  Renders an html web page with interactive plotly figures.
+    Input: divs = dict of div strs keyed by panel id, as returned by
+        regenerate_dashboard_components().  Panels missing from it are read from io_mid.
+        params = determines whether output sizes are measured and checked against the budget,
+            and whether the outputs are exported to ../portfolio
+    Output: the io_out address of the rendered html file
     """
-    if params['download_weather_data']:
-        print('Downloading weather data...')
-        download_weather_data()
-        print('...Done')
-    if params['regenerate_divs']:
-        print('Regenerating div files...')
-        draw_progress_panel()
-        draw_proximity_panel()
-        draw_map_panel()
-        draw_oconus_panel()
-        print('...Done')
-    return None
-
-
-def construct_roadtrip_dashboard():
-    """Top-level executable function.  Renders an html web page with interactive plotly figures"""
-
-    ## import html file with empty divs to be filled in with figures plus explainatory text
-    html_str = import_html()
-
-    ## inject statistics into the explainatory text to match the latest data
-    html_str = fill_in_statistics(html_str = html_str)
-
-    ## inject plotly figures into the empty divs, so that web page renders an interactive dashboard
-    html_str = inject_div(id = 'PROGRESS',  html_str = html_str, div_class = 'progress_panel' )
-    html_str = inject_div(id = 'MAP',       html_str = html_str, div_class = 'main_panel'  )
-    html_str = inject_div(id = 'OCONUS',    html_str = html_str, div_class = 'oconus_panel')
-    html_str = inject_div(id = 'PROXIMITY', html_str = html_str, div_class = 'bottom_panel')
 
-    ## export html file, which now has plotly figures and statistics
-    return export_outputs(html_str = html_str)
+    ## tokenize the html file with empty divs to be filled in with figures plus explainatory text
+    template = compile_template(os.path.join('io_in', f'{project_name}.html'))
+
+    ## gather every slot value: statistics, shared static assets, and plotly figure divs
+    values = calculate_statistics()
+    assets = publish_assets(project_name = project_name)
+    values.update(assets)
+    divs = load_divs(divs = divs)
+    if params['lazy_panels']:
+        placeholders, panel_assets = publish_panels(divs = divs, project_name = project_name)
+        values.update(classify_panels(placeholders))
+        assets.update(panel_assets)
+    else: values.update(classify_panels(divs))
+
+    ## render the html file in one pass, which now has plotly figures and statistics
+    file_address = render_template(template = template, values = values,
+        file_address = os.path.join('io_out', f'{project_name}.html'))
+
+    ## measure page weight and stop before exporting if it is over budget, then export
+    if params['measure_outputs']:
+        check_budget(measure_outputs(divs = divs, file_address = file_address, assets = assets))
+    if not params['export_outputs']: return file_address
+    return export_outputs(project_name = project_name, assets = assets)
+
+
+def snapshot_files(directory: str, suffix = '') -> dict:
+    """Modification time and size of each file in a directory, for change detection by polling."""
+    with os.scandir(directory) as entries:
+        return {
+            i.path: (i.stat().st_mtime_ns, i.stat().st_size) for i in entries
+            if i.is_file() and i.name.endswith(suffix) and not i.name.startswith(('~$', '.'))}
+
+
+def watch_dashboard(project_name = 'roadtrips', params = params) -> None:
+    """Watch mode: rebuilds the dashboard whenever a file in params['watch_dir'] changes, until
+    interrupted.  This process, and with parallel_build its process pool, stay alive between
+    rebuilds, so imports, memoized spreadsheets, and the cached spatial indexes stay warm.  The
+    panel divs are kept in memory, so a rebuild only re-renders the panels a4_build finds stale
+    (e.g. editing Travels.kml rebuilds just MAP).  A rebuild that fails is reported and the last
+    good page is left in place.  Stops if any of the project's .py files change, since the
+    running processes would still use the old code.
+
+    Input:  params = as for a normal run, except that rebuilds are not measured or exported
+    """
+    watch = dict(params, measure_outputs = False, export_outputs = False)
+    code, seen, divs = snapshot_files('.', '.py'), None, dict()
+    pool = start_pool() if params['parallel_build'] and (os.cpu_count() or 1) > 1 else None
+    print('Watching', params['watch_dir'], '(Ctrl+C to stop)...')
+    try:
+        while True:
+            if snapshot_files('.', '.py') != code:
+                print('Code changed; restart watch mode to load it')
+                return None
+            files = snapshot_files(params['watch_dir'])
+            if files == seen:
+                time.sleep(params['watch_interval'])
+                continue
+            time.sleep(params['watch_settle'])
+            if snapshot_files(params['watch_dir']) != files: continue
+
+            ## rebuild, keeping every panel's latest div in memory for the next round
+            started = time.time()
+            try:
+                divs = load_divs(divs = {
+                    **divs, **regenerate_dashboard_components(params = watch, pool = pool)})
+                construct_roadtrip_dashboard(
+                    divs = divs, project_name = project_name, params = watch)
+                print('Rebuilt in {0:.2f}s'.format(time.time() - started))
+                write_report(extra = dict(params = watch))
+            except Exception as except_msg:
+                divs = dict()   # a partly failed build may have rewritten some io_mid divs
+                print('REBUILD FAILED:', type(except_msg).__name__, except_msg)
+            del records[:]
+            seen = files
+    except KeyboardInterrupt: return None
+    finally:
+        if pool is not None: pool.shutdown(cancel_futures = True)
 
 
 ##########==========##########==========##########==========##########==========##########==========
 ## TEST CODE
 
 
-if __name__ == '__main__':
-    regenerate_dashboard_components()
-    html_str = construct_roadtrip_dashboard()
+if __name__ == '__main__' and sys.argv[1:2] == ['watch']:
+    watch_dashboard()
+elif __name__ == '__main__':
+    divs = regenerate_dashboard_components()
+    dashboard = construct_roadtrip_dashboard(divs = divs)
+    write_report(extra = dict(params = params))
 
 
 ##########==========##########==========##########==========##########==========##########==========
\ No newline at end of file
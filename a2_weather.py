@@ -1,34 +1,109 @@
 """
     Purpose: Download NOAA weather data and compile it into information on the best time to visit
         each destination.
+        Each destination is assigned the nearest weather station in NOAA's hourly normals
+        inventory that reports temperature normals, unless the Cities sheet names one in its
+        noaa_station column.  Candidates for every destination come from one bulk query on a
+        BallTree over the stations (a6_spatial), and each station is downloaded once however many
+        destinations share it.
+        Destinations left without station data (no qualifying station, a failed download, or a
+        blank noaa_station) get an inverse-distance-weighted average of the nearest stations that
+        do have data, with an uncertainty estimate, so every destination has a weather row.
     Inputs:
         io_in/city_list.xlsx: provides information on the destinations I seek to visit and my
             progress visiting them.
+        io_in/hly_inventory_{15,30}yr.txt: optional local copy of the fixed-width station
+            inventory for the normals being downloaded (see params['thirty_year_normals']).  When
+            it is missing, the inventory is downloaded to io_mid instead.
         www.ncei.noaa.gov: code downloads weather data from this site and stores it in
             io_mid/weather_data
     Outputs:
         io_mid/weather_data.xlsx: records the average number of temperate hours per day in each
-            destination for periods throughout the year.
+            destination for periods throughout the year.  Its Stations sheet records which
+            station each destination was assigned, and how far away it is.  Its Destinations
+            sheet holds each destination's own weather (interpolated where needed), the
+            uncertainty of that estimate, and where it came from.  The Comfort and Comfort
+            Destinations sheets hold the same for comfortable hours, which also account for
+            heat index, wind chill, humidity, and cloud cover.
     Open GitHub Issues:
-        #27 recheck weather station assignment cities missing a station. (Low Priority)
+        # None.  This file is good to go.
 """
 ##########==========##########==========##########==========##########==========##########==========
 ## INITIALIZE
 
 ## import packages
-import os, multiprocessing, sys
+import os, io, gzip, lzma, shutil, queue, multiprocessing, sys
+from concurrent.futures import ThreadPoolExecutor
 from urllib import request
 if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')  
 import pandas as pd
 import numpy as np
+try: import pyarrow, pyarrow.csv
+except ImportError: pyarrow = None
+try: import zstandard
+except ImportError: zstandard = None
+from a3_render import read_sheet
+from a5_instrument import instrument
+from a6_spatial import build_index, query_knn
+from a7_cache import lookup, commit, forget
 
 ## set parameters
 params = dict(
     parallel_workers = 4,
+    ingest_threads = os.cpu_count() or 1,   # station files parsed at once by refine_weather_data()
+
+    ## raw station files: compressed as written; files in any of these formats are read
+    raw_dir = os.path.join('io_mid', 'weather_data'),
+    raw_compression = 'zstd' if zstandard is not None else 'gzip',
+    raw_levels = dict(zstd = 3, gzip = 6, lzma = 6),
+    raw_extensions = dict(zstd = '.csv.zst', gzip = '.csv.gz', lzma = '.csv.xz', plain = '.csv'),
+
+    ## download pipeline: each station is reduced to its period-wise scores as soon as it arrives
+    pipeline = True,            # False downloads every station first, then reads them all back
+    pipeline_queue = 16,        # downloaded stations held in memory, waiting for a reducer
+    reduce_workers = os.cpu_count() or 1,
+    keep_raw = True,            # also store each download in the raw cache
+    ideal_temp = [50, 75],      # see refine_weather_data()
+    active_hours = [8, 17],
     months = [
         '01_Jan', '02_Feb', '03_Mar', '04_Apr', '05_May', '06_Jun', '07_Jul', '08_Aug',
-        '09_Sep', '10_Oct', '11_Nov', '12_Dec']
+        '09_Sep', '10_Oct', '11_Nov', '12_Dec'],
+
+    ## which normals to download (see rwe_worker()); stations are picked from the same normals'
+    ## inventory, since the two periods do not cover the same stations
+    thirty_year_normals = False,
+    normals = {  # thirty_year_normals: (period, station inventory file)
+        True: ('1991-2020', 'hly_inventory_30yr.txt'),
+        False: ('2006-2020', 'hly_inventory_15yr.txt')},
+    normals_url = 'https://www.ncei.noaa.gov/data/normals-hourly/{0}/',
+
+    ## station assignment
+    inventory_dirs = ['io_in', 'io_mid'],  # a local copy is read first; downloads go to io_mid
+    inventory_columns = dict(  # [start, end) character positions of each fixed-width field
+        station = (0, 11), lat = (12, 20), lon = (21, 30), elevation = (31, 37),
+        state = (38, 40), name = (41, 71)),
+    station_candidates = 5,     # nearest stations tried per destination
+    min_valid_share = 0.9,      # share of hours a station must report a temperature normal for
+    keep_manual = True,         # a station named in the Cities sheet wins over the nearest one
+
+    ## interpolation, for destinations without station data
+    idw_neighbors = 4,          # stations averaged per destination
+    idw_power = 2,              # weights fall off as 1 / miles**power
+    idw_min_miles = 1.0,        # distances are floored here, so a co-located station cannot
+                                # take an infinite weight
+
+    ## comfort index: hourly normals read besides temperature, where a station reports them
+    comfort_columns = dict(
+        dewpoint = 'HLY-DEWP-NORMAL', heat_index = 'HLY-HIDX-NORMAL',
+        wind_chill = 'HLY-WCHL-NORMAL', wind_speed = 'HLY-WIND-AVGSPD',
+        overcast = 'HLY-CLOD-PCTOVC'),
+    max_dewpoint = 65,          # °F; muggier hours are not comfortable
+    max_overcast = 75,          # % of years overcast at that hour; gloomier hours do not count
+    mid_month = [7, 23],        # days of the month averaged into each period
+    metric_sheets = dict(       # weather_data.xlsx sheets of each metric: stations, destinations
+        temperate = [0, 'Destinations'], comfort = ['Comfort', 'Comfort Destinations']),
 )
+reduced_cache = dict()   # (station, reduce_settings()): pipeline output, see reduce_station()
 os.environ['no_proxy']='*'
 
 
@@ -45,17 +120,149 @@ def split_list(the_list: list, splits = params['parallel_workers']) -> dict:
     return split_index
 
 
+def raw_file(station: str, data_dir=params['raw_dir'], source_url=None, params=params):
+    """ Address of a station's raw data file, in whichever format it was stored, or None if the
+    station has not been downloaded (or its file failed the a7_cache checks and was deleted).
+    Files are cached against the URL they were downloaded from (source_url, by default
+    station_url()), so a file of the other normals period is a miss rather than a hit.
+    """
+    source_url = source_url or station_url(station, params = params)
+    for iter_extension in params['raw_extensions'].values():
+        file_address = lookup(
+            os.path.join(data_dir, station + iter_extension), inputs = source_url,
+            adopt = complete_raw_file, producer = 'a2_weather.write_raw')
+        if file_address is not None: return file_address
+    return None
+
+
+def complete_raw_file(file_address: str) -> bool:
+    """ Checks a raw data file written before the cache manifest existed: it must decompress and
+    parse, and run through December.
+    """
+    try:
+        with open_raw(file_address) as f: months = pd.read_csv(
+            f, usecols = ['month'], encoding_errors = 'replace')['month']
+    except (ValueError, EOFError, OSError): return False
+    return bool(months.shape[0]) and str(months.iloc[-1]).strip() == '12'
+
+
+def open_raw(file_address: str):
+    """ Opens a raw data file as a binary stream, decompressing as it is read, so callers never
+    hold the whole decompressed file in memory.
+    """
+    if file_address.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Reading ' + file_address + ' needs zstandard: pip install zstandard')
+        return zstandard.ZstdDecompressor().stream_reader(open(file_address, 'rb'), closefd = True)
+    if file_address.endswith('.gz'): return gzip.open(file_address, 'rb')
+    if file_address.endswith('.xz'): return lzma.open(file_address, 'rb')
+    return open(file_address, 'rb')
+
+
+def write_raw(station: str, source, data_dir=params['raw_dir'], source_url=None,
+              params=params) -> str:
+    """ Streams a station's raw data from a binary file-like source (e.g. an HTTP response) into
+    the raw cache, compressed per params['raw_compression'].  Writes go through a temporary file
+    that a7_cache commits only once complete, so an interrupted download never leaves a partial
+    file behind.  source_url = where the data came from; see raw_file()
+    Output: file_address of the written file
+    """
+    source_url = source_url or station_url(station, params = params)
+    method = params['raw_compression'] or 'plain'
+    file_address = os.path.join(data_dir, station + params['raw_extensions'][method])
+    temporary = file_address + '.' + str(os.getpid()) + '.tmp'
+    try:
+        if method == 'zstd':
+            compressor = zstandard.ZstdCompressor(level = params['raw_levels']['zstd'])
+            with open(temporary, 'wb') as f: compressor.copy_stream(source, f)
+        else:
+            writers = dict(
+                gzip = lambda x: gzip.open(x, 'wb', compresslevel = params['raw_levels']['gzip']),
+                lzma = lambda x: lzma.open(x, 'wb', preset = params['raw_levels']['lzma']),
+                plain = lambda x: open(x, 'wb'))
+            with writers[method](temporary) as f: shutil.copyfileobj(source, f)
+        commit(temporary, file_address, producer = 'a2_weather.write_raw', inputs = source_url)
+    finally:
+        if os.path.exists(temporary): os.remove(temporary)
+    return file_address
+
+
+def compact_raw_file(station: str, data_dir=params['raw_dir'], params=params) -> None:
+    """ Rewrites a plain-text raw file in the compressed format, dropping the blank lines that
+    older downloads put between every row.
+    """
+    file_address = os.path.join(data_dir, station + params['raw_extensions']['plain'])
+    if (params['raw_compression'] is None) or not os.path.exists(file_address): return None
+    if lookup(file_address, inputs = station_url(station, params = params),
+            adopt = complete_raw_file, producer = 'a2_weather.write_raw') is None: return None
+    with open(file_address, 'rb') as f:
+        lines = io.BytesIO(b''.join(i for i in f if i.strip()))
+    write_raw(station, lines, data_dir = data_dir)
+    forget(file_address)
+    return None
+
+
 ##########==========##########==========##########==========##########==========##########==========
 ## COMPONENT FUNCTIONS - download raw data
 
 
-def import_weather_stations() -> list:
-    """Import city data and extract weather station list from it"""
-    weather_stations = pd.read_excel('io_in/city_list.xlsx', sheet_name= 'Cities')
-    return sorted(weather_stations['noaa_station'].dropna().to_list())
+@instrument
+def read_station_inventory(params=params) -> pd.DataFrame:
+    """ Parses NOAA's fixed-width hourly normals station inventory for the normals that
+    params['thirty_year_normals'] selects, downloading it first if no local copy exists.  The
+    downloaded copy is an a7_cache entry; the io_in copy is not.
+    Output: inventory = DataFrame of station, lat, lon, elevation, state, and name
+    """
+    period, file_name = params['normals'][params['thirty_year_normals']]
+    inventory_url = params['normals_url'].format(period) + 'doc/' + file_name
+    file_address = os.path.join(params['inventory_dirs'][0], file_name)
+    if not os.path.exists(file_address):
+        file_address = os.path.join(params['inventory_dirs'][-1], file_name)
+        if lookup(file_address, inputs = inventory_url, adopt = complete_inventory,
+                producer = 'a2_weather.read_station_inventory') is None:
+            request.urlretrieve(inventory_url, file_address + '.tmp')
+            commit(file_address + '.tmp', file_address,
+                producer = 'a2_weather.read_station_inventory', inputs = inventory_url)
+    inventory = pd.read_fwf(
+        file_address, header = None,
+        colspecs = list(params['inventory_columns'].values()),
+        names = list(params['inventory_columns'].keys()),
+        dtype = dict(station = str, state = str, name = str))
+    return inventory.dropna(subset = ['station', 'lat', 'lon']).reset_index(drop = True)
+
+
+def complete_inventory(file_address: str) -> bool:
+    """Checks a station inventory downloaded before the cache manifest existed for a last line."""
+    with open(file_address, 'rb') as f:
+        f.seek(max(0, os.path.getsize(file_address) - 1))
+        return f.read() == b'\n'
+
 
+def has_temperature_normals(station: str, params=params) -> bool:
+    """ Checks a downloaded station file for hourly temperature normals: the column must exist
+    and hold a plausible value for at least params['min_valid_share'] of hours.  Missing files
+    (e.g. failed downloads) do not count.
+    """
+    file_address = raw_file(station)
+    if file_address is None: return False
+    try:
+        with open_raw(file_address) as f: temps = pd.read_csv(
+            f, usecols = ['HLY-TEMP-NORMAL'], encoding_errors = 'replace')
+    except (ValueError, EOFError, OSError): return False
+    temps = pd.to_numeric(temps['HLY-TEMP-NORMAL'], errors = 'coerce')
+    return bool(temps.shape[0]) and temps.between(-80, 140).mean() >= params['min_valid_share']
+
+
+def station_url(station: str, thirty_year_normals=None, params=params) -> str:
+    """ Address of a station's hourly normals at NOAA; see rwe_worker() on which normals to use.
+    thirty_year_normals defaults to params['thirty_year_normals'].
+    """
+    if thirty_year_normals is None: thirty_year_normals = params['thirty_year_normals']
+    period = params['normals'][bool(thirty_year_normals)][0]
+    return params['normals_url'].format(period) + 'access/{0}.csv'.format(station)
 
-def rwe_worker(idx:list, weather_stations:list, thirty_year_normals=False) -> None:
+
+def rwe_worker(idx:list, weather_stations:list, thirty_year_normals=None) -> None:
     """ Iteratively retrieves data from a list of weather stations.  Designed to be instantiated
     multiple times in parallel in the retrieve_weather_data() function.
     Inputs:
@@ -67,34 +274,32 @@ def rwe_worker(idx:list, weather_stations:list, thirty_year_normals=False) -> No
             between 2006 and 2020.  Statistically, a 30-year average is considered more
             accurate than a 15-year average.  However, temperatures have been abnormally high in
             recent decades, so the 15-year average may be more useful for predicting future
-            trends.
+            trends.  Defaults to params['thirty_year_normals'], which also selects the station
+            inventory that assign_weather_stations() picks stations from.
         Outputs:
-            As rwe_worker() downloads data from the NOAA, it writes that data in csv format to
-            weather_data directory.  This prevents data from accumulating in RAM.  It also makes
-            it easier to start and stop download as needed, rather than having to start over each
-            time.  Before downloading a file, rwe_worker() checks to see if the file is already
-            in the weather_data directory and will move on without downloading if the file is 
-            present. rwe_worker() returns None when it finishes iterating through the download list.
-    """
-    data_dir = os.path.join('io_mid', 'weather_data')
-    source_url = 'https://www.ncei.noaa.gov/data/normals-hourly/2006-2020/access/{0}.csv'
-    if thirty_year_normals:
-        source_url = 'https://www.ncei.noaa.gov/data/normals-hourly/1991-2020/access/{0}.csv'
+            As rwe_worker() downloads data from the NOAA, it streams that data, compressed, to
+            the weather_data directory (see write_raw()).  This prevents data from accumulating
+            in RAM.  It also makes it easier to start and stop download as needed, rather than
+            having to start over each time.  Before downloading a file, rwe_worker() checks to
+            see if the station is already in the weather_data directory and will move on without
+            downloading if it is present. rwe_worker() returns None when it finishes iterating
+            through the download list.
+    """
     for iter_idx in idx:
-        source_url_iter = source_url.format(weather_stations[iter_idx])
-        dest_url_iter = os.path.join(data_dir, weather_stations[iter_idx] + '.csv')
-        if os.path.exists(dest_url_iter): continue
+        source_url_iter = station_url(weather_stations[iter_idx], thirty_year_normals)
+        if raw_file(weather_stations[iter_idx], source_url = source_url_iter) is not None:
+            continue
 
         try:
-            data_iter = request.urlretrieve(source_url_iter)[0]
-            data_iter = '\n'.join(open(data_iter, 'rt').readlines())
-        except Exception as except_msg:
+            with request.urlopen(source_url_iter) as response:
+                write_raw(weather_stations[iter_idx], response, source_url = source_url_iter)
+        except Exception:
             print('DOWNLOAD FAILED:', source_url_iter)
             continue
-        open(dest_url_iter, 'wt').writelines(data_iter)
     return None
 
 
+@instrument
 def retrieve_weather_data(weather_stations:list, params=params) -> None:
     """ Divides a list of weather stations among multiple lists, and then instantiates rwe_worker()
         multiple times in parallel to download data for each station.
@@ -105,9 +310,12 @@ def retrieve_weather_data(weather_stations:list, params=params) -> None:
                 versions of rwe_worker() should be instantiated.
         Outputs: returns None; rwe_worker() saves downloaded data to list.
     """
-    ## prepare for data transfer
-    data_dir = os.path.join('io_mid', 'weather_data')
+    ## prepare for data transfer; stations shared by several destinations are fetched once, and
+    ## stations already downloaded as plain text are compressed in place
+    data_dir = params['raw_dir']
     if not os.path.exists(data_dir): os.mkdir(data_dir)
+    weather_stations = sorted(set(weather_stations))
+    for iter_station in weather_stations: compact_raw_file(iter_station)
 
     ## divide stations among parallel workers
     station_idx = np.arange(0, len(weather_stations))
@@ -132,11 +340,368 @@ def retrieve_weather_data(weather_stations:list, params=params) -> None:
     return None
 
 
-def refine_weather_data(ideal_temp=[50,75], active_hours=[8,17]) -> None:
+@instrument
+def assign_weather_stations(params=params) -> pd.DataFrame:
+    """ Assigns every destination a weather station and downloads the stations' data.  A station
+    named in the Cities sheet's noaa_station column is kept (if params['keep_manual']); everyone
+    else gets the nearest inventory station with temperature normals.  The nearest
+    params['station_candidates'] stations for all destinations come from one bulk query, so
+    assignment is O(n log n).  Each round downloads the stations not yet on disk, each once, and
+    drops any without temperature normals, whose destinations then fall through to their next
+    candidate.  With params['pipeline'], stations are scored as they download (see
+    pipeline_weather_data()), so refine_weather_data() has little left to do.
+    Output: stations = DataFrame with one row per destination: city, station (None if no
+        candidate qualifies, or if the destination has no lat / lon and no manual station),
+        miles (to the station; blank when manual), and source
+    """
+    cities = pd.read_excel(os.path.join('io_in', 'city_list.xlsx'), sheet_name = 'Cities')
+    inventory = read_station_inventory()
+    manual = cities['noaa_station'].notna().to_numpy() & params['keep_manual']
+    rows = np.arange(0, cities.shape[0])
+
+    ## destinations without coordinates get no nearest station (BallTree rejects NaN)
+    located = cities[['lat', 'lon']].notna().all(axis = 1).to_numpy()
+    k = min(params['station_candidates'], inventory.shape[0])
+    miles = np.full((cities.shape[0], k), np.nan)
+    candidates = np.full((cities.shape[0], k), None, dtype = object)
+    if located.any():
+        miles[located], positions = query_knn(build_index(inventory), cities.loc[located], k = k)
+        candidates[located] = inventory['station'].to_numpy(dtype = object)[positions]
+
+    valid = dict()
+    while True:
+        usable = ~np.isin(candidates, [i for i in valid if not valid[i]]) & located[:, None]
+        choice = usable.argmax(axis = 1)
+        station = np.where(usable.any(axis = 1), candidates[rows, choice], None)
+        station = np.where(manual, cities['noaa_station'].to_numpy(dtype = object), station)
+        fetched = [i for i in station if i is not None]
+        if params['pipeline']: reduced = pipeline_weather_data(fetched)
+        else: retrieve_weather_data(weather_stations = fetched)
+        checks = [i for i in set(station[~manual]) if (i is not None) and (i not in valid)]
+        if params['pipeline']:
+            valid.update({i: (reduced[i] is not None) and reduced[i]['valid'] for i in checks})
+        else: valid.update({i: has_temperature_normals(i) for i in checks})
+        if all(valid[i] for i in checks): break
+
+    return pd.DataFrame(dict(
+        city = cities['city'],
+        station = station,
+        miles = np.where(manual | pd.isna(station), np.nan, miles[rows, choice]).round(1),
+        source = np.where(manual, 'manual', 'nearest'),
+        ))
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - comfort index
+
+
+def station_schema(params=params) -> dict:
+    """ The columns read from station files, as dict of NOAA column name: (name used here, numpy
+    dtype).  Measurements are float32 and calendar fields int8.
+    """
+    measures = dict(temp = 'HLY-TEMP-NORMAL', **params['comfort_columns'])
+    return dict(
+        LATITUDE = ('latitude', np.float32), LONGITUDE = ('longitude', np.float32),
+        month = ('month', np.int8), day = ('day', np.int8), hour = ('hour', np.int8),
+        **{j: (i, np.float32) for i, j in measures.items()})
+
+
+def read_station_file(source, types: dict) -> pd.DataFrame:
+    """ Reads one station file's columns with an explicit schema, skipping every other column.
+    Columns the file lacks come back blank.  Uses pyarrow's CSV reader when it is installed, and
+    pandas' when it is not, or when pyarrow rejects the file (e.g. for bytes that are not UTF-8).
+    Compressed files are decompressed as they are parsed (see open_raw()).
+    Inputs:
+        source = a raw data file, as found by raw_file(), or a downloaded file's bytes
+        types = dict of column name: numpy dtype, in the order wanted
+    """
+    open_raw_source = lambda: io.BytesIO(source) if isinstance(source, bytes) else open_raw(source)
+    if pyarrow is not None:
+        convert_options = pyarrow.csv.ConvertOptions(
+            column_types = {i: pyarrow.from_numpy_dtype(j) for i, j in types.items()},
+            include_columns = list(types), include_missing_columns = True)
+        try:
+            with open_raw_source() as f: return pyarrow.csv.read_csv(
+                f, read_options = pyarrow.csv.ReadOptions(use_threads = False),
+                convert_options = convert_options).to_pandas()
+        except pyarrow.ArrowInvalid: pass
+    with open_raw_source() as f: data = pd.read_csv(
+        f, encoding_errors = 'replace', usecols = lambda x: x in types, dtype = types)
+    return data.reindex(columns = list(types)).astype(types)
+
+
+def combine_station_data(stations: list, data: list, params=params) -> pd.DataFrame:
+    """ Stacks the read_station_file() frames of several stations into one columnar frame with a
+    dictionary-encoded (categorical) station column, taken from the station ids rather than
+    parsed.  Implausible measurements (NOAA's missing-value codes) are blanked.
+    Output: data = DataFrame of station, latitude, longitude, month, day, hour, temp, and the
+        keys of params['comfort_columns']
+    """
+    schema = station_schema()
+    categories = pd.Index(sorted(stations))
+    codes = np.repeat(categories.get_indexer(stations), [i.shape[0] for i in data])
+    data = pd.concat(data, ignore_index = True)
+    data.columns = [i[0] for i in schema.values()]
+    data.insert(0, 'station', pd.Categorical.from_codes(codes, categories = categories))
+    for iter_col in ['temp'] + list(params['comfort_columns']):
+        values = data[iter_col].to_numpy(dtype = np.float32)
+        data[iter_col] = np.where((values >= -150) & (values <= 200), values, np.nan)
+    return data
+
+
+@instrument
+def read_station_files(stations: list, files=None, params=params) -> pd.DataFrame:
+    """ Reads the downloaded hourly normals of each station into one columnar frame (see
+    combine_station_data()).  Files are parsed concurrently on params['ingest_threads'] threads;
+    both CSV readers release the GIL while parsing.  Comfort columns a station does not report
+    are blank.  files = optional dict of station: file address, for callers that have already
+    found the files with raw_file(); other stations are looked up here.
+    """
+    files = files or dict()
+    types = {i: j[1] for i, j in station_schema().items()}
+    with ThreadPoolExecutor(params['ingest_threads']) as pool:
+        data = list(pool.map(
+            lambda x: read_station_file(files.get(x) or raw_file(x), types), stations))
+    return combine_station_data(stations, data)
+
+
+def apparent_temperature(data: pd.DataFrame) -> np.ndarray:
+    """ Temperature as it feels (°F): the heat index above 80°F and the wind chill at or below
+    50°F with some wind, plain temperature otherwise.  Stations' own heat index and wind chill
+    normals are used where they exist; elsewhere they are computed from temperature, dew point,
+    and wind speed with the National Weather Service formulas.
+    """
+    temp = data['temp'].to_numpy(dtype = float)
+    dewpoint = data['dewpoint'].to_numpy(dtype = float)
+    wind = data['wind_speed'].to_numpy(dtype = float)
+
+    ## relative humidity from dew point (Magnus), then the Rothfusz heat index regression
+    celsius, dew_celsius = (temp - 32) / 1.8, (dewpoint - 32) / 1.8
+    humidity = 100 * np.exp(
+        17.625 * dew_celsius / (243.04 + dew_celsius) - 17.625 * celsius / (243.04 + celsius))
+    heat_index = (-42.379 + 2.04901523 * temp + 10.14333127 * humidity
+        - 0.22475541 * temp * humidity - 0.00683783 * temp**2 - 0.05481717 * humidity**2
+        + 0.00122874 * temp**2 * humidity + 0.00085282 * temp * humidity**2
+        - 0.00000199 * temp**2 * humidity**2)
+    heat_index = np.where(data['heat_index'].notna(), data['heat_index'], heat_index)
+    wind_chill = (35.74 + 0.6215 * temp - 35.75 * np.abs(wind)**0.16
+        + 0.4275 * temp * np.abs(wind)**0.16)
+    wind_chill = np.where(data['wind_chill'].notna(), data['wind_chill'], wind_chill)
+
+    apparent = temp.copy()
+    hot = (temp > 80) & ~np.isnan(heat_index)
+    apparent[hot] = np.maximum(heat_index[hot], temp[hot])
+    cold = (temp <= 50) & ~np.isnan(wind_chill) & (np.nan_to_num(wind, nan = 3) >= 3)
+    apparent[cold] = np.minimum(wind_chill[cold], temp[cold])
+    return apparent
+
+
+def comfort_hours(data: pd.DataFrame, ideal_temp: list, params=params) -> np.ndarray:
+    """ Flags the comfortable hours: apparent temperature within ideal_temp, dew point at or
+    below params['max_dewpoint'], and overcast skies at most params['max_overcast'] percent of
+    the time.  Measurements a station does not report do not disqualify an hour.
+    Output: comfortable = float array of 0 / 1, one per row of data
+    """
+    apparent = apparent_temperature(data)
+    comfortable = (apparent >= min(ideal_temp)) & (apparent <= max(ideal_temp))
+    comfortable &= ~(data['dewpoint'].to_numpy() > params['max_dewpoint'])
+    comfortable &= ~(data['overcast'].to_numpy() > params['max_overcast'])
+    return comfortable.astype(float)
+
+
+def average_by_period(data: pd.DataFrame, hourly: np.ndarray, active_hours: list,
+                      params=params) -> pd.DataFrame:
+    """ Sums an hourly 0 / 1 score over active_hours for each day, then averages the daily sums
+    over the params['mid_month'] days of each month, per station.  One pass of np.bincount over
+    station-month keys, so it costs the same whatever the number of scores.
+    Output: DataFrame with one row per station and one column per period (e.g. '01_Jan (Mid)')
+    """
+    day, hour = data['day'].to_numpy(), data['hour'].to_numpy()
+    keep = (day >= min(params['mid_month'])) & (day <= max(params['mid_month']))
+    keep &= (hour >= min(active_hours)) & (hour <= max(active_hours))
+    stations = data['station'].cat.categories
+    key = data['station'].cat.codes.to_numpy(dtype = np.int64)[keep] * 12
+    key += data['month'].to_numpy(dtype = np.int64)[keep] - 1
+    totals = np.bincount(key, weights = hourly[keep], minlength = stations.size * 12)
+    days = np.unique(key * 32 + day[keep].astype(np.int64)) // 32
+    days = np.bincount(days, minlength = stations.size * 12)
+    averages = (totals / np.where(days > 0, days, np.nan)).reshape(stations.size, 12)
+    rows, cols = ~np.isnan(averages).all(axis = 1), ~np.isnan(averages).all(axis = 0)
+    return pd.DataFrame(
+        averages[rows][:, cols],
+        index = pd.Index(stations[rows], name = 'station'),
+        columns = pd.Index([i + ' (Mid)' for i in params['months']], name = 'period')[cols])
+
+
+def score_stations(data: pd.DataFrame, ideal_temp: list, active_hours: list) -> tuple:
+    """ Scores each station-hour, then averages the scores into mid-month periods.  Temperate
+    hours count on temperature alone, comfortable hours on how it feels (see comfort_hours()).
+    Inputs:
+        data = output of combine_station_data()
+        ideal_temp, active_hours = see refine_weather_data()
+    Output: temperate, comfort = station-wise hours per day, one column per period; locations =
+        lat / lon of each station
+    """
+    locations = data.drop_duplicates('station').set_index('station')
+    locations = locations[['latitude', 'longitude']].rename(
+        columns = {'latitude': 'lat', 'longitude': 'lon'})
+    temp = data['temp'].to_numpy()
+    temperate = ((temp >= min(ideal_temp)) & (temp <= max(ideal_temp))).astype(float)
+    comfort = average_by_period(data, comfort_hours(data, ideal_temp), active_hours)
+    temperate = average_by_period(data, temperate, active_hours)
+    return temperate, comfort, locations
+
+
+def reduce_station(station: str, body: bytes, ideal_temp: list, active_hours: list,
+                   params=params) -> dict:
+    """ Reduces one downloaded station file to what refine_weather_data() needs from it, so the
+    file itself need not be kept or read again.
+    Output: reduced = dict of valid (see has_temperature_normals()) and the station's one-row
+        temperate, comfort, and locations frames (see score_stations())
+    """
+    types = {i: j[1] for i, j in station_schema().items()}
+    data = combine_station_data([station], [read_station_file(body, types)])
+    temperate, comfort, locations = score_stations(data, ideal_temp, active_hours)
+    temp = data['temp'].to_numpy()
+    valid = bool(temp.size) and (
+        ((temp >= -80) & (temp <= 140)).mean() >= params['min_valid_share'])
+    return dict(valid = valid, temperate = temperate, comfort = comfort, locations = locations)
+
+
+def reduce_settings(ideal_temp: list, active_hours: list, params=params) -> tuple:
+    """ The reduced_cache key for a set of scoring settings: everything reduce_station() and
+    score_stations() read, plus the normals period the stations came from, so changing any of it
+    (e.g. params['max_dewpoint']) re-reduces stations rather than reusing old scores.
+    """
+    return (
+        tuple(ideal_temp), tuple(active_hours), params['max_dewpoint'], params['max_overcast'],
+        tuple(params['mid_month']), params['min_valid_share'],
+        tuple(params['comfort_columns'].items()), tuple(params['months']),
+        params['normals'][params['thirty_year_normals']][0])
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - download pipeline
+
+
+@instrument
+def pipeline_weather_data(weather_stations: list, ideal_temp=params['ideal_temp'],
+                          active_hours=params['active_hours'], params=params) -> dict:
+    """ Downloads and reduces stations at the same time.  Download threads fetch each station
+    (or read it from the raw cache, if already there) and put its bytes on a bounded queue;
+    reducer threads take them off and reduce them to period-wise scores immediately (see
+    reduce_station()).  The network never waits on parsing and parsing never waits on the whole
+    download, so a full refresh takes about max(network, CPU) rather than their sum, and the
+    queue bound (params['pipeline_queue']) caps the memory held in flight.  Threads rather than
+    processes, as downloads wait on the network and both CSV readers release the GIL.  Results
+    are memoized in reduced_cache for refine_weather_data().
+    Inputs:
+        weather_stations = list of station ids; each is fetched once however often it appears
+        params['keep_raw'] = whether downloads are also written to the raw cache (write_raw())
+    Output: reduced = dict of station: output of reduce_station(), or None if the download
+        failed or the file could not be parsed
+    """
+    settings = reduce_settings(ideal_temp, active_hours)
+    stations = [i for i in sorted(set(weather_stations)) if (i, settings) not in reduced_cache]
+    bodies = queue.Queue(maxsize = params['pipeline_queue'])
+    if params['keep_raw'] and not os.path.exists(params['raw_dir']): os.mkdir(params['raw_dir'])
+
+    def produce(station):
+        file_address = raw_file(station)
+        try:
+            if file_address is not None:
+                with open_raw(file_address) as f: body = f.read()
+            else:
+                with request.urlopen(station_url(station)) as response: body = response.read()
+                if params['keep_raw']: write_raw(station, io.BytesIO(body))
+        except Exception:
+            print('DOWNLOAD FAILED:', station_url(station))
+            body = None
+        bodies.put((station, body))
+
+    def consume():
+        while True:
+            item = bodies.get()
+            if item is None: return
+            station, body = item
+            try: reduced = None if body is None else reduce_station(
+                station, body, ideal_temp, active_hours)
+            except Exception as except_msg:
+                print('REDUCE FAILED:', station, except_msg)
+                reduced = None
+            reduced_cache[(station, settings)] = reduced
+
+    with ThreadPoolExecutor(params['reduce_workers']) as reducers:
+        consumers = [reducers.submit(consume) for i in range(0, params['reduce_workers'])]
+        try:
+            with ThreadPoolExecutor(params['parallel_workers']) as producers:
+                list(producers.map(produce, stations))
+        finally:
+            for iter_consumer in consumers: bodies.put(None)
+        [i.result() for i in consumers]
+    return {i: reduced_cache[(i, settings)] for i in weather_stations}
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - compile
+
+
+@instrument
+def interpolate_weather(weather: pd.DataFrame, locations: pd.DataFrame, cities: pd.DataFrame,
+                        stations: pd.DataFrame, params=params) -> pd.DataFrame:
+    """ Gives every destination a period-wise weather row.  A destination whose assigned station
+    has data takes that station's row as-is.  The rest take an inverse-distance-weighted average
+    over the params['idw_neighbors'] nearest stations with data.  The neighbors for all
+    destinations come from one bulk k-NN query, and the averages from one batched weighted
+    product, so cost is linear in destinations.  Periods a neighbor lacks are left out of its
+    weights rather than counted as zero.
+    Inputs:
+        weather = station-wise hours per day, one column per period
+        locations = lat / lon of each station in weather, indexed by station
+        cities = destination-wise data with city, lat, lon columns
+        stations = station assignment, as passed to refine_weather_data()
+    Output: destinations = DataFrame indexed by city, with the period columns, uncertainty (the
+        weighted standard deviation among the neighbors, in hours per day, averaged over
+        periods; 0 for destinations with their own station data), and source ('station' or
+        'interpolated')
+    """
+    cities = cities.drop_duplicates('city').set_index('city')[['lat', 'lon']]
+    assigned = cities.index.map(stations.drop_duplicates('city').set_index('city')['station'])
+    direct = assigned.isin(weather.index)
+    destinations = weather.reindex(assigned)
+    destinations.index = cities.index
+    destinations['uncertainty'] = np.where(direct, 0.0, np.nan)
+    destinations['source'] = np.where(direct, 'station', None)
+
+    ## inverse-distance weights over each remaining destination's nearest stations
+    missing = ~direct & cities.notna().all(axis = 1).to_numpy()
+    if (not missing.any()) or (weather.shape[0] == 0): return destinations
+    miles, positions = query_knn(
+        build_index(locations), cities.loc[missing], k = params['idw_neighbors'])
+    neighbors = weather.to_numpy(dtype = float)[positions]                     # (n, k, periods)
+    weights = np.maximum(miles, params['idw_min_miles'])**-float(params['idw_power'])
+    weights = np.where(np.isnan(neighbors), 0.0, weights[:, :, None])
+    total = weights.sum(axis = 1)
+    weights = weights / np.where(total > 0, total, np.nan)[:, None, :]
+    neighbors = np.nan_to_num(neighbors)
+    estimate = np.einsum('nkp,nkp->np', weights, neighbors)
+    spread = np.einsum('nkp,nkp->np', weights, (neighbors - estimate[:, None, :])**2)
+
+    destinations.loc[missing, weather.columns] = estimate
+    destinations.loc[missing, 'uncertainty'] = np.sqrt(spread).mean(axis = 1)
+    destinations.loc[missing, 'source'] = 'interpolated'
+    return destinations
+
+
+@instrument
+def refine_weather_data(ideal_temp=params['ideal_temp'], active_hours=params['active_hours'],
+                        stations=None) -> None:
     """ reads in raw weather data files previously downloaded from NOAA. Simplifies and compiles
     data from them to determine the average number of temperate hours per day for each month. The
     averages are based on data from the 7th day of the month to the 23th day of the month, so they
-    better reflect mid-month conditions.
+    better reflect mid-month conditions.  Alongside, it counts comfortable hours: hours that feel
+    temperate once heat index and wind chill are accounted for, and are neither muggy nor
+    overcast (see comfort_hours()).
     Input:
         ideal_temp = A temperate hour is defined as having a temperature between those specified
             here.  Temperatures are in degrees Fahrenheit. By default, this range is 50°F to 75°F,
@@ -146,65 +711,101 @@ def refine_weather_data(ideal_temp=[50,75], active_hours=[8,17]) -> None:
             impact what temperature is actually comfortable.
         active_hours = Temperate hours are only counted for hours of the day that fall in this
             range. By default, this is 8am to 5pm.
+        stations = station assignment from assign_weather_stations().  When omitted, the Cities
+            sheet's noaa_station column is used as-is.
+        Stations already reduced by pipeline_weather_data() with the same settings are not read
+        again; the rest are read from the raw cache.
     Output:  Outputs a xlsx file to the io_mid directory, called weather_data.xlsx
     """
+    cities = pd.read_excel(os.path.join('io_in', 'city_list.xlsx'), sheet_name = 'Cities')
+    if stations is None:
+        stations = pd.DataFrame(dict(
+            city = cities['city'], station = cities['noaa_station'], miles = np.nan,
+            source = 'manual'))
+
+    ## score the assigned stations: those the download pipeline already reduced, plus the rest
+    ## read from the raw cache in one columnar pass
+    all_stations = sorted(set(stations['station'].dropna()))
+    settings = reduce_settings(ideal_temp, active_hours)
+    reduced = [reduced_cache.get((i, settings)) for i in all_stations]
+    reduced = {i: j for i, j in zip(all_stations, reduced) if j is not None}
+    files = {i: raw_file(i) for i in all_stations if i not in reduced}
+    files = {i: j for i, j in files.items() if j is not None}
+    scores = [[i['temperate'], i['comfort'], i['locations']] for i in reduced.values()]
+    if files:
+        scores.append(score_stations(
+            read_station_files(list(files), files = files), ideal_temp, active_hours))
+    if not scores:
+        raise RuntimeError('No weather data for any assigned station ({0} stations, e.g. {1}): '
+            'nothing was reduced and no raw file is in {2}.  Download them first (see '
+            'assign_weather_stations()).'.format(
+                len(all_stations), ', '.join(all_stations[0:5]) or 'none', params['raw_dir']))
+    all_data, comfort, locations = [
+        pd.concat(i).sort_index().sort_index(axis = 1) for i in zip(*scores)]
+    destinations = interpolate_weather(
+        all_data, locations.loc[all_data.index], cities = cities, stations = stations)
+    comfort_destinations = interpolate_weather(
+        comfort, locations.loc[comfort.index], cities = cities, stations = stations)
 
-    ## read in data files and compile
-    data_dir = os.path.join('io_mid', 'weather_data')
-    all_files = os.listdir(data_dir)
-    all_data = list()
-    cols = ['STATION', 'LATITUDE', 'LONGITUDE', 'NAME', 'month', 'day', 'hour', 'HLY-TEMP-NORMAL']
-    for iter in range(0, len(all_files)):
-        if not all_files[iter].endswith('csv'): continue
-        all_data.append(
-            pd.read_csv(
-                os.path.join(data_dir, all_files[iter]),
-                encoding_errors = 'replace',
-                usecols = cols
-                ))
-    all_data = pd.concat(all_data)
-    all_data.columns = all_data.columns.str.lower()
-
-    ## refine data
-    all_data['temp'] = (all_data['hly-temp-normal'] >= min(ideal_temp))
-    all_data['temp'] &= (all_data['hly-temp-normal'] <= max(ideal_temp))
-    all_data = all_data.astype({'temp': int})
-    all_data = all_data.drop(columns = ['hly-temp-normal'])
-    all_data = all_data.groupby(['station','latitude','longitude','name','month','day','hour'])
-    all_data = all_data.agg('mean').reset_index()
-    all_data = all_data.loc[
-        (all_data['hour'] >= min(active_hours)) & (all_data['hour'] <= max(active_hours))]
-    all_data = all_data.groupby(['station','latitude','longitude','name','month','day']).agg('sum')
-    all_data = all_data.drop(columns = ['hour']).reset_index()
-    
-    ## bin time - early, mid months
-    all_data['month'] = all_data['month'].replace({i:params['months'][i-1] for i in range(1, 13)})
-    day_bins = {i:'EXCLUDE' for i in range(0, 32)}
-    #day_bins.update({i:' (Early)' for i in range(1, 11)})
-    day_bins.update({i:' (Mid)' for i in range(7, 30-6)})
-    all_data['day'] = all_data['day'].replace(day_bins)
-    all_data['period'] = all_data['month'] + all_data['day']
-    all_data = all_data.loc[all_data['day'] != 'EXCLUDE', ~all_data.columns.isin(['day', 'month'])]
-    cols = all_data.columns[~all_data.columns.isin(['temp'])].to_list()
-    all_data = all_data.groupby(cols).agg('mean').reset_index()
-    all_data = all_data.pivot(index = 'station', columns = 'period', values = 'temp')
-
-    ## export as excell
-    all_data.to_excel(os.path.join('io_mid', 'weather_data.xlsx'))
+    ## export as excell, with the station assignment and per-destination weather alongside
+    with pd.ExcelWriter(os.path.join('io_mid', 'weather_data.xlsx')) as writer:
+        all_data.to_excel(writer)
+        stations.to_excel(writer, sheet_name = 'Stations', index = False)
+        destinations.to_excel(writer, sheet_name = 'Destinations')
+        comfort.to_excel(writer, sheet_name = 'Comfort')
+        comfort_destinations.to_excel(writer, sheet_name = 'Comfort Destinations')
     return None
 
 
+def station_weather(metric='temperate', params=params) -> pd.DataFrame:
+    """ The station-wise sheet of io_mid/weather_data.xlsx for a metric (see
+    params['metric_sheets']).  Workbooks written before the comfort index existed have no comfort
+    sheets; asking one for metric='comfort' raises an error saying to refine the weather again.
+    """
+    file_address = os.path.join('io_mid', 'weather_data.xlsx')
+    station_sheet = params['metric_sheets'][metric][0]
+    try: return read_sheet(file_address, sheet_name = station_sheet, index_col = 0)
+    except ValueError as except_msg:
+        raise ValueError('{0} has no {1!r} sheet for weather_metric {2!r}; it predates that '
+            'metric, so re-run a2_weather.refine_weather_data() (or download_weather_data()) '
+            'to rewrite it.'.format(file_address, station_sheet, metric)) from except_msg
+
+
+def destination_weather(city_list: pd.DataFrame, metric='temperate', params=params
+                        ) -> pd.DataFrame:
+    """ Each destination's period-wise weather, aligned to city_list's index: its row of the
+    Destinations sheet of io_mid/weather_data.xlsx.  Destinations added since the weather was
+    refined, and weather files written before interpolation existed, fall back to the row of the
+    Cities sheet's noaa_station, and are blank if that is missing too.
+    Inputs:
+        metric = 'temperate' (hours in the ideal temperature range) or 'comfort' (comfortable
+            hours); a key of params['metric_sheets']
+    Output: weather = DataFrame of the period columns, plus uncertainty and source
+    """
+    file_address = os.path.join('io_mid', 'weather_data.xlsx')
+    destination_sheet = params['metric_sheets'][metric][1]
+    weather = station_weather(metric, params = params)
+    weather = weather.reindex(city_list['noaa_station'])
+    weather.index = city_list.index
+    try: destinations = read_sheet(file_address, sheet_name = destination_sheet, index_col = 0)
+    except ValueError: destinations = pd.DataFrame(columns = ['uncertainty', 'source'])
+    destinations = destinations.reindex(city_list['city'])
+    destinations.index = city_list.index
+    columns = weather.columns.to_list() + ['uncertainty', 'source']
+    return destinations.combine_first(weather)[columns]
+
+
 ##########==========##########==========##########==========##########==========##########==========
 ## TOP-LEVEL FUNCTIONS
 
 
+@instrument
 def download_weather_data():
     """ Top-level function, loaded and invoked in 0_execute_project.py.  Sequentially executes the 
     other functions in this modules
     """
-    weather_stations = import_weather_stations()
-    retrieve_weather_data(weather_stations = weather_stations)
-    weather_data = refine_weather_data()
+    stations = assign_weather_stations()
+    weather_data = refine_weather_data(stations = stations)
     return weather_data
 
 
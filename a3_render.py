@@ -0,0 +1,349 @@
+"""
+    Purpose: Shared input-reading, rendering, and file-writing helpers for the panel modules
+        (b1_progress, b2_proximity, b3_map, b4_oconus).  Each panel renders its plotly figure to
+        an html div string in memory and hands that string straight to a1_execute_project.py,
+        rather than writing the div to disk and reading it back.
+        Spreadsheet reads are memoized per process, so each sheet is parsed once no matter how
+        many panels use it.
+        Figures are serialized from a plain-dict spec rather than through go.Figure.to_html(), so
+        panels can hand over traces as plain dicts of numpy arrays and skip plotly's per-property
+        validation.  Coordinates can optionally be rounded and/or base64 typed-array encoded.
+    Inputs:
+        go.Figure objects assembled by the panel modules.
+    Outputs:
+        io_mid/{PANEL}.div: html code contained inside a <div> tag.  A build output that a4_build
+            records in io_mid/build_manifest.json, so a1_execute_project.py can assemble the
+            dashboard without regenerating every panel; it only reads a div that still matches.
+        io_mid/{PANEL}.html: html page for inspecting a panel during development.  Only written
+            when debug_html is True.  Loads the shared, content-hashed copy of plotly.js in io_out
+            rather than inlining its own ~3 MB copy.
+        io_out/{name}.{hash}.{ext}: content-hashed static assets (plotly.js, css), plus optional
+            pre-compressed .gz / .br variants for static hosting.  See publish_asset().
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, re, json, base64, glob, gzip, hashlib, functools
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+from a5_instrument import instrument
+try: import brotli
+except ImportError: brotli = None
+
+## set parameters
+params = dict(
+    buffer_size = 2**20,
+    encoding = 'utf-8',
+    json_engine = 'auto', # 'auto' uses orjson when it is installed, else the json module
+    coordinates = ['x', 'y', 'lat', 'lon'],
+    precision = None,     # decimal places to round coordinates to; None leaves them as-is
+    typed_arrays = False, # base64 typed arrays; needs plotly.js >= 2.28 on the dashboard page
+    hash_length = 12,
+    asset_dir = 'io_out'
+)
+sheet_cache = dict()
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - file io
+
+
+def write_text(file_address: str, text: str, params=params) -> str:
+    """ Writes a text string to disk in a single buffered write.  All html/div outputs in the
+    project go through this function.
+    Inputs:
+        file_address = location of the file to write
+        text = the str to write
+        params = dict of misc. parameters.  Sets the buffer size and encoding.
+    Output: file_address, for convenience
+    """
+    with open(file_address, 'wt', encoding=params['encoding'],
+              buffering=params['buffer_size']) as f:
+        f.write(text)
+    return file_address
+
+
+@instrument
+def read_sheet(file_address: str, sheet_name=0, index_col=None) -> pd.DataFrame:
+    """ Memoized pd.read_excel().  Parses each (file, sheet, index_col) combination once per
+    process and returns a copy, so callers can modify the frame freely.  Entries are keyed on the
+    file's modification time, so an edited file is parsed again, and the superseded entry is
+    dropped (which keeps a long-running watch process from accumulating old copies).  a4_build
+    pre-fills this cache in its worker processes, so parallel panel builds do not each re-parse
+    the workbooks.
+    """
+    file_address = os.path.normpath(file_address)
+    key = (file_address, sheet_name, index_col, os.path.getmtime(file_address))
+    if key not in sheet_cache:
+        for iter_key in [i for i in sheet_cache.keys() if i[0:3] == key[0:3]]:
+            del sheet_cache[iter_key]
+        sheet_cache[key] = pd.read_excel(file_address, sheet_name=sheet_name, index_col=index_col)
+    return sheet_cache[key].copy()
+
+
+def write_chunks(file_address: str, chunks, params=params) -> str:
+    """ Streams an iterable of str chunks to disk through one buffered writer, so large outputs
+    never need to be joined into a single str in memory.
+    """
+    with open(file_address, 'wt', encoding=params['encoding'],
+              buffering=params['buffer_size']) as f:
+        for iter_chunk in chunks: f.write(iter_chunk)
+    return file_address
+
+
+def read_text(file_address: str, params=params) -> str:
+    """ Reads a text file written by write_text() back in as a single str, without altering
+    its line breaks.
+    """
+    with open(file_address, 'rt', encoding=params['encoding']) as f:
+        return f.read()
+
+
+def write_bytes(file_address: str, data: bytes, params=params) -> str:
+    """ Binary counterpart to write_text(); used for pre-compressed assets."""
+    with open(file_address, 'wb', buffering=params['buffer_size']) as f:
+        f.write(data)
+    return file_address
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - static assets
+
+
+def minify_css(text: str) -> str:
+    """ Conservative css minifier: drops comments and collapses whitespace around css
+    punctuation.  Does not touch selectors' internal spacing (e.g. descendant combinators).
+    """
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def remove_stale_assets(file_name: str, directory: str) -> None:
+    """ Removes other versions of a content-hashed asset (e.g. plotly.{hash}.js) from a
+    directory, along with their pre-compressed variants.  file_name's own files are kept.
+    """
+    name, _, ext = file_name.rsplit('.', 2)
+    for iter_file in glob.glob(os.path.join(directory, '{0}.*.{1}*'.format(name, ext))):
+        if not os.path.basename(iter_file).startswith(file_name): os.remove(iter_file)
+    return None
+
+
+@instrument
+def publish_asset(name: str, ext: str, text: str, compress=(), directory=None,
+                  params=params) -> str:
+    """ Writes a static asset once under a content-hashed file name, e.g. plotly.3f9c0a1b2c4d.js.
+    Because the name changes whenever the content does, hosts can cache the file indefinitely.
+    Older versions of the same asset are removed.
+    Inputs:
+        name = asset base name (e.g. 'plotly', 'roadtrips')
+        ext = file extension (e.g. 'js', 'css')
+        text = asset contents
+        compress = iterable of 'gzip' and/or 'brotli'; writes .gz / .br variants alongside the
+            asset for static hosting.  brotli is skipped if the brotli package is not installed.
+        directory = destination directory; defaults to params['asset_dir']
+    Output: file_name = the hashed file name, relative to directory
+    """
+    directory = directory or params['asset_dir']
+    data = text.encode(params['encoding'])
+    file_name = '{0}.{1}.{2}'.format(
+        name, hashlib.sha256(data).hexdigest()[0:params['hash_length']], ext)
+    file_address = os.path.join(directory, file_name)
+    remove_stale_assets(file_name=file_name, directory=directory)
+
+    ## write the asset and any pre-compressed variants that are not already on disk
+    if not os.path.exists(file_address): write_bytes(file_address, data)
+    if ('gzip' in compress) and not os.path.exists(file_address + '.gz'):
+        write_bytes(file_address + '.gz', compress_bytes(data, 'gzip'))
+    if ('brotli' in compress) and (brotli is not None) and not os.path.exists(file_address + '.br'):
+        write_bytes(file_address + '.br', compress_bytes(data, 'brotli'))
+    return file_name
+
+
+def compress_bytes(data: bytes, method: str) -> bytes:
+    """ Compresses data with 'gzip' or 'brotli' at maximum settings, as for every pre-compressed
+    asset and size measurement in the project.  Returns None for brotli if the brotli package is
+    not installed.
+    """
+    if method == 'gzip': return gzip.compress(data, compresslevel=9, mtime=0)
+    if method == 'brotli': return brotli.compress(data, quality=11) if brotli is not None else None
+    raise ValueError('Unknown compression method: ' + method)
+
+
+def compressed_sizes(data: bytes) -> dict:
+    """ Transfer sizes of data under the same gzip / brotli settings publish_asset() uses.  The
+    brotli size is None if the brotli package is not installed.
+    """
+    return dict(
+        gzip = len(compress_bytes(data, 'gzip')),
+        brotli = len(compress_bytes(data, 'brotli')) if brotli is not None else None
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def publish_plotlyjs(compress=(), directory=None) -> str:
+    """ Publishes the plotly.js bundle that ships with the installed plotly package (already
+    minified) as a content-hashed asset.  Cached, so the ~3 MB bundle is hashed once per run.
+    """
+    return publish_asset(
+        name='plotly', ext='js', text=get_plotlyjs(), compress=compress, directory=directory)
+
+
+def wrap_debug_page(div: str, params=params) -> str:
+    """ Wraps an already-rendered div in a minimal html page that loads the shared plotly.js
+    asset, so the debug page neither serializes the figure again nor inlines plotly.js.
+    """
+    plotlyjs_src = os.path.join('..', params['asset_dir'], publish_plotlyjs())
+    return ''.join([
+        '<html>\n<head><meta charset="utf-8" /></head>\n<body>\n',
+        '<script type="text/javascript" src="', plotlyjs_src.replace(os.sep, '/'), '"></script>\n',
+        div,
+        '\n</body>\n</html>'
+    ])
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - figure serialization
+
+
+def encode_array(values, precision=None, typed_arrays=False):
+    """ Compacts a numeric array for serialization.  Non-numeric arrays (text, colors, bools)
+    are returned unchanged.
+    Inputs:
+        values = array-like of trace data (list, pd.Series, np.ndarray)
+        precision = decimal places to round floats to.  None skips rounding.
+        typed_arrays = bool; if True, encode as a plotly.js typed array, i.e.
+            {'dtype': 'f4', 'bdata': <base64>}.  Floats are stored as float32, which keeps ~7
+            significant digits -- well below a pixel at dashboard scale.
+    """
+    array = np.asarray(values)
+    if array.dtype.kind not in 'fiu' or array.ndim != 1: return values
+    if (precision is not None) and (array.dtype.kind == 'f'): array = array.round(precision)
+    if not typed_arrays: return array
+    dtype = '<f4' if array.dtype.kind == 'f' else '<i4'
+    return dict(
+        dtype = dtype[1::],
+        bdata = base64.b64encode(array.astype(dtype).tobytes()).decode('ascii')
+    )
+
+
+@instrument
+def figure_spec(fig, traces=(), params=params) -> dict:
+    """ Builds the plain-dict figure spec that plotly.js consumes.  The layout (and any traces
+    already added to fig) come from the validated figure; traces passed in as plain dicts are
+    used as-is, skipping plotly's per-property validation.
+    Inputs:
+        fig = a plotly figure carrying the layout, sliders, and optionally some traces
+        traces = additional traces; plain dicts (must include 'type') or go trace objects
+        params = dict of misc. parameters.  Sets coordinate rounding and typed-array encoding.
+    Output: spec = {'data': [...], 'layout': {...}}
+    """
+    spec = fig.to_plotly_json()
+    spec['data'] = spec['data'] + [
+        i.to_plotly_json() if hasattr(i, 'to_plotly_json') else i for i in traces]
+    if (params['precision'] is None) and not params['typed_arrays']: return spec
+    for iter_trace in spec['data']:
+        for iter_key in set(params['coordinates']).intersection(iter_trace.keys()):
+            iter_trace[iter_key] = encode_array(
+                iter_trace[iter_key],
+                precision = params['precision'],
+                typed_arrays = params['typed_arrays']
+                )
+    return spec
+
+
+def count_points(values) -> int:
+    """Number of points in a serialized coordinate array, either a list or a typed array."""
+    if isinstance(values, dict) and 'bdata' in values:
+        return len(base64.b64decode(values['bdata'])) // np.dtype(values['dtype']).itemsize
+    return len(values) if isinstance(values, list) else 0
+
+
+def measure_div(div: str, params=params) -> dict:
+    """ Measures a rendered div: its size in bytes (raw and compressed), how those bytes split
+    between trace data and layout (which includes the sliders), its trace count, and the number
+    of points per trace.  Reads the figure back out of the Plotly.newPlot() call (see split_div()),
+    so it works on cached divs as well as freshly rendered ones.
+    """
+    parts = split_div(div)
+    data, spans = parts['data'], parts['spans']
+    points = [
+        max([count_points(i[j]) for j in params['coordinates'] if j in i], default=0)
+        for i in data]
+    return dict(
+        bytes = len(div.encode(params['encoding'])),
+        **compressed_sizes(div.encode(params['encoding'])),
+        data_bytes = spans['data'][1] - spans['data'][0],
+        layout_bytes = spans['layout'][1] - spans['layout'][0],
+        traces = len(data),
+        points = sum(points),
+        max_points_per_trace = max(points, default=0),
+        mean_points_per_trace = round(sum(points) / max(len(points), 1), 1)
+    )
+
+
+def split_div(div: str) -> dict:
+    """ Reads a rendered div back into its parts, so the figure can be shipped separately from the
+    page (see a1_execute_project's lazy_panels mode).  Works on cached divs as well as fresh ones.
+    Output: parts = dict of id and style (of the plot's div), data, layout, and config (as
+        passed to Plotly.newPlot()), post_script ('' if the figure has none), and spans (the
+        [start, end) positions of data, layout, and config within div; see measure_div())
+    """
+    decoder = json.JSONDecoder()
+    tag = re.search(r'<div id="([^"]+)" class="plotly-graph-div" style="([^"]*)"', div)
+    spans, parts, end = dict(), dict(), div.index(',', div.index('Plotly.newPlot('))
+    for iter_part, iter_open in [('data', '['), ('layout', '{'), ('config', '{')]:
+        start = div.index(iter_open, end)
+        parts[iter_part], end = decoder.raw_decode(div, start)
+        spans[iter_part] = (start, end)
+    then = div.find('.then(function(){', end)
+    post_script = div[then + len('.then(function(){'):div.rindex('})')] if then >= 0 else ''
+    return dict(id = tag.group(1), style = tag.group(2), **parts,
+        post_script = post_script.strip(), spans = spans)
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+@instrument
+def render_figure(fig, name: str, debug_html=False, traces=(), post_script=None,
+                  params=params) -> str:
+    """ Renders a finished plotly figure as an html div string, writes the div to io_mid, and
+    optionally writes a debug page alongside it.
+    Inputs:
+        fig = a plotly figure with sliders and layout already applied
+        name = panel name (e.g. 'MAP').  Determines the io_mid file names.
+        debug_html = bool; if True, also writes io_mid/{name}.html, which loads the shared,
+            content-hashed plotly.js asset from io_out (see wrap_debug_page())
+        traces = traces not yet added to fig; see figure_spec().  Plain dicts are not validated.
+        post_script = optional JavaScript run once the figure is drawn; '{plot_id}' is replaced
+            with the div's id
+        params = dict of misc. parameters; see figure_spec().  Panels can pass
+            {**a3_render.params, 'precision': 4} to override individual settings.
+    Output: div = the figure as an html div str, ready for injection into roadtrips.html
+    """
+    spec = figure_spec(fig=fig, traces=traces, params=params)
+
+    ## pio.to_html() has no engine argument, so select params['json_engine'] for this call only
+    ## rather than changing plotly's configuration for the whole process
+    engine = pio.json.config.default_engine
+    pio.json.config.default_engine = params['json_engine']
+    try:
+        div = pio.to_html(spec, full_html=False, include_plotlyjs=False, validate=False,
+            post_script=post_script)
+    finally: pio.json.config.default_engine = engine
+    write_text(os.path.join('io_mid', name + '.div'), div)
+    if debug_html:
+        write_text(os.path.join('io_mid', name + '.html'), wrap_debug_page(div))
+    return div
+
+
+##########==========##########==========##########==========##########==========##########==========
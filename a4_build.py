@@ -0,0 +1,344 @@
+"""
+    Purpose: A small make-like build orchestrator for the dashboard components.  Each target (a
+        panel div, or the weather data) declares the inputs it reads and the outputs it writes.
+        A target is rebuilt only when the content hash of its inputs, code, or arguments has
+        changed since its last successful build, or when one of its outputs is missing or has
+        been altered.  Unchanged targets are skipped entirely.
+        Targets that do not depend on each other can be built concurrently in a process pool.
+        The workers receive the parent's already-parsed spreadsheets (pickled once per worker),
+        and results come back in a fixed order regardless of which worker finishes first.
+    Inputs:
+        params['targets']: the dependency graph.  Inputs are file paths; spreadsheet inputs can
+            name a single sheet as 'file.xlsx#Sheet', so that editing one sheet does not
+            invalidate targets that only read the others.
+    Outputs:
+        io_mid/build_manifest.json: the fingerprint and output hashes recorded for each target
+            after its last successful build.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, json, hashlib, zipfile, importlib
+from concurrent.futures import ProcessPoolExecutor
+from xml.dom.minidom import parseString as xml_parse
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+from a3_render import write_text, read_text, read_sheet, sheet_cache
+from a5_instrument import instrument, records
+
+## set parameters
+cities = os.path.join('io_in', 'city_list.xlsx') + '#Cities'
+palette = [os.path.join('io_in', 'city_list.xlsx') + '#' + i for i in ['Color', 'ColorMap']]
+weather = os.path.join('io_mid', 'weather_data.xlsx')
+params = dict(
+    manifest = os.path.join('io_mid', 'build_manifest.json'),
+    max_workers = os.cpu_count() or 1,
+    ## (file, sheet, index_col) reads shared by several panels; parsed once and sent to workers
+    shared_sheets = [
+        (os.path.join('io_in', 'city_list.xlsx'), 'Cities', None),
+        (os.path.join('io_in', 'city_list.xlsx'), 'Cities', 0),
+        (os.path.join('io_in', 'city_list.xlsx'), 'Color', 0),
+        (os.path.join('io_in', 'city_list.xlsx'), 'ColorMap', None),
+        (os.path.join('io_in', 'colors.xlsx'), 0, 0),
+        (weather, 0, 0),
+        ],
+    targets = dict(
+        WEATHER = dict(
+            recipe = 'a2_weather.download_weather_data',
+            inputs = [cities, os.path.join('io_in', 'hly_inventory_15yr.txt'),
+                os.path.join('io_in', 'hly_inventory_30yr.txt')],
+            code = ['a2_weather.py', 'a3_render.py', 'a6_spatial.py'],
+            outputs = [weather]
+            ),
+        PROGRESS = dict(
+            recipe = 'b1_progress.draw_progress_panel',
+            inputs = [cities] + palette,
+            code = ['b1_progress.py', 'a3_render.py'],
+            outputs = [os.path.join('io_mid', 'PROGRESS.div')]
+            ),
+        PROXIMITY = dict(
+            recipe = 'b2_proximity.draw_proximity_panel',
+            inputs = [cities, weather] + palette,
+            code = ['b2_proximity.py', 'a2_weather.py', 'a3_render.py', 'a6_spatial.py'],
+            variables = ['b2_proximity.params'], # first_visible depends on today's date
+            outputs = [os.path.join('io_mid', 'PROXIMITY.div')]
+            ),
+        MAP = dict(
+            recipe = 'b3_map.draw_map_panel',
+            inputs = [cities, weather, os.path.join('io_in', 'colors.xlsx'),
+                      os.path.join('io_in', 'Travels.kml')] + palette,
+            code = ['b3_map.py', 'a2_weather.py', 'a3_render.py', 'a6_spatial.py',
+                    'b5_itinerary.py', 'b2_proximity.py'],
+            variables = ['b5_itinerary.params'], # the default trip month is today's month
+            outputs = [os.path.join('io_mid', 'MAP.div')]
+            ),
+        OCONUS = dict(
+            recipe = 'b4_oconus.draw_oconus_panel',
+            inputs = [cities, os.path.join('io_in', 'colors.xlsx')],
+            code = ['b4_oconus.py', 'b3_map.py', 'a2_weather.py', 'a3_render.py', 'a6_spatial.py'],
+            outputs = [os.path.join('io_mid', 'OCONUS.div')]
+            ),
+        )
+    )
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - content hashing
+
+
+def hash_file(file_address: str) -> str:
+    """Returns the sha256 hex digest of a file's bytes, or 'MISSING' if it does not exist."""
+    if not os.path.exists(file_address): return 'MISSING'
+    digest = hashlib.sha256()
+    with open(file_address, 'rb') as f:
+        for iter_block in iter(lambda: f.read(2**20), b''): digest.update(iter_block)
+    return digest.hexdigest()
+
+
+def hash_workbook(file_address: str, sheet=None) -> str:
+    """ Hashes the cell data of an xlsx workbook, or of a single named sheet within it.  Only the
+    worksheet xml and the shared string table are hashed, so metadata that changes on every save
+    (e.g. docProps timestamps) does not mark a workbook as changed.
+    Inputs:
+        file_address = location of the xlsx file
+        sheet = name of the sheet to hash; None hashes every sheet
+    """
+    if not os.path.exists(file_address): return 'MISSING'
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(file_address) as workbook:
+        members = workbook.namelist()
+
+        ## map sheet names to worksheet xml files
+        rels = xml_parse(workbook.read('xl/_rels/workbook.xml.rels'))
+        rels = {i.getAttribute('Id'): i.getAttribute('Target')
+                for i in rels.getElementsByTagName('Relationship')}
+        rels = {i: rels[i][1::] if rels[i].startswith('/') else 'xl/' + rels[i] for i in rels}
+        sheets = xml_parse(workbook.read('xl/workbook.xml')).getElementsByTagName('sheet')
+        sheets = {i.getAttribute('name'): rels[i.getAttribute('r:id')] for i in sheets}
+        if sheet is not None: sheets = {sheet: sheets[sheet]}
+
+        ## hash the selected worksheets plus the shared string table they draw on
+        for iter_sheet in sorted(sheets.keys()):
+            digest.update(iter_sheet.encode('utf-8'))
+            digest.update(workbook.read(sheets[iter_sheet]))
+        if 'xl/sharedStrings.xml' in members: digest.update(workbook.read('xl/sharedStrings.xml'))
+    return digest.hexdigest()
+
+
+def hash_input(source: str) -> str:
+    """Hashes one declared input: a plain file, an xlsx workbook, or an 'file.xlsx#Sheet' sheet."""
+    file_address, _, sheet = source.partition('#')
+    if file_address.endswith('.xlsx'): return hash_workbook(file_address, sheet or None)
+    return hash_file(file_address)
+
+
+def resolve(dotted_name: str):
+    """Imports and returns a module attribute given as 'module.attribute'."""
+    module_name, _, attribute = dotted_name.partition('.')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+@instrument
+def fingerprint(target: dict, kwargs=dict()) -> str:
+    """ Combines the content hashes of a target's inputs, code, runtime variables, and recipe
+    arguments into a single fingerprint.  The target is up to date when this matches the
+    fingerprint recorded at its last successful build.
+    """
+    parts = [target['recipe'], repr(sorted(kwargs.items()))]
+    parts += [i + '=' + hash_input(i) for i in target['inputs']]
+    parts += [i + '=' + hash_file(i) for i in target['code']]
+    parts += [i + '=' + repr(resolve(i)) for i in target.get('variables', [])]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - dependency graph
+
+
+def upstream_targets(name: str, names: list, params=params) -> list:
+    """Lists the requested targets whose outputs are inputs to the named target."""
+    targets = params['targets']
+    producers = {j: i for i in targets.keys() for j in targets[i]['outputs']}
+    upstream = [producers.get(i.partition('#')[0]) for i in targets[name]['inputs']]
+    return [i for i in upstream if i in names]
+
+
+def build_order(names: list, params=params) -> list:
+    """ Orders the requested targets so that every target comes after the targets that produce
+    its inputs.  Targets that are not requested are left out, even if upstream of a requested one.
+    """
+    order = list()
+    def visit(name, path=()):
+        if name in order: return
+        if name in path: raise ValueError('Build targets form a cycle: ' + ' -> '.join(path))
+        for iter_upstream in upstream_targets(name, names, params=params):
+            visit(iter_upstream, path + (name,))
+        order.append(name)
+    for iter_name in names: visit(iter_name)
+    return order
+
+
+def build_levels(names: list, params=params) -> list:
+    """ Groups the ordered targets into levels.  Each level depends only on earlier levels, so
+    the targets within a level can be built at the same time.
+    """
+    depth = dict()
+    for iter_name in build_order(names, params=params):
+        upstream = upstream_targets(iter_name, names, params=params)
+        depth[iter_name] = 1 + max([depth[i] for i in upstream], default=-1)
+    levels = range(0, max(depth.values(), default=-1) + 1)
+    return [[i for i in depth.keys() if depth[i] == j] for j in levels]
+
+
+def read_manifest(params=params) -> dict:
+    """Reads the build manifest, or returns an empty one if none has been written yet."""
+    if not os.path.exists(params['manifest']): return dict()
+    return json.loads(read_text(params['manifest']))
+
+
+def is_current(file_address: str, manifest=None, params=params) -> bool:
+    """ True if a file is an output of a built target and still matches the hash recorded when
+    that target was built, e.g. so a panel div is known to be complete before it is read back.
+    Files no target lists, and outputs of targets never built, are not current.
+    """
+    manifest = read_manifest(params=params) if manifest is None else manifest
+    for iter_name, iter_target in params['targets'].items():
+        if file_address not in iter_target['outputs']: continue
+        recorded = manifest.get(iter_name, dict()).get('outputs', dict()).get(file_address)
+        return (recorded is not None) and (recorded == hash_file(file_address))
+    return False
+
+
+def is_stale(name: str, fingerprint_now: str, manifest: dict, params=params) -> bool:
+    """A target is stale if it has never been built, its fingerprint changed, or any output is
+    missing or no longer matches the hash recorded when it was built."""
+    if name not in manifest: return True
+    if manifest[name]['fingerprint'] != fingerprint_now: return True
+    outputs = manifest[name]['outputs']
+    return any(hash_file(i) != outputs.get(i) for i in params['targets'][name]['outputs'])
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - run recipes
+
+
+def load_shared_sheets(params=params) -> dict:
+    """Parses the spreadsheets that several panels read, so they can be handed to workers."""
+    for file_address, sheet_name, index_col in params['shared_sheets']:
+        if os.path.exists(file_address): read_sheet(file_address, sheet_name, index_col)
+    return dict(sheet_cache)
+
+
+def prime_worker(cache: dict) -> None:
+    """ProcessPoolExecutor initializer: installs the parent's parsed spreadsheets in a worker."""
+    sheet_cache.update(cache)
+    return None
+
+
+def run_recipe(recipe: str, kwargs: dict, collect=False):
+    """ Resolves a recipe by name and runs it.  Module-level, so it can be sent to a worker.
+    With collect=True, also returns the a5_instrument records the recipe produced, so a worker's
+    timings can be shipped back to the parent's run report.  They are removed from the worker's
+    own records, which would otherwise grow without bound in a long-lived pool.
+    """
+    first = len(records)
+    result = resolve(recipe)(**kwargs)
+    if not collect: return result
+    collected = records[first::]
+    del records[first::]
+    return result, collected
+
+
+def run_level(jobs: dict, parallel=True, pool=None, params=params):
+    """ Runs one level's recipes, either one after another or across a process pool sized to the
+    machine.  An error in one recipe does not stop the others.
+    Inputs:
+        jobs = dict of (recipe, kwargs) tuples keyed by target name
+        parallel = bool; if True and there is more than one job, use a process pool
+        pool = an already running pool to use (see start_pool()); by default, a pool is started
+            for this level and shut down after it
+        params = The parameters dictionary defined at the top of this script.
+    Output: results, errors = dicts keyed by target name, in the same order as jobs
+    """
+    results, errors = dict(), dict()
+    if (not parallel) or (len(jobs) < 2):
+        for iter_name in jobs.keys():
+            try: results[iter_name] = run_recipe(*jobs[iter_name])
+            except Exception as except_msg: errors[iter_name] = except_msg
+        return results, errors
+
+    if pool is None:
+        with start_pool(max_workers=len(jobs), params=params) as pool:
+            return run_level(jobs, parallel=parallel, pool=pool, params=params)
+    futures = {i: pool.submit(run_recipe, *jobs[i], collect=True) for i in jobs.keys()}
+    for iter_name in jobs.keys():
+        try: results[iter_name], worker_records = futures[iter_name].result()
+        except Exception as except_msg: errors[iter_name] = except_msg
+        else: records.extend(worker_records)
+    return results, errors
+
+
+def start_pool(max_workers=None, params=params) -> ProcessPoolExecutor:
+    """ Starts a process pool whose workers hold the parent's parsed spreadsheets.  Workers keep
+    their imports and memoized reads for as long as the pool runs, so a pool kept across builds
+    (e.g. by a1_execute_project's watch mode) only pays those costs once.
+    """
+    max_workers = max(1, min(max_workers or params['max_workers'], params['max_workers']))
+    cache = load_shared_sheets(params=params)
+    return ProcessPoolExecutor(max_workers, initializer=prime_worker, initargs=(cache,))
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+@instrument
+def build_targets(names: list, kwargs=dict(), force=False, parallel=False, pool=None,
+                  params=params) -> dict:
+    """ Rebuilds the requested targets that are stale, in dependency order, and skips the rest.
+    The manifest is updated after each level, so an interrupted run keeps the targets it
+    finished.  If any recipe fails, the others in its level still finish and are recorded, and
+    then a RuntimeError naming every failed target is raised.
+    Inputs:
+        names = target names to bring up to date (e.g. ['PROGRESS', 'MAP'])
+        kwargs = dict of keyword arguments for each target's recipe, keyed by target name
+        force = bool; if True, rebuild every requested target regardless of hashes
+        parallel = bool; if True, build independent targets concurrently in a process pool
+        pool = optional running pool to build in; see run_level()
+        params = The parameters dictionary defined at the top of this script.
+    Output: results = dict of recipe return values (e.g. div strs), for rebuilt targets only,
+        in dependency order
+    """
+    manifest = read_manifest(params=params)
+    results = dict()
+    for iter_level in build_levels(names, params=params):
+
+        ## determine which targets in this level are stale
+        jobs, fingerprints = dict(), dict()
+        for iter_name in iter_level:
+            target = params['targets'][iter_name]
+            kwargs_now = kwargs.get(iter_name, dict())
+            fingerprints[iter_name] = fingerprint(target, kwargs=kwargs_now)
+            if not (force or is_stale(iter_name, fingerprints[iter_name], manifest, params=params)):
+                print('   ', iter_name, 'is up to date')
+                continue
+            print('   ', iter_name, 'is stale; rebuilding')
+            jobs[iter_name] = (target['recipe'], kwargs_now)
+
+        ## rebuild stale targets and record the successful ones
+        results_now, errors = run_level(jobs, parallel=parallel, pool=pool, params=params)
+        for iter_name in results_now.keys():
+            manifest[iter_name] = dict(
+                fingerprint = fingerprints[iter_name],
+                outputs = {i: hash_file(i) for i in params['targets'][iter_name]['outputs']}
+                )
+        results.update(results_now)
+        write_text(params['manifest'], json.dumps(manifest, indent=1, sort_keys=True))
+        if errors:
+            summary = '; '.join([f'{i}: {type(errors[i]).__name__}: {errors[i]}' for i in errors])
+            raise RuntimeError('Build failed for ' + summary) from list(errors.values())[0]
+    return results
+
+
+##########==========##########==========##########==========##########==========##########==========
@@ -0,0 +1,144 @@
+"""
+    Purpose: Lightweight instrumentation for the build pipeline.  The instrument decorator (or the
+        stage context manager) records, for each call of a top-level or component function, its
+        wall time, CPU time, the process's peak resident memory, optionally the peak python heap
+        allocation (tracemalloc), and the row count of what it returned.  Records from the
+        a4_build worker processes are shipped back to the parent, so one run report covers the
+        whole build.
+    Inputs:
+        None.  Other modules decorate their functions with @instrument.
+    Outputs:
+        io_out/run_report.json: every stage record from the run, plus per-stage totals.  Used to
+            compare where the build time goes before and after each change.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, time, json, datetime, functools, contextlib, resource, tracemalloc
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+
+## set parameters
+params = dict(
+    enabled = True,
+    tracemalloc = False,  # exact heap peaks, at a large speed cost; RSS is always recorded
+    report = os.path.join('io_out', 'run_report.json')
+)
+records = list()
+stack = list()
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS
+
+
+def peak_rss_mb() -> float:
+    """Returns this process's peak resident set size in MB (ru_maxrss is KB on Linux, bytes on
+    macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def count_rows(result):
+    """ Row count of a function's return value: len() of frames, arrays, lists, and dicts, or a
+    list of counts for a tuple of them.  None for anything else (e.g. strs, figures).
+    """
+    if isinstance(result, tuple): return [count_rows(i) for i in result]
+    if isinstance(result, (str, bytes)) or not hasattr(result, '__len__'): return None
+    try: return len(result)
+    except TypeError: return None
+
+
+@contextlib.contextmanager
+def stage(name: str, params=params):
+    """ Context manager that times the enclosed block and appends a record to records.  Stages
+    can be nested; each record notes its depth and parent stage.
+    Inputs:
+        name = stage name recorded in the report
+        params = dict of misc. parameters.  Determines whether tracemalloc is used.
+    Yields: record = dict that the caller can add fields to (e.g. rows)
+    """
+    record = dict(
+        stage = name, parent = stack[-1]['stage'] if stack else None, depth = len(stack),
+        pid = os.getpid(), started = datetime.datetime.now().isoformat(timespec='milliseconds')
+        )
+    if params['tracemalloc'] and not tracemalloc.is_tracing(): tracemalloc.start()
+    if tracemalloc.is_tracing():
+        if stack:
+            stack[-1]['heap_peak'] = max(stack[-1]['heap_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record['heap_start'] = tracemalloc.get_traced_memory()[0]
+        record['heap_peak'] = record['heap_start']
+    stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+        stack.pop()
+        if 'heap_start' in record:
+            record['heap_peak'] = max(record['heap_peak'], tracemalloc.get_traced_memory()[1])
+            if stack: stack[-1]['heap_peak'] = max(stack[-1]['heap_peak'], record['heap_peak'])
+            heap_peak = record.pop('heap_peak') - record.pop('heap_start')
+            record['heap_peak_mb'] = round(heap_peak / 2**20, 2)
+        records.append(record)
+
+
+def instrument(func):
+    """ Decorator that runs the function inside a stage named 'module.function' and records the
+    row count of its return value.  A no-op when params['enabled'] is False.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not params['enabled']: return func(*args, **kwargs)
+        with stage(func.__module__ + '.' + func.__qualname__) as record:
+            result = func(*args, **kwargs)
+            record['rows'] = count_rows(result)
+        return result
+    return wrapper
+
+
+def summarize(records=records) -> list:
+    """ Totals wall time, CPU time, and call counts per stage, slowest first, with the highest
+    peak RSS seen at the end of any call to the stage.
+    """
+    summary = dict()
+    for iter_record in records:
+        total = summary.setdefault(iter_record['stage'], dict(
+            stage = iter_record['stage'], calls = 0, wall_s = 0, cpu_s = 0, peak_rss_mb = 0))
+        total['calls'] += 1
+        total['wall_s'] = round(total['wall_s'] + iter_record['wall_s'], 4)
+        total['cpu_s'] = round(total['cpu_s'] + iter_record['cpu_s'], 4)
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], iter_record['peak_rss_mb'])
+    return sorted(summary.values(), key = lambda x: x['wall_s'], reverse = True)
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+def write_report(file_address=None, extra=dict(), params=params) -> str:
+    """ Writes every stage record collected so far, plus per-stage totals, as a JSON run report.
+    Inputs:
+        file_address = where to write the report; defaults to params['report']
+        extra = dict of additional run-level fields (e.g. the build parameters)
+    Output: file_address, for convenience
+    """
+    file_address = file_address or params['report']
+    report = dict(
+        written = datetime.datetime.now().isoformat(timespec='seconds'),
+        python = sys.version.split(' ')[0],
+        cpu_count = os.cpu_count(),
+        **extra,
+        summary = summarize(records),
+        stages = records
+        )
+    with open(file_address, 'wt', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, default=str)
+    return file_address
+
+
+##########==========##########==========##########==========##########==========##########==========
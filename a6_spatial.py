@@ -0,0 +1,218 @@
+"""
+    Purpose: Spatial index over the destinations, for planning questions such as "which
+        unphotographed destinations are within 150 miles of X".  Wraps a scikit-learn BallTree
+        with the haversine metric over lat/lon, so distances are great-circle miles and queries
+        are O(log n) per point.  Each index is built once per run and cached to disk, keyed on a
+        hash of its coordinates, so later runs (and parallel build workers) load it instead of
+        rebuilding it.  Both go through the a7_cache manifest, which checks them on read.
+        Also serves the pairwise great-circle distances between all destinations as a condensed
+        float32 matrix, computed blockwise and kept on disk as a memory-mapped file, so that
+        clustering (b2_proximity) and trip planning (b5_itinerary) share one copy and repeated
+        runs reuse it.  The condensed layout is the one scipy's hierarchy.linkage() accepts.
+        describe_nearby() turns the queries into the "Nearby" hover line shown on the map and
+        proximity panels.
+    Inputs:
+        city_list (or any frame with lat / lon columns), as loaded by the panel modules.
+    Outputs:
+        io_mid/spatial_index/{hash}.pkl: cached BallTree for one set of coordinates.
+        io_mid/spatial_index/distances.{hash}.f32: condensed distance matrix (raw float32) for
+            one set of coordinates.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, pickle, hashlib
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import squareform
+from sklearn.neighbors import BallTree
+from a5_instrument import instrument
+from a7_cache import lookup, commit
+
+## set parameters
+params = dict(
+    earth_radius_miles = 3958.8,
+    leaf_size = 40,
+    block_elements = 2**24,     # distances computed per block; bounds the working memory
+    cache_dir = os.path.join('io_mid', 'spatial_index'),
+    nearby_miles = 150,
+    nearby_status = ['Unvisited', 'Visited'],   # i.e. destinations not yet photographed
+    nearby_limit = 3,                           # names listed before summarizing as "+N more"
+)
+index_cache = dict()
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS
+
+
+def to_radians(points: pd.DataFrame) -> np.ndarray:
+    """Converts lat / lon columns to the (lat, lon) radian pairs the haversine metric expects."""
+    return np.radians(points[['lat', 'lon']].to_numpy(dtype=float))
+
+
+def to_cartesian(points: pd.DataFrame, params=params) -> np.ndarray:
+    """ Converts lat / lon columns to x, y, z miles from the earth's center.  Straight-line
+    distances between these points are chord lengths, which track great-circle miles closely at
+    trip scales, so Euclidean methods (k-means, Ward on coordinates) can use them directly.
+    """
+    lat, lon = to_radians(points).T
+    return params['earth_radius_miles'] * np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def coordinate_key(coords: np.ndarray) -> str:
+    """Short content hash of a set of radian coordinates; keys the on-disk caches."""
+    return hashlib.sha256(coords.tobytes()).hexdigest()[0:16]
+
+
+@instrument
+def build_index(points: pd.DataFrame, params=params) -> BallTree:
+    """ Returns a haversine BallTree over the points' lat / lon.  Indexes are memoized per process
+    and cached to disk, keyed on a hash of the coordinates, so each is built once.  Query results
+    are row positions in points.
+    """
+    coords = to_radians(points)
+    key = coordinate_key(coords)
+    if key in index_cache: return index_cache[key]
+    file_address = os.path.join(params['cache_dir'], key + '.pkl')
+    if lookup(file_address, inputs=[key, params['leaf_size']]) is not None:
+        with open(file_address, 'rb') as f: index_cache[key] = pickle.load(f)
+        return index_cache[key]
+
+    ## build, then write through a temporary file so parallel workers never read a partial cache
+    index_cache[key] = BallTree(coords, leaf_size=params['leaf_size'], metric='haversine')
+    os.makedirs(params['cache_dir'], exist_ok=True)
+    with open(file_address + '.' + str(os.getpid()), 'wb') as f:
+        pickle.dump(index_cache[key], f, protocol=pickle.HIGHEST_PROTOCOL)
+    commit(file_address + '.' + str(os.getpid()), file_address, producer='a6_spatial.build_index',
+        inputs=[key, params['leaf_size']])
+    return index_cache[key]
+
+
+def haversine_block(rows: np.ndarray, cols: np.ndarray, params=params) -> np.ndarray:
+    """Great-circle distances (miles) from each of rows to each of cols, both radian pairs."""
+    chord = np.sin((rows[:, 0, None] - cols[None, :, 0]) / 2)**2 + (
+        np.outer(np.cos(rows[:, 0]), np.cos(cols[:, 0]))
+        * np.sin((rows[:, 1, None] - cols[None, :, 1]) / 2)**2)
+    return 2 * params['earth_radius_miles'] * np.arcsin(np.sqrt(chord.clip(0, 1)))
+
+
+@instrument
+def condensed_distances(points: pd.DataFrame, params=params) -> np.ndarray:
+    """ Great-circle distances (miles, float32) between every pair of points, in scipy's
+    condensed order: (0,1), (0,2), ... (0,n-1), (1,2), ...  Computed in row blocks, so the
+    working memory stays near params['block_elements'] floats however many points there are, and
+    written to a memory-mapped file keyed on a hash of the coordinates.  Later calls with the same
+    coordinates map the file instead of recomputing it.
+    Output: distances = read-only np.memmap of length n * (n - 1) / 2
+    """
+    coords = to_radians(points)
+    count = coords.shape[0]
+    size = count * (count - 1) // 2
+    key = coordinate_key(coords)
+    file_address = os.path.join(params['cache_dir'], 'distances.{0}.f32'.format(key))
+    if lookup(file_address, inputs=[key, params['earth_radius_miles']]) is not None:
+        return np.memmap(file_address, dtype=np.float32, mode='r', shape=(size,))
+    if size == 0: return np.zeros(0, dtype=np.float32)
+
+    ## each block of rows is computed against the points after it only (the upper triangle),
+    ## and each row's tail is one contiguous stretch of the condensed vector
+    os.makedirs(params['cache_dir'], exist_ok=True)
+    temporary = file_address + '.' + str(os.getpid())
+    distances = np.memmap(temporary, dtype=np.float32, mode='w+', shape=(size,))
+    rows = max(1, params['block_elements'] // count)
+    for iter_start in range(0, count - 1, rows):
+        iter_stop = min(iter_start + rows, count - 1)
+        block = haversine_block(coords[iter_start:iter_stop], coords[iter_start + 1::])
+        for iter_row in range(iter_start, iter_stop):
+            offset = iter_row * count - iter_row * (iter_row + 1) // 2
+            distances[offset:offset + count - 1 - iter_row] = block[
+                iter_row - iter_start, iter_row - iter_start::]
+    distances.flush()
+    del distances
+    commit(temporary, file_address, producer='a6_spatial.condensed_distances',
+        inputs=[key, params['earth_radius_miles']])
+    return np.memmap(file_address, dtype=np.float32, mode='r', shape=(size,))
+
+
+def subset_distances(distances: np.ndarray, count: int, positions) -> np.ndarray:
+    """ Condensed distances among a subset of the points, read out of the full condensed matrix
+    without expanding it.
+    Inputs:
+        distances = output of condensed_distances() for count points
+        positions = sorted or unsorted row positions of the subset, in the order wanted
+    """
+    positions = np.asarray(positions)
+    i, j = np.triu_indices(positions.size, k=1)
+    i, j = positions[i], positions[j]
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return np.asarray(distances[i * count - i * (i + 1) // 2 + (j - i - 1)])
+
+
+def square_distances(distances: np.ndarray, count: int, positions=None) -> np.ndarray:
+    """Square (dense) float64 form of the condensed distances, optionally for a subset."""
+    if positions is not None: distances = subset_distances(distances, count, positions)
+    return squareform(np.asarray(distances, dtype=float))
+
+
+def query_knn(index: BallTree, points: pd.DataFrame, k: int, params=params):
+    """ Bulk k-nearest-neighbor query.
+    Output: distances (miles), positions = arrays of shape (len(points), k), nearest first
+    """
+    distances, positions = index.query(to_radians(points), k=min(k, index.data.shape[0]))
+    return distances * params['earth_radius_miles'], positions
+
+
+def query_radius(index: BallTree, points: pd.DataFrame, miles: float, params=params):
+    """ Bulk radius query.
+    Output: distances (miles), positions = object arrays holding, for each point, the distances
+        to and positions of every indexed point within the radius, nearest first
+    """
+    positions, distances = index.query_radius(
+        to_radians(points), r=miles / params['earth_radius_miles'],
+        return_distance=True, sort_results=True)
+    return np.array([i * params['earth_radius_miles'] for i in distances], dtype=object), positions
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+@instrument
+def describe_nearby(city_list: pd.DataFrame, params=params) -> pd.Series:
+    """ For each destination, lists the destinations with a status in params['nearby_status']
+    within params['nearby_miles'], nearest first, e.g. "Nearby: Salem OR (43 mi), Eugene OR
+    (61 mi) +2 more".  A destination never lists itself.
+    Inputs:
+        city_list = destination-wise data with city, lat, lon, and status columns
+        params = The parameters dictionary defined at the top of this script.
+    Output: nearby = Series of hover-ready strs, aligned to city_list's index
+    """
+    is_candidate = city_list['status'].isin(params['nearby_status']).to_numpy()
+    candidates = city_list.loc[is_candidate]
+    if candidates.shape[0] == 0:
+        return pd.Series('Nearby: none', index=city_list.index)
+    distances, positions = query_radius(
+        build_index(candidates), city_list, miles=params['nearby_miles'])
+    names = candidates['city'].to_numpy()
+    rows = np.flatnonzero(is_candidate)   # candidate position -> city_list row position
+
+    ## skip each destination's own row, rather than every destination that shares its name
+    nearby = list()
+    for iter_row, (iter_distances, iter_positions) in enumerate(zip(distances, positions)):
+        found = [
+            '{0} ({1:.0f} mi)'.format(names[j], i)
+            for i, j in zip(iter_distances, iter_positions) if rows[j] != iter_row]
+        text = ', '.join(found[0:params['nearby_limit']]) or 'none within {0} mi'.format(
+            params['nearby_miles'])
+        if len(found) > params['nearby_limit']:
+            text += ' +{0} more'.format(len(found) - params['nearby_limit'])
+        nearby.append('Nearby: ' + text)
+    return pd.Series(nearby, index=city_list.index)
+
+
+##########==========##########==========##########==========##########==========##########==========
@@ -0,0 +1,254 @@
+"""
+    Purpose: Keeps track of the caches under io_mid: the downloaded NOAA files, the spatial
+        indexes and distance matrices, and anything else that can be rebuilt from its inputs.
+        Every cache write is committed to a manifest with the function that produced it, a hash
+        of what it was made from, its size, a checksum, and when it was last read.  Every cache
+        read is looked up there first, and a file that is missing from the manifest, was made
+        from different inputs, or no longer matches its size and checksum (e.g. a write cut off
+        by a crash) is deleted and reported as a miss, so the caller rebuilds it.  When the
+        caches outgrow params['max_bytes'], the least recently read entries are evicted.
+        Build outputs that a4_build tracks (weather_data.xlsx, the panel divs) are not caches in
+        this sense; a4_build already checks them against the hashes in its own manifest.
+    Inputs:
+        Cache files written by the other modules, which register them with commit().
+    Outputs:
+        io_mid/cache_manifest.jsonl: an append-only journal of manifest changes, one JSON object
+            per line; the last line for a key wins.  Each directory named io_mid (including the
+            scratch copies c1_benchmark makes) keeps its own.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, json, time, hashlib, fcntl, threading, contextlib
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+
+## set parameters
+params = dict(
+    root_name = 'io_mid',           # caches live under the nearest directory with this name
+    manifest = 'cache_manifest.jsonl',
+    lock_file = 'cache_manifest.lock',
+    max_bytes = 4 * 2**30,          # total size of one root's cached files before eviction
+    verify = True,                  # checksum files on their first read in each process
+    compact_ratio = 4,              # journal lines per entry before the journal is rewritten
+    access_interval = 300,          # seconds; reads sooner than this after the last recorded one
+                                    # are not journaled, as eviction only needs rough recency
+)
+journals = dict()       # root: dict(head, offset, lines, entries), replayed from the journal
+verified = set()        # (root, key, size, mtime) of files already checksummed in this process
+lock = threading.Lock()
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS
+
+
+def locate(file_address: str, params=params) -> tuple:
+    """ Splits a cache file's address into its cache root (the nearest enclosing directory named
+    params['root_name']) and its key (the path relative to that root).
+    """
+    parts = os.path.normpath(os.path.abspath(file_address)).split(os.sep)
+    if params['root_name'] not in parts[0:-1]:
+        raise ValueError('Not under a cache directory (' + params['root_name'] + '): ' +
+            file_address)
+    split = len(parts) - 2 - parts[-2::-1].index(params['root_name'])
+    return os.sep.join(parts[0:split + 1]), '/'.join(parts[split + 1::])
+
+
+def hash_inputs(inputs) -> str:
+    """Short hash of whatever a cache entry was made from: any JSON-serializable value."""
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[0:16]
+
+
+def checksum(file_address: str) -> str:
+    """sha256 hex digest of a file's bytes, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(file_address, 'rb') as f:
+        for iter_block in iter(lambda: f.read(2**20), b''): digest.update(iter_block)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def locked(root: str, params=params):
+    """ Holds this process's lock and an exclusive lock on the root's lock file, so threads and
+    processes (e.g. parallel download workers) never interleave their manifest updates.  The lock
+    file is separate from the journal, which compact() replaces.
+    Yields: handle = the journal, open for appending
+    """
+    os.makedirs(root, exist_ok=True)
+    with lock, open(os.path.join(root, params['lock_file']), 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            with open(os.path.join(root, params['manifest']), 'ab') as handle: yield handle
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_manifest(root: str, params=params) -> dict:
+    """ Current manifest entries of a cache root, as dict of key: entry.  Only journal lines
+    appended since the last call are parsed; the whole journal is replayed again only after it
+    has been compacted (rewritten) by some process, which shows as a new first line.  Callers
+    should hold locked(root).
+    """
+    file_address = os.path.join(root, params['manifest'])
+    if not os.path.exists(file_address): return dict()
+    with open(file_address, 'rb') as f:
+        head = f.readline()
+        journal = journals.get(root)
+        if (journal is None) or (journal['head'] != head):
+            journal = journals[root] = dict(head = head, offset = 0, lines = 0, entries = dict())
+        f.seek(journal['offset'])
+        for iter_line in f:
+            if not iter_line.endswith(b'\n'): break   # a line still being written
+            journal['offset'] += len(iter_line)
+            journal['lines'] += 1
+            change = json.loads(iter_line)
+            if 'key' not in change: continue          # the header compact() writes
+            if change.get('removed'): journal['entries'].pop(change['key'], None)
+            else: journal['entries'].setdefault(change['key'], dict()).update(change)
+    if not head.endswith(b'\n'): journal['head'] = None   # replay again once it is complete
+    return journal['entries']
+
+
+def append(handle, changes: list) -> None:
+    """Appends manifest changes to a journal opened by locked()."""
+    handle.write(b''.join(json.dumps(i).encode('utf-8') + b'\n' for i in changes))
+    handle.flush()
+    return None
+
+
+def compact(root: str, params=params) -> None:
+    """ Rewrites a root's journal as one line per live entry, once it has grown to
+    params['compact_ratio'] lines per entry.  The rewrite starts with a random header line, so
+    other processes can tell it from the journal they last read.  Callers should hold locked(root).
+    """
+    entries = read_manifest(root)
+    if journals[root]['lines'] <= params['compact_ratio'] * max(len(entries), 16): return None
+    file_address = os.path.join(root, params['manifest'])
+    with open(file_address + '.tmp', 'wb') as f:
+        append(f, [dict(generation = os.urandom(8).hex())] + list(entries.values()))
+    os.replace(file_address + '.tmp', file_address)
+    read_manifest(root)
+    return None
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+def commit(temporary: str, file_address: str, producer: str, inputs=None, params=params) -> dict:
+    """ Moves a completely written temporary file into place as a cache file and registers it, in
+    one step under the manifest lock, so no reader ever sees the file without its entry.  Then
+    evicts the least recently read entries of the same root until the root fits in
+    params['max_bytes'] again, never the entry just committed.
+    Inputs:
+        temporary = where the file was written; may equal file_address for a file already in place
+        producer = the function that wrote the file, e.g. 'a6_spatial.build_index'
+        inputs = what the file was made from (any JSON-serializable value); lookup() treats
+            the file as stale if called with different inputs
+    Output: entry = the manifest entry
+    """
+    root, key = locate(file_address)
+    stat = os.stat(temporary)
+    entry = dict(
+        key = key, producer = producer, inputs = hash_inputs(inputs), size = stat.st_size,
+        sha256 = checksum(temporary), mtime = stat.st_mtime_ns, last_access = time.time())
+    with locked(root) as handle:
+        os.replace(temporary, file_address)
+        verified.add((root, key, stat.st_size, stat.st_mtime_ns))
+        read_manifest(root)
+        append(handle, [entry])
+        entries = read_manifest(root)
+        total = sum(i['size'] for i in entries.values())
+        for iter_entry in sorted(entries.values(), key=lambda x: x['last_access']):
+            if total <= params['max_bytes']: break
+            if iter_entry['key'] == key: continue
+            remove_file(os.path.join(root, *iter_entry['key'].split('/')))
+            append(handle, [dict(key = iter_entry['key'], removed = True)])
+            total -= iter_entry['size']
+        compact(root)
+    return entry
+
+
+def lookup(file_address: str, inputs=None, adopt=None, producer=None, any_inputs=False,
+        params=params):
+    """ Checks a cache file before it is read.  Returns file_address if it is registered, was
+    made from the same inputs, and still matches its recorded size (and, on its first read in
+    this process, its checksum), and records the read for LRU eviction unless one was recorded
+    in the last params['access_interval'] seconds.  Otherwise deletes the file and its entry, if
+    any, and returns None.
+    Inputs:
+        inputs = what the caller needs the file to have been made from; see commit()
+        any_inputs = True skips the inputs check, e.g. to verify entries whose inputs are unknown
+        adopt = optional check for files written before the manifest existed: a function of the
+            file address that returns True if the file is complete.  Files that pass are
+            registered (under producer) rather than deleted.
+    """
+    root, key = locate(file_address)
+    with locked(root):
+        entry = dict(read_manifest(root).get(key) or dict()) or None
+        stat = os.stat(file_address) if os.path.exists(file_address) else None
+    if (entry is None) and (stat is None): return None
+    if (entry is None) and (adopt is not None) and adopt(file_address):
+        commit(file_address, file_address, producer = producer or 'adopted', inputs = inputs)
+        return file_address
+
+    ## size and inputs first, then the (slower) checksum outside the lock
+    good = (entry is not None) and (stat is not None) and (stat.st_size == entry['size'])
+    good = good and (any_inputs or (entry['inputs'] == hash_inputs(inputs)))
+    state = (root, key, stat.st_size, stat.st_mtime_ns) if stat is not None else None
+    if good and params['verify'] and (state not in verified):
+        good = checksum(file_address) == entry['sha256']
+        if good: verified.add(state)
+    if good and (time.time() - entry['last_access'] < params['access_interval']):
+        return file_address
+
+    with locked(root) as handle:
+        current = read_manifest(root).get(key)
+        if good: append(handle, [dict(key = key, last_access = time.time())])
+        elif (current or dict()).get('sha256') != (entry or dict()).get('sha256'):
+            return None     # replaced while being checked; leave the new file alone
+        else:
+            if current is not None: append(handle, [dict(key = key, removed = True)])
+            remove_file(file_address)
+        compact(root)
+    return file_address if good else None
+
+
+def forget(file_address: str) -> None:
+    """Deletes a cache file and its manifest entry."""
+    root, key = locate(file_address)
+    with locked(root) as handle:
+        if key in read_manifest(root): append(handle, [dict(key = key, removed = True)])
+    remove_file(file_address)
+    return None
+
+
+def remove_file(file_address: str) -> None:
+    """Deletes a file if it exists."""
+    try: os.remove(file_address)
+    except FileNotFoundError: pass
+    return None
+
+
+def check_root(root=params['root_name'], params=params) -> dict:
+    """ Verifies every entry of a cache root against its file, dropping the entries (and files)
+    that fail, and summarizes the rest.
+    Output: summary = dict of entries, bytes, and the keys removed
+    """
+    with locked(root): keys = list(read_manifest(root).keys())
+    removed = [
+        i for i in keys if lookup(os.path.join(root, *i.split('/')), any_inputs = True) is None]
+    with locked(root): entries = read_manifest(root)
+    return dict(entries = len(entries), bytes = sum(i['size'] for i in entries.values()),
+        max_bytes = params['max_bytes'], removed = removed)
+
+
+##########==========##########==========##########==========##########==========##########==========
+## CODE TESTS
+
+if __name__ == '__main__':
+    print(json.dumps(check_root(), indent=1))
+
+##########==========##########==========##########==========##########==========##########==========
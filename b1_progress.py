@@ -6,9 +6,10 @@
         io_in/city_list.xlsx: provides information on the destinations I seek to visit and my
             progress visiting them.  Also provides information on color schema for figures.
     Outputs:
-        io_mid/PROGRESS.html: self-contained, fully-functional html file with all data displays.
-            Used during development to inspect data displays.  Is not tied into the project
-            css file, so some stylistic elements will be of lower quality.
+        io_mid/PROGRESS.html: fully-functional html file with all data displays, which loads the
+            shared plotly.js asset from io_out.  Used during development to inspect data
+            displays.  Is not tied into the project css file, so some stylistic elements will be
+            of lower quality.  Only written when debug_html is True.
         io_mid/PROGRESS.div: html code contained inside a <div> tag, suitable for injection into
             the project's main html product.
     Open GitHub Issues:
@@ -23,6 +24,8 @@ import warnings, sys
 if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')  
 import pandas as pd
 import plotly.graph_objects as go
+from a3_render import render_figure, read_sheet
+from a5_instrument import instrument
 
 ## set parameters
 params = {
@@ -41,13 +44,14 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 ## COMPONENT FUNCTIONS: Manipulate City Visit Data
 
 
+@instrument
 def import_data() -> pd.DataFrame:
     """Import primary dataset (city_list) from xlsx and construct useful columns.
     output: city_list = a dataset of information about the cities on my travel list.
     """
 
     ## import and merge data
-    city_list = pd.read_excel('io_in/city_list.xlsx', sheet_name = "Cities")
+    city_list = read_sheet('io_in/city_list.xlsx', sheet_name = "Cities")
 
     ## derive unvisited/ visited/ photographed counts
     city_list['status'] = 'Unvisited'
@@ -58,13 +62,14 @@ def import_data() -> pd.DataFrame:
     return city_list
 
 
+@instrument
 def import_color() -> pd.DataFrame:
     """Import color scheme, which is packaged in two tabs within the main city_list file.
     output: a matrix of colors, specified in hsva format.  Function use this file to 
         determine which colors on the plot.
     """
-    colors = pd.read_excel('io_in/city_list.xlsx', sheet_name = "Color", index_col = 0)
-    color_map = pd.read_excel('io_in/city_list.xlsx', sheet_name = "ColorMap").dropna()
+    colors = read_sheet('io_in/city_list.xlsx', sheet_name = "Color", index_col = 0)
+    color_map = read_sheet('io_in/city_list.xlsx', sheet_name = "ColorMap").dropna()
     for iter_row in color_map.index:
         colors[color_map.loc[iter_row, 'key']] = colors[color_map.loc[iter_row, 'hue']]
     return colors
@@ -74,6 +79,7 @@ def import_color() -> pd.DataFrame:
 ## COMPONENT FUNCTIONS: Render waffle chart visualizations
 
 
+@instrument
 def make_waffle(var:str, city_list:pd.DataFrame, colors:pd.DataFrame, params=params) -> pd.DataFrame:
     """Generates a pd.DataFrame with all the data necessary to draw a waffle plot, including
     colors, coordinates, and labels.
@@ -157,6 +163,7 @@ def make_waffle(var:str, city_list:pd.DataFrame, colors:pd.DataFrame, params=par
     return waffle_data
 
 
+@instrument
 def make_legend(waffle_data: pd.DataFrame, params=params) -> pd.DataFrame:
     """ The color scheme for the waffle plot is based on the two variables, requiring a customized
     legend.  This function generates a dataframe with all the information needed to draw it.
@@ -211,6 +218,7 @@ def make_legend(waffle_data: pd.DataFrame, params=params) -> pd.DataFrame:
 ## COMPONENT FUNCTIONS: Draw Figure
 
 
+@instrument
 def make_figure(params=params) -> go.Figure:
     """ Initialize an empty plotly object, so that write_figure can append visualization traces
     to it and write it to disk as html code (a div)
@@ -242,23 +250,23 @@ def make_figure(params=params) -> go.Figure:
     return fig
 
 
-def write_figure(fig: go.Figure, trace_dict: dict, slider=None) -> str:
-    """ Add sliders and traces to a plotly figure.  Write figure as both a self-contained html
-    file and also as an html div section.  The self-contained file is for testing / trouble-
-    shooting.  0_executve_project.py injects the div code into a data dashboard.
+@instrument
+def write_figure(fig: go.Figure, trace_dict: dict, slider=None, debug_html=False) -> str:
+    """ Add sliders and traces to a plotly figure.  Render figure as an html div section and
+    return it.  a1_execute_project.py injects the div code into a data dashboard.
     Inputs:
         fig = An empty plotly figure
         trace_dict =  a dict of plotly traces, which are added to fig
         slider = plotly slider specifications, which are also added to fig
+        debug_html = bool; if True, also write a debug html page for testing / trouble-
+            shooting.
     """
     fig = fig.add_traces([trace_dict[i] for i in trace_dict.keys()])
     fig = fig.update_layout(sliders = slider)
-    fig.write_html('io_mid/PROGRESS.html', full_html=True, include_plotlyjs=True)
-    fig.write_html('io_mid/PROGRESS.div', full_html=False, include_plotlyjs=False)
-    div = '\n'.join(open('io_mid/PROGRESS.div', 'rt').readlines())
-    return div
+    return render_figure(fig=fig, name='PROGRESS', debug_html=debug_html)
 
 
+@instrument
 def draw_waffle(name:str, waffle:pd.DataFrame, trace_dict:dict, size=20, visible=False) -> dict:
     """ Draws a waffle plot, using the plotly scatter plot function.  make_waffle() does all the
     calculations in advance.  draw_waffle() supplies the output from make_waffle() to the scatter
@@ -296,6 +304,7 @@ def draw_waffle(name:str, waffle:pd.DataFrame, trace_dict:dict, size=20, visible
     return trace_dict
 
 
+@instrument
 def draw_legend(name:str, legend:pd.DataFrame, trace_dict:dict, colors:pd.DataFrame, size=20,
                 visible=False) -> dict:
     """ Draws a waffle plot legend, using the plotly scatter plot function.  make_legend() does
@@ -332,6 +341,7 @@ def draw_legend(name:str, legend:pd.DataFrame, trace_dict:dict, colors:pd.DataFr
     return trace_dict
 
 
+@instrument
 def add_slider(trace_dict:dict, colors:pd.DataFrame, order=['Total','Criteria','Region']) -> list:
     """ Generates slider specifications for the plotly object.
     Input:
@@ -369,9 +379,10 @@ def add_slider(trace_dict:dict, colors:pd.DataFrame, order=['Total','Criteria','
 ## TOP-LEVEL FUNCTIONS
 
 
-def draw_progress_panel() -> None:
-    """ Executes all of the functions defined above.  Loaded in 0_execute_project.py in order
-    to execute the full project.
+@instrument
+def draw_progress_panel(debug_html=False) -> str:
+    """ Executes all of the functions defined above.  Loaded in a1_execute_project.py in order
+    to execute the full project.  Returns the panel as an html div str.
     """
 
     ## import and refine data
@@ -406,10 +417,10 @@ def draw_progress_panel() -> None:
     ## generate slider
     slider= add_slider(trace_dict, colors=colors)
 
-    ## attach waffles and legends to figure object, then write to disk as html div code
+    ## attach waffles and legends to figure object, then render as html div code
     fig = make_figure()
-    write_figure(fig=fig, trace_dict=trace_dict, slider=slider)
-    return None
+    div = write_figure(fig=fig, trace_dict=trace_dict, slider=slider, debug_html=debug_html)
+    return div
 
 
 ##########==========##########==========##########==========##########==========##########==========
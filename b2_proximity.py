@@ -2,11 +2,13 @@
 distances between them in dendrogram format.  These figures are a trip planning tool, enabling
 me to see at a glance where there are clusters of unphotographed locations currently experiencing
 the country's most decent weather.
+Each month's dendrogram is drawn at a bounded level of detail: below the top params['lod']
+merges, groups of destinations collapse into summary nodes, which expand when clicked.
 Input:
     import_data() reads in destination-wise data on my past travels, as well as the color
     pallette for this project.  Both are tabs in the io_in/city_list.xlsx spreadsheet.
-Output: write_figure() writes an html file to io_mid/PROMIXITY.div. the execute_project.py module
-    injects this code into an html data dashboard.
+Output: write_figure() renders the figure as an html div, which the a1_execute_project.py module
+    injects into an html data dashboard.  A copy is cached to io_mid/PROXIMITY.div.
 Open GitHub Issues:
     #22 refactor to streamline and pay down technical debt. (Low priority)
 """
@@ -16,10 +18,16 @@ Open GitHub Issues:
 ## import packages
 import os, sys, datetime
 if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')  
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from scipy.cluster import hierarchy
+from sklearn.cluster import MiniBatchKMeans
 from pyproj import Proj
+from a3_render import render_figure, read_sheet, params as render_params
+from a2_weather import destination_weather, station_weather
+from a5_instrument import instrument
+from a6_spatial import describe_nearby, condensed_distances, subset_distances, to_cartesian
 
 ## set parameters
 params = dict(
@@ -31,12 +39,137 @@ params = dict(
         'border':{'Photographed':'M' , 'Visited':'LM', 'Unvisited':'LM', 'Bracket':'LM'},
         'fill':  {'Photographed':'MS', 'Visited':'MS', 'Unvisited':'S' , 'Bracket':'MS' }
         },
+    render = dict(precision = 4),
+    ## 'temperate' ranks months on temperate hours, 'comfort' on comfortable hours (a2_weather)
+    weather_metric = 'temperate',
+    ## 'haversine' clusters on great-circle miles from a6_spatial's cached distance matrix;
+    ## 'lcc' clusters on the projected x / y from project_coordinates()
+    distance = 'haversine',
+    ## how each month's destinations are clustered:
+    ##   'ward' = scipy's Ward linkage on a distance matrix; O(n^2) memory
+    ##   'nn_chain' = nearest-neighbor-chain Ward on coordinates; O(n) memory, O(n^2) time
+    ##   'two_level' = pre-clusters by k-means or grid, then Ward within and among them
+    ##   'auto' = the most exact backend whose size limit the month's destinations fit under
+    cluster = dict(
+        backend = 'auto',
+        auto_limits = dict(ward = 3000, nn_chain = 5000),
+        optimal_ordering = 500,     # reorder leaves optimally up to this many destinations
+        pre_cluster = 'kmeans',     # or 'grid'
+        groups = 1000,              # k-means pre-clusters
+        grid_miles = 25,            # grid pre-cluster cell size
+        seed = 0,
+        ),
+    ## level of detail: each month's tree is drawn down to at most max_leaves destinations and
+    ## summary nodes, with lower merges (and any below collapse_miles) collapsed into summary
+    ## nodes.  Clicking a summary node shows up to expand_leaves more; clicking a merge collapses
+    ## it again.
+    lod = dict(max_leaves = 100, collapse_miles = 0, expand_leaves = 20),
     )
 
+## runs after the figure is drawn: clicking a summary node expands it (and its highest
+## descendants, up to params['lod']['expand_leaves'] nodes), and clicking a merge node collapses
+## it.  The visible tree is laid out again exactly as layout_tree() does and the month's traces
+## are rewritten in place.  Months with nothing collapsed carry no tree and ignore clicks.
+expand_on_click = '''
+(() => {
+    const gd = document.getElementById('{plot_id}');
+    const monthTraces = (month) => Object.fromEntries(gd.data
+        .filter((trace) => (trace.uid || '').startsWith(month + '∆'))
+        .map((trace) => [trace.uid.slice(month.length + 1), trace]));
+
+    const layoutTree = (tree, expanded) => {
+        const count = tree.leaf_name.length, rows = tree.height.length;
+        const x = new Float64Array(count + rows), y = new Float64Array(count + rows);
+        const units = [], merges = [], stack = [count + rows - 1];
+        while (stack.length) {
+            const node = stack.pop();
+            if (node >= count && expanded[node - count]) {
+                merges.push(node - count);
+                stack.push(tree.right[node - count], tree.left[node - count]);
+            } else units.push(node);
+        }
+        units.forEach((node, k) => {
+            x[node] = node < count ? 0 : tree.height[node - count];
+            y[node] = (10 * k + 5) / (10 * units.length - 5);
+        });
+        merges.sort((a, b) => a - b).forEach((row) => {
+            x[count + row] = tree.height[row];
+            y[count + row] = (y[tree.left[row]] + y[tree.right[row]]) * 0.5;
+        });
+        return {count, x, y, units, merges};
+    };
+
+    const redraw = (month, meta) => {
+        const traces = monthTraces(month), tree = meta.tree;
+        const {count, x, y, units, merges} = layoutTree(tree, meta.expanded);
+        tree.colors.forEach((hue, k) => Object.assign(traces['bracket∆' + k], {x: [], y: []}));
+        merges.forEach((row) => {
+            const trace = traces['bracket∆' + tree.color[row]], h = tree.height[row];
+            const l = tree.left[row], r = tree.right[row];
+            trace.x.push(x[l], h, h, x[r], null);
+            trace.y.push(y[l], y[l], y[r], y[r], null);
+        });
+
+        const leaves = units.filter((node) => node < count);
+        const line = leaves.map((i) => tree.leaf_line[i]);
+        const fill = leaves.map((i) => tree.leaf_fill[i]);
+        const leaf = traces.leaf_nodes;
+        Object.assign(leaf, {x: leaves.map(() => 0), y: leaves.map((i) => y[i]),
+            text: leaves.map((i) => tree.leaf_name[i]),
+            hovertext: leaves.map((i) => tree.leaf_hover[i])});
+        leaf.textfont = {...leaf.textfont, color: line};
+        leaf.marker = {...leaf.marker, color: fill, line: {...leaf.marker.line, color: line}};
+        leaf.hoverlabel = {...leaf.hoverlabel, bgcolor: fill, bordercolor: line,
+            font: {...(leaf.hoverlabel.font || {}), color: line}};
+
+        const summaries = units.filter((node) => node >= count).map((node) => node - count);
+        Object.assign(traces.summary_nodes, {x: summaries.map((row) => tree.height[row]),
+            y: summaries.map((row) => y[count + row]), customdata: summaries,
+            text: summaries.map((row) => tree.name[row]),
+            hovertext: summaries.map((row) => '<b>' + tree.name[row] + '</b><br>' +
+                tree.leaves[row] + ' destinations, ' +
+                Math.round(100 * tree.photographed[row] / tree.leaves[row]) +
+                '% photographed<br>Click to expand')});
+
+        const shown = merges.filter((row) => tree.height[row] < meta.too_high);
+        [['upper_merge_nodes', (h) => h >= meta.label_height],
+         ['lower_merge_nodes', (h) => h < meta.label_height]].forEach(([part, keep]) => {
+            const rows = shown.filter((row) => keep(tree.height[row]));
+            Object.assign(traces[part], {x: rows.map((row) => tree.height[row]),
+                y: rows.map((row) => y[count + row]), customdata: rows,
+                text: rows.map((row) => tree.name[row])});
+        });
+        Plotly.redraw(gd);
+    };
+
+    gd.on('plotly_click', (event) => {
+        const point = event.points[0], uid = point.data.uid || '';
+        const month = uid.split('∆')[0], part = uid.slice(month.length + 1);
+        const meta = (monthTraces(month).summary_nodes || {}).meta;
+        if (!meta || !meta.tree || point.customdata === undefined) return;
+        const tree = meta.tree, count = tree.leaf_name.length;
+        if (part === 'summary_nodes') {
+            const below = [], stack = [point.customdata];
+            while (stack.length) {
+                const row = stack.pop();
+                below.push(row);
+                [tree.left[row], tree.right[row]].forEach((child) => {
+                    if (child >= count) stack.push(child - count); });
+            }
+            below.sort((a, b) => b - a).slice(0, Math.max(meta.expand_leaves - 1, 1))
+                .forEach((row) => { meta.expanded[row] = true; });
+        } else if (part.endsWith('merge_nodes')) meta.expanded[point.customdata] = false;
+        else return;
+        redraw(month, meta);
+    });
+})();
+'''
+
 ##########==========##########==========##########==========##########==========##########==========
 ## COMPONENT FUNCTIONS - import and enrich data
 
-def import_data() -> pd.DataFrame:
+@instrument
+def import_data(params=params) -> pd.DataFrame:
     """ Imports a dataset of my travels plus the color palette for the project.  Both come from
     tabs in the io_in/city_list.xlsx file.
     Outputs:
@@ -46,30 +179,28 @@ def import_data() -> pd.DataFrame:
         colors = the color pallette for this project.
     """
     ## import color matrix
-    colors = pd.read_excel('io_in/city_list.xlsx', sheet_name = "Color", index_col = 0)
-    color_map = pd.read_excel('io_in/city_list.xlsx', sheet_name = "ColorMap").dropna()
+    colors = read_sheet('io_in/city_list.xlsx', sheet_name = "Color", index_col = 0)
+    color_map = read_sheet('io_in/city_list.xlsx', sheet_name = "ColorMap").dropna()
     for iter_row in color_map.index:
         colors[color_map.loc[iter_row, 'key']] = colors[color_map.loc[iter_row, 'hue']]
 
     ## import city data and calculate useful variables
-    city_list = pd.read_excel(os.path.join('io_in', 'city_list.xlsx'), index_col = 0)
+    city_list = read_sheet(
+        os.path.join('io_in', 'city_list.xlsx'), sheet_name = 'Cities', index_col = 0)
     city_list['status'] = 'Unvisited'
     city_list.loc[city_list['visit'].astype(bool), 'status'] = 'Visited'
     city_list.loc[~city_list['photo_date'].isna(), 'status'] = 'Photographed'
 
-    ## import weather data and identify best months to visit each city
-    weather_data = pd.read_excel(os.path.join('io_mid', 'weather_data.xlsx'), index_col=0)
-    best_quantile = weather_data.quantile(0.75, axis=0).values
-    best_quantile = pd.DataFrame(
-        data={i:best_quantile for i in weather_data.index}, index=weather_data.columns).T
+    ## import weather data and identify best months to visit each city; quartiles are taken over
+    ## stations, and compared against each destination's own (possibly interpolated) weather
+    weather_data = station_weather(params['weather_metric'])
+    best_quantile = weather_data.quantile(0.75, axis=0)
+    weather_data = destination_weather(city_list, params['weather_metric'])[best_quantile.index]
     best_months = (weather_data >= best_quantile) & (weather_data >= 4)
-
-    ## align weather data to city_list
-    best_months = best_months.loc[city_list['noaa_station'].values]
-    best_months.index = city_list.index
     return city_list, best_months, colors
 
 
+@instrument
 def assign_colors(city_list:pd.DataFrame, colors:pd.DataFrame, params=params) -> pd.DataFrame:
     """ Allocates colors from the project color palette matrix to city_list.  Function assigns
     each city the project's main color or main gray, depending on whether I have already 
@@ -95,10 +226,127 @@ def assign_colors(city_list:pd.DataFrame, colors:pd.DataFrame, params=params) ->
     return city_list
 
 
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - clustering backends
+## Every backend returns a scipy linkage matrix: one row per merge holding [left, right, height,
+## leaves], where ids below n are destinations and id n + i is the cluster formed in row i.
+
+
+def choose_backend(count: int, params=params) -> str:
+    """Resolves params['cluster']['backend'] for a set of count destinations."""
+    backend = params['cluster']['backend']
+    if backend != 'auto': return backend
+    if count <= params['cluster']['auto_limits']['ward']: return 'ward'
+    if count <= params['cluster']['auto_limits']['nn_chain']: return 'nn_chain'
+    return 'two_level'
+
+
+def cluster_coordinates(city_list: pd.DataFrame, params=params) -> np.ndarray:
+    """ Euclidean coordinates (miles) for the coordinate-based backends: x, y, z from the earth's
+    center when clustering on great-circle distances, or the projected x / y otherwise.
+    """
+    if params['distance'] == 'haversine': return to_cartesian(city_list)
+    return city_list[['x', 'y']].to_numpy(dtype = float)
+
+
+def relabel_merges(merges: list, count: int) -> np.ndarray:
+    """ Turns merges recorded as (any destination in the left cluster, any destination in the
+    right cluster, height, leaves) into a scipy linkage matrix.  Sorts them by height, stably, so
+    a merge never comes before the merges that formed its children, then numbers the clusters
+    the way scipy does.
+    """
+    merges = np.array(merges, dtype = float).reshape(-1, 4)
+    merges = merges[np.argsort(merges[:, 2], kind = 'stable')]
+    parent = np.arange(0, 2 * count - 1)
+    def find(node):
+        """helper function to find the cluster a destination currently belongs to"""
+        root = node
+        while parent[root] != root: root = parent[root]
+        while parent[node] != root: parent[node], node = root, parent[node]
+        return root
+    for iter_row in range(0, merges.shape[0]):
+        left, right = find(int(merges[iter_row, 0])), find(int(merges[iter_row, 1]))
+        merges[iter_row, 0:2] = min(left, right), max(left, right)
+        parent[left] = parent[right] = count + iter_row
+    return merges
+
+
+def nn_chain_ward(coords: np.ndarray, leaves=None) -> list:
+    """ Ward's method by nearest-neighbor chain: follows a chain of nearest clusters until two
+    are each other's nearest, merges them, and carries on from the rest of the chain.  Works from
+    cluster centroids and sizes alone, so memory is O(n) rather than a distance matrix's O(n^2).
+    Heights match scipy's Ward linkage on the same coordinates.
+    Inputs:
+        coords = (n, d) array of Euclidean coordinates
+        leaves = optional starting size of each point (e.g. of pre-clusters); defaults to 1
+    Output: merges = (left, right, height, leaves) tuples in the order found, naming each cluster
+        by one of its points; see relabel_merges()
+    """
+    centroid = np.array(coords, dtype = float)
+    size = np.ones(centroid.shape[0]) if leaves is None else np.array(leaves, dtype = float)
+    names = np.arange(0, centroid.shape[0])
+    merges, chain = list(), list()
+    while names.size > 1:
+        if not chain: chain = [0]
+        while True:
+            a = chain[-1]
+            cost = 2 * size[a] * size / (size[a] + size) * (
+                (centroid - centroid[a])**2).sum(axis = 1)
+            cost[a] = np.inf
+            b = int(cost.argmin())
+            if len(chain) > 1 and cost[chain[-2]] <= cost[b]: b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]: break
+            chain.append(b)
+        chain = chain[0:-2]
+
+        ## the merged cluster keeps b's slot; a's slot is dropped
+        merges.append((names[a], names[b], np.sqrt(cost[b]), size[a] + size[b]))
+        centroid[b] = (size[a] * centroid[a] + size[b] * centroid[b]) / (size[a] + size[b])
+        size[b] += size[a]
+        keep = np.arange(0, names.size) != a
+        centroid, size, names = centroid[keep], size[keep], names[keep]
+        chain = [i - (i > a) for i in chain]
+    return merges
+
+
+def pre_cluster(coords: np.ndarray, params=params) -> np.ndarray:
+    """Assigns each point to a k-means or grid-cell group; returns group ids 0..k-1."""
+    if params['cluster']['pre_cluster'] == 'grid':
+        cells = np.floor(coords / params['cluster']['grid_miles']).astype(np.int64)
+        return np.unique(cells, axis = 0, return_inverse = True)[1].ravel()
+    groups = MiniBatchKMeans(n_clusters = min(params['cluster']['groups'], coords.shape[0]),
+        random_state = params['cluster']['seed'], n_init = 3).fit_predict(coords)
+    return np.unique(groups, return_inverse = True)[1]
+
+
+def two_level_ward(coords: np.ndarray, params=params) -> np.ndarray:
+    """ Approximate Ward linkage for large point sets.  Pre-clusters the points (pre_cluster()),
+    runs Ward within each group, then runs Ward on the groups' centroids, weighted by their sizes.
+    A group's merge is raised to at least the height of its tallest internal merge, so the tree
+    stays monotonic.  Time is roughly O(n^2 / k + k^2) for k groups.
+    """
+    groups = pre_cluster(coords, params=params)
+    members = np.split(np.argsort(groups, kind = 'stable'), np.cumsum(np.bincount(groups))[0:-1])
+    merges, height = list(), np.zeros(len(members))
+    for iter_group, iter_members in enumerate(members):
+        for left, right, up, leaves in nn_chain_ward(coords[iter_members]):
+            merges.append((iter_members[left], iter_members[right], up, leaves))
+            height[iter_group] = max(height[iter_group], up)
+
+    ## merge the groups; each merged cluster keeps the name of its right-hand group
+    centroids = np.array([coords[i].mean(axis = 0) for i in members])
+    sizes = np.array([i.size for i in members])
+    for left, right, up, leaves in nn_chain_ward(centroids, leaves = sizes):
+        height[right] = max(up, height[left], height[right])
+        merges.append((members[left][0], members[right][0], height[right], leaves))
+    return relabel_merges(merges, coords.shape[0])
+
+
 ##########==========##########==========##########==========##########==========##########==========
 ## COMPONENT FUNCTIONS - generate distance hierarchy
 
 
+@instrument
 def project_coordinates(city_list: pd.DataFrame) -> pd.DataFrame:
     """ scipy's dendrogram generation code does not filly support geographic coordinates. This
     function converts destination coordinates to something approximating Euclidean coordinates
@@ -108,35 +356,48 @@ def project_coordinates(city_list: pd.DataFrame) -> pd.DataFrame:
             and travel goals
     """
     project_lcc = Proj(proj = 'lcc +lon_0=-99.58 +lat_1=24.54 +lat_2=49.38', ellsp = 'WGS84')
-    city_list['x'] = 0.0
-    city_list['y'] = 0.0
-    for iter_row in city_list.index:
-        city_list.loc[iter_row, ['x','y']] = project_lcc(
-            max(city_list.loc[iter_row, 'lon'], -179),
-            max(city_list.loc[iter_row, 'lat'], 0),
-            )
+    city_list['x'], city_list['y'] = project_lcc(
+        city_list['lon'].clip(lower = -179).to_numpy(dtype = float),
+        city_list['lat'].clip(lower = 0).to_numpy(dtype = float))
     city_list['x'] = (city_list['x'] / 1609.34).round().astype(int)
     city_list['y'] = (city_list['y'] / 1609.34).round().astype(int)
     return city_list
 
 
-def make_hierarchy_linkage(city_list: pd.DataFrame) -> pd.DataFrame:
+@instrument
+def make_hierarchy_linkage(city_list: pd.DataFrame, distances=None, params=params) -> pd.DataFrame:
     """ Calculates the hierarchy of merges that clusters my travel destinations into geographically
-    proximate groups.
+    proximate groups, with the backend choose_backend() picks for their number.
     Inputs:
         city_list = project's main dataset.  Provides destination-wise information about my travels
             and travel goals
+        distances = optional condensed distance matrix among city_list's rows (see a6_spatial),
+            for the 'ward' backend.  When omitted, distances come from cluster_coordinates().
+        params = The parameters dictionary defined at the top of this script.
     """
-    city_names = {i:city_list['city'].iat[i] for i in range(0, city_list.shape[0])}
-    linkage = hierarchy.linkage(y = city_list[['x', 'y']], method = 'ward', optimal_ordering = True)
+    count = city_list.shape[0]
+    backend = choose_backend(count, params=params)
+    coords = cluster_coordinates(city_list, params=params)
+    y = coords if distances is None else distances
+    if backend == 'ward': linkage = hierarchy.linkage(y, method = 'ward')
+    elif backend == 'nn_chain': linkage = relabel_merges(nn_chain_ward(coords), count)
+    elif backend == 'two_level': linkage = two_level_ward(coords, params=params)
+    else: raise ValueError('Unknown clustering backend: ' + str(backend))
+    if count <= params['cluster']['optimal_ordering']:
+        linkage = hierarchy.optimal_leaf_ordering(linkage, y)
+
     linkage = pd.DataFrame(linkage, columns = ['left', 'right', 'distance', 'leaves'])
-    linkage['up'] = linkage.index + city_list.shape[0]
+    linkage['up'] = linkage.index + count
     linkage = linkage.astype({'left': int, 'right': int, 'leaves': int})
-    linkage['left_name'] = linkage['left'].copy().replace(city_names)
-    linkage['right_name'] = linkage['right'].copy().replace(city_names)
+    city_names = city_list['city'].to_numpy(dtype = object)
+    for iter_side in ['left', 'right']:
+        ids = linkage[iter_side].to_numpy()
+        linkage[iter_side + '_name'] = np.where(
+            ids < count, city_names[np.minimum(ids, count - 1)], ids)
     return linkage
 
 
+@instrument
 def name_composite_nodes(city_list: pd.DataFrame, linkage: pd.DataFrame) -> pd.DataFrame:
     """ Recevies a hierarchy of merges that clusters my travel destinations into geographically
     proximate groups from make_hierarchy_linkage(). Generates names for each merge group, based
@@ -147,151 +408,223 @@ def name_composite_nodes(city_list: pd.DataFrame, linkage: pd.DataFrame) -> pd.D
         linkage = a merge hierarchy that lumps destinations into sucessfully larger groups based
             on geographic proximity.  Is the output from make_hierarchy_linkage()
     """
-    ## compile all cities for each merge
-    linkage['up_name'] = ''
-    for iter_row in linkage.index:
-        linkage.loc[iter_row, 'up_name'] = (
-            linkage.loc[iter_row, 'left_name'] + ',' + linkage.loc[iter_row, 'right_name'])
-        linkage['left_name'] = linkage['left_name'].replace({
-            linkage.loc[iter_row, 'up']: linkage.loc[iter_row, 'up_name']})
-        linkage['right_name'] = linkage['right_name'].replace({
-            linkage.loc[iter_row, 'up']: linkage.loc[iter_row, 'up_name']})
-        
-    ## simplify composite names to most central city plus count
-    for iter_row in linkage.index:
-        city_now = linkage.loc[iter_row, 'up_name'].split(',')
-        xy_now = city_list.loc[city_list['city'].isin(city_now), ['city', 'x', 'y']]
-        xy_now[['x', 'y']] = xy_now[['x', 'y']] - xy_now[['x', 'y']].median()
-        xy_now['centrality'] = (xy_now[['x', 'y']] ** 2).sum(axis = 1)
-        label_now = xy_now.loc[xy_now['centrality'] == xy_now['centrality'].min(), 'city'].values[0]
-        label_now = label_now + ' +' + str(xy_now.shape[0] - 1)
-        linkage.loc[iter_row, 'up_name'] = label_now
-    
+    ## compile the destinations in each merge (row positions in city_list, in city_list order);
+    ## each cluster is merged exactly once, so its members can be handed up to its parent
+    count = city_list.shape[0]
+    city_names = city_list['city'].to_numpy(dtype = object)
+    xy = city_list[['x', 'y']].to_numpy(dtype = float)
+    members = {i: np.array([i]) for i in range(0, count)}
+    up_name = list()
+    for left, right in zip(linkage['left'], linkage['right']):
+        city_now = np.sort(np.concatenate([members.pop(left), members.pop(right)]))
+        members[count + len(up_name)] = city_now
+
+        ## name composites after their most central city plus count
+        xy_now = xy[city_now] - np.median(xy[city_now], axis = 0)
+        label_now = city_names[city_now[(xy_now ** 2).sum(axis = 1).argmin()]]
+        up_name.append(label_now + ' +' + str(city_now.size - 1))
+    linkage['up_name'] = up_name
+
+    ## merges of composites refer to them by name
+    up_name = np.array(up_name, dtype = object)
+    for iter_side in ['left', 'right']:
+        ids = linkage[iter_side].to_numpy()
+        linkage.loc[ids >= count, iter_side + '_name'] = up_name[ids[ids >= count] - count]
     return linkage
 
 
-def make_hierarchy_dendrogram(city_list:pd.DataFrame, linkage:pd.DataFrame, colors:pd.DataFrame,
-                              params=params) -> pd.DataFrame:
-    """ Uses the merge hierarchy that make_hierarchy_linkage() generated to represent proximity
-    among destinations.  Formulates a dendrogram representation of the merge hierarchy. 
+@instrument
+def make_hierarchy_tree(city_list:pd.DataFrame, linkage:pd.DataFrame, colors:pd.DataFrame,
+                        params=params) -> dict:
+    """ Collects what drawing the merge hierarchy needs, for every merge and every destination,
+    whether or not it ends up drawn.  The same dict is handed to the browser (see label_nodes())
+    so that collapsed merges can be expanded there.
     Inputs:
         city_list = project's main dataset.  Provides destination-wise information about my travels
             and travel goals
         linkage = a merge hierarchy that lumps destinations into sucessfully larger groups based
-            on geographic proximity.  Is the output from make_hierarchy_linkage()
+            on geographic proximity.  Is the output from name_composite_nodes()
         colors = project's color palette matrix.  Projects the standard colors used across the
             project.
         params = The parameters dictionary defined at the top of this script.  Provides easy
             access to parameters that might need adjustment.
+    Output: tree = dict of lists.  Per merge: left, right (child ids, as in linkage), height,
+        name, leaves, photographed (count of photographed destinations beneath), and color (index
+        into colors, the distinct bracket colors).  Per destination: leaf_name, leaf_hover,
+        leaf_line, and leaf_fill.
     """
+    count = city_list.shape[0]
+    left, right = linkage['left'].to_numpy(), linkage['right'].to_numpy()
+    status = city_list['status'].to_numpy()
+
+    ## brackets take the color of an unphotographed destination directly beneath them, else grey
+    color = np.full(left.size, colors.loc[params['shading']['border']['Bracket'], 'grey'],
+        dtype = object)
+    for iter_child in [left, right]:
+        idx = iter_child < count
+        idx[idx] = status[iter_child[idx]] != 'Photographed'
+        color[idx] = city_list['color_line'].to_numpy(dtype = object)[iter_child[idx]]
+    palette, color = np.unique(color.astype(str), return_inverse = True)
+
+    ## count photographed destinations beneath each merge
+    photographed = np.concatenate([status == 'Photographed', np.zeros(left.size)]).astype(int)
+    for iter_row, (iter_left, iter_right) in enumerate(zip(left, right)):
+        photographed[count + iter_row] = photographed[iter_left] + photographed[iter_right]
+
+    return dict(
+        left = left.tolist(), right = right.tolist(),
+        height = linkage['distance'].round(2).tolist(),
+        name = linkage['up_name'].tolist(),
+        leaves = linkage['leaves'].tolist(),
+        photographed = photographed[count::].tolist(),
+        color = color.ravel().tolist(), colors = palette.tolist(),
+        leaf_name = city_list['city'].tolist(),
+        leaf_hover = ('<b>' + city_list['city'] + '</b><br>' + city_list['nearby']).tolist(),
+        leaf_line = city_list['color_line'].tolist(),
+        leaf_fill = city_list['color_fill'].tolist(),
+        )
 
-    ## extract bracket coordiantes
-    dendrogram = hierarchy.dendrogram(linkage[['left', 'right', 'distance', 'leaves']].values,
-        no_plot = True, labels = city_list['city'].values, get_leaves = True)
-    extract_xy = lambda x: pd.DataFrame(dendrogram[x], columns = [x + str(i) for i in range(0, 4)])
-    dendrogram = pd.concat([extract_xy('icoord'), extract_xy('dcoord')], axis = 1)
 
-    ## attach city information to brackets and filter out the highest brackets
-    dendrogram = dendrogram.merge(right = linkage[['distance', 'left_name', 'right_name', 'up_name']],
-        left_on = 'dcoord1', right_on = 'distance', how = 'left').drop(columns = 'distance')
-    
-    ## normalize icoord
-    icoords = ['icoord' + str(i) for i in range(0, 4)]
-    dendrogram[icoords] =  dendrogram[icoords] / dendrogram[icoords].max().max()
-
-    ## compile color information
-    dendrogram['color'] = colors.loc[params['shading']['border']['Bracket'], 'grey']
-    dendrogram = dendrogram.merge(
-        right=city_list[['city', 'color_line','status']].rename(
-            columns={'color_line':'left_color','status':'left_status'}),
-        how='left', left_on='left_name', right_on='city'
-        ).drop(columns='city')
-    dendrogram = dendrogram.merge(
-        right=city_list[['city', 'color_line', 'status']].rename(
-            columns={'color_line':'right_color','status':'right_status'}),
-        how='left', left_on='right_name', right_on='city'
-        ).drop(columns='city')
-    
-    ## determine line color
-    idx = (dendrogram['left_status'] != 'Photographed') & (~dendrogram['left_status'].isna())
-    dendrogram.loc[idx, 'color'] = dendrogram.loc[idx, 'left_color']
-    idx = (dendrogram['right_status'] != 'Photographed') & (~dendrogram['right_status'].isna())
-    dendrogram.loc[idx, 'color'] = dendrogram.loc[idx, 'right_color']
-
-    return dendrogram
+def choose_expanded(tree: dict, params=params) -> list:
+    """ The initial level of detail: expands merges from the top of the tree down until
+    params['lod']['max_leaves'] destinations and summary nodes are showing, leaving any merge
+    lower than params['lod']['collapse_miles'] collapsed.  A merge always comes after its
+    children in the linkage, so the last rows are the top of the tree.
+    Output: expanded = list of bools, one per merge
+    """
+    rows = len(tree['height'])
+    expanded = np.arange(0, rows) >= rows - (params['lod']['max_leaves'] - 1)
+    expanded &= np.array(tree['height']) >= params['lod']['collapse_miles']
+    return expanded.tolist()
+
+
+@instrument
+def layout_tree(tree: dict, expanded: list) -> tuple:
+    """ Lays out the visible part of the tree the way scipy's dendrogram() lays out a whole one:
+    destinations and collapsed merges ("summary nodes") are spaced evenly down the y axis in
+    left-to-right order, and each expanded merge sits at its height, midway between its children.
+    The expand_on_click script repeats this layout in the browser.
+    Inputs:
+        tree = output of make_hierarchy_tree()
+        expanded = list of bools, one per merge; see choose_expanded()
+    Outputs:
+        nodes = DataFrame of visible nodes: id (as in linkage), kind (leaf, summary, or merge),
+            row (the merge's position in linkage; -1 for destinations), dcoord, and icoord
+        brackets = DataFrame of bracket coordinates (dcoord0-3, icoord0-3), one per visible merge
+    """
+    count, rows = len(tree['leaf_name']), len(tree['height'])
+    left, right, height = [np.array(tree[i]) for i in ['left', 'right', 'height']]
+
+    ## walk the visible tree left-first; destinations and collapsed merges are the new leaves
+    units, merges, stack = list(), list(), [count + rows - 1]
+    while stack:
+        node = stack.pop()
+        if node >= count and expanded[node - count]:
+            merges.append(node - count)
+            stack.extend([right[node - count], left[node - count]])
+        else: units.append(node)
+    units, merges = np.array(units), np.sort(merges).astype(int)
+
+    ## position the leaves, then each merge from its children
+    x, y = np.zeros(count + rows), np.zeros(count + rows)
+    x[units] = np.where(units < count, 0, height[np.maximum(units - count, 0)])
+    y[units] = (10 * np.arange(0, units.size) + 5) / (10 * units.size - 5)
+    for iter_row in merges:
+        x[count + iter_row] = height[iter_row]
+        y[count + iter_row] = (y[left[iter_row]] + y[right[iter_row]]) * 0.5
+
+    ids = np.concatenate([units, count + merges])
+    nodes = pd.DataFrame(dict(
+        id = ids,
+        kind = np.where(ids < count, 'leaf', 'summary'),
+        row = np.where(ids < count, -1, ids - count),
+        dcoord = x[ids], icoord = y[ids]))
+    nodes.loc[units.size::, 'kind'] = 'merge'
+    brackets = pd.DataFrame(dict(
+        row = merges,
+        dcoord0 = x[left[merges]], dcoord1 = height[merges],
+        dcoord2 = height[merges], dcoord3 = x[right[merges]],
+        icoord0 = y[left[merges]], icoord1 = y[left[merges]],
+        icoord2 = y[right[merges]], icoord3 = y[right[merges]]))
+    return nodes, brackets
+
+
+@instrument
+def extract_leaf_nodes(nodes:pd.DataFrame, tree:dict) -> pd.DataFrame:
+    """ Extracts info. about the visible terminal nodes ("leaves"; the destinations)
+    Inputs:
+        nodes = visible nodes, from layout_tree()
+        tree = output of make_hierarchy_tree()
+    """
+    leaf_nodes = nodes.loc[nodes['kind'] == 'leaf', ['id', 'icoord', 'dcoord']]
+    for iter_key in ['name', 'hover', 'line', 'fill']:
+        leaf_nodes[iter_key] = np.array(tree['leaf_' + iter_key], dtype = object)[leaf_nodes['id']]
+    leaf_nodes = leaf_nodes.rename(columns = {'line': 'color_line', 'fill': 'color_fill'})
+    return leaf_nodes.reset_index(drop = True)
 
 
-def extract_leaf_nodes(hierarchy_dendrogram:pd.DataFrame, city_list:pd.DataFrame) -> pd.DataFrame:
-    """ Extracts info. about terminal nodes ("leaves"; the destinations) from dendrogram object"
+@instrument
+def extract_summary_nodes(nodes:pd.DataFrame, tree:dict) -> pd.DataFrame:
+    """ Extracts info. about the visible collapsed merges ("summary nodes"), each standing in for
+    the destinations beneath it, with their count and photographed share.
     Inputs:
-        hierarchy_dendrogram = Coordinates needed to draw a dendrogram representation of a 
-            the distances between destinations
-        city_list = project's main dataset.  Provides destination-wise information about my travels
-            and travel goals
+        nodes = visible nodes, from layout_tree()
+        tree = output of make_hierarchy_tree()
     """
-    ## extract terminal node coordinates
-    def get_node_coords(num, hd = hierarchy_dendrogram):
-        """helper function to extract coordinates for each destination in the dendrogram"""
-        i = [['left_name', '', '', 'right_name'][num]]
-        i = i + ['icoord' + str(num), 'dcoord' + str(num)]
-        hd = hd.copy()[i]
-        hd.columns = ['name', 'icoord', 'dcoord']
-        return hd
-    dendrogram_nodes = pd.concat([get_node_coords(num = 0), get_node_coords(num = 3)])
-    dendrogram_nodes = dendrogram_nodes.loc[dendrogram_nodes['dcoord'] == 0]
-
-    ## formulate colors
-    dendrogram_nodes = dendrogram_nodes.merge(right = city_list[['city','color_line','color_fill']],
-        how='left', left_on='name', right_on='city')
-    return dendrogram_nodes.reset_index(drop = True)
-
-
-def extract_merge_nodes(hierarchy_dendrogram:pd.DataFrame, colors:pd.DataFrame, params=params):
-    """ Extracts info. about non-terminal nodes "branches" from dendrogram object". These
+    summary_nodes = nodes.loc[nodes['kind'] == 'summary', ['row', 'icoord', 'dcoord']]
+    summary_nodes['name'] = np.array(tree['name'], dtype = object)[summary_nodes['row']]
+    leaves = np.array(tree['leaves'])[summary_nodes['row']]
+    share = np.floor(100 * np.array(tree['photographed'])[summary_nodes['row']] / leaves + 0.5)
+    summary_nodes['hover'] = [
+        '<b>{0}</b><br>{1} destinations, {2:.0f}% photographed<br>Click to expand'.format(i, j, k)
+        for i, j, k in zip(summary_nodes['name'], leaves, share)]
+    return summary_nodes.reset_index(drop = True)
+
+
+@instrument
+def extract_merge_nodes(nodes:pd.DataFrame, tree:dict, params=params) -> pd.DataFrame:
+    """ Extracts info. about the visible expanded non-terminal nodes ("branches"). These
     nodes are groups of destinations that are geographically proximate.
     Inputs:
-        hierarchy_dendrogram = Coordinates needed to draw a dendrogram representation of a 
-            the distances between destinations
-        colors = project's color palette matrix.  Projects the standard colors used across the
-            project.
+        nodes = visible nodes, from layout_tree()
+        tree = output of make_hierarchy_tree()
         params = The parameters dictionary defined at the top of this script.  Provides easy
             access to parameters that might need adjustment.
     """
-
-    ## extract merge node coordinates
-    merge_nodes = hierarchy_dendrogram[['up_name']].copy().rename(columns = {'up_name':'name'})
-    merge_nodes['icoord']= (hierarchy_dendrogram['icoord1'] + hierarchy_dendrogram['icoord2']) * 0.5
-    merge_nodes['dcoord'] = hierarchy_dendrogram['dcoord1'].copy()
-
-    ## formulate colors
-    merge_nodes['color_line'] = colors.loc[params['shading']['border']['Bracket'],'grey']
-    merge_nodes['color_fill'] = colors.loc[params['shading']['fill']['Bracket'],  'grey']
+    merge_nodes = nodes.loc[nodes['kind'] == 'merge', ['row', 'icoord', 'dcoord']]
+    merge_nodes['name'] = np.array(tree['name'], dtype = object)[merge_nodes['row']]
     merge_nodes['label_type'] = 'hover'
     merge_nodes.loc[merge_nodes['dcoord'] >= params['label_height'], 'label_type'] = 'text'
     merge_nodes = merge_nodes.loc[merge_nodes['dcoord'] < params['too_high']]
     return merge_nodes.reset_index(drop = True)
 
 
-def make_dendrogram(city_list:pd.DataFrame, colors:pd.DataFrame) -> list:
+@instrument
+def make_dendrogram(city_list:pd.DataFrame, colors:pd.DataFrame, distances=None) -> tuple:
     """Wrapper function that executes the other functions in this section. Calculates a distance
-    dendrogram for a set of points and returns the coordinate data necessary to draw that
-    dendrogram.
+    dendrogram for a set of points and returns the coordinate data necessary to draw its initial
+    level of detail.
         city_list = project's main dataset.  Provides destination-wise information about my travels
             and travel goals
         colors = project's color palette matrix.  Projects the standard colors used across the
             project.
+        distances = optional condensed distance matrix among city_list's rows
+    Output: tree, expanded, brackets, and the leaf, summary, and merge nodes
     """
-    hierarchy_linkage = make_hierarchy_linkage(city_list = city_list)
+    hierarchy_linkage = make_hierarchy_linkage(city_list = city_list, distances = distances)
     hierarchy_linkage = name_composite_nodes(city_list = city_list, linkage = hierarchy_linkage)
-    hierarchy_dendrogram = make_hierarchy_dendrogram(
-        city_list=city_list, linkage=hierarchy_linkage, colors=colors)
-    leaf_nodes = extract_leaf_nodes(hierarchy_dendrogram=hierarchy_dendrogram, city_list=city_list)
-    merge_nodes = extract_merge_nodes(hierarchy_dendrogram=hierarchy_dendrogram, colors=colors)
-    return hierarchy_dendrogram, leaf_nodes, merge_nodes
+    tree = make_hierarchy_tree(city_list=city_list, linkage=hierarchy_linkage, colors=colors)
+    expanded = choose_expanded(tree)
+    nodes, brackets = layout_tree(tree=tree, expanded=expanded)
+    leaf_nodes = extract_leaf_nodes(nodes=nodes, tree=tree)
+    summary_nodes = extract_summary_nodes(nodes=nodes, tree=tree)
+    merge_nodes = extract_merge_nodes(nodes=nodes, tree=tree)
+    return tree, expanded, brackets, leaf_nodes, summary_nodes, merge_nodes
 
 ##########==========##########==========##########==========##########==========##########==========
 ## COMPONENT FUNCTIONS - render figure
 
+@instrument
 def make_figure(params = params):
     """ Generates a blank Plotly figure with suitable parameters for this script's dendrograms.
     Inputs:
@@ -320,60 +653,85 @@ def make_figure(params = params):
     return fig, dict()
 
 
-def draw_dendrogram(trace_dict:dict, hierarchy_dendrogram:pd.DataFrame, prefix:str, params=params) -> dict:
-    """ Converts dendrogram coordinates to plotly traces, and appends them to a dict of traces.
+@instrument
+def draw_dendrogram(trace_dict:dict, brackets:pd.DataFrame, tree:dict, prefix:str,
+                    params=params) -> dict:
+    """ Converts bracket coordinates to plotly traces, and appends them to a dict of traces.
+    Brackets of one color share a trace, as line segments separated by gaps, so the number of
+    traces depends on the palette rather than on the number of destinations.  Every bracket color
+    in the tree gets a trace, even if none of its brackets is showing yet, so expanding a merge in
+    the browser never needs a new trace.  Traces are plain dicts to skip plotly's validation.
     Inputs:
         trace_dict = a dict object to be filled with plotly traces.  These traces will be
             drawn in the plotly figure during write_figure() and also tied into a slider
             bar in add_slider().
-        hierarchy_dendrogram = Coordinates needed to draw a dendrogram representation of a 
-            the distances between destinations
+        brackets = bracket coordinates for the visible merges, from layout_tree()
+        tree = output of make_hierarchy_tree()
         prefix = an identifying string added to the dict keys for the traces generated.
         params = The parameters dictionary defined at the top of this script.  Provides easy
             access to parameters that might need adjustment.
     """
     icoords = ['icoord' + str(i) for i in range(0, 4)]
     dcoords = ['dcoord' + str(i) for i in range(0, 4)]
+    color = np.array(tree['color'], dtype = int)[brackets['row'].to_numpy()]
+    gap = lambda x: np.column_stack([x, np.full(x.shape[0], np.nan)]).ravel()
     new_traces = dict()
-    for iter_row in hierarchy_dendrogram.index:
-        name_now = hierarchy_dendrogram.loc[iter_row, 'up_name']
-        new_traces[prefix + '∆' + name_now + '∆bracket'] = go.Scatter(
-            x = hierarchy_dendrogram.loc[iter_row, dcoords],
-            y = hierarchy_dendrogram.loc[iter_row, icoords],
+    for iter_color, iter_hue in enumerate(tree['colors']):
+        idx = color == iter_color
+        key = prefix + '∆bracket∆' + str(iter_color)
+        new_traces[key] = dict(
+            type = 'scatter',
+            x = gap(brackets.loc[idx, dcoords].to_numpy(dtype = float)),
+            y = gap(brackets.loc[idx, icoords].to_numpy(dtype = float)),
             hoverinfo = 'none', showlegend = False, mode = 'lines',
-            line = dict(color = hierarchy_dendrogram.loc[iter_row, 'color']),
-            name = name_now,
+            line = dict(color = iter_hue),
+            name = 'brackets', uid = key,
             visible = params['first_visible'] == int(prefix.split('_')[0])
         )
     trace_dict.update(new_traces)
     return trace_dict
 
 
-def label_nodes(trace_dict, leaf_nodes, merge_nodes, prefix:str, params=params):
+@instrument
+def label_nodes(trace_dict, leaf_nodes, summary_nodes, merge_nodes, tree:dict, expanded:list,
+                colors:pd.DataFrame, prefix:str, params=params):
     """ Adds traces to a dict of traces.  Traces depict destinations at the terminal edge
-    of the dendrograms.
+    of the dendrograms, collapsed groups of destinations, and the merges between them.  When
+    anything is collapsed, the summary trace carries the whole tree in its meta, for the
+    expand_on_click script.
     Inputs:
         trace_dict = a dict object to be filled with plotly traces.  These traces will be
             drawn in the plotly figure during write_figure() and also tied into a slider
             bar in add_slider().
-        leaf_nodes = Information on the terminal nodes (destinations).  Extracted from the 
-            dendrogram coordinates object.
-        merge_nodes = Information on the non-terminal nodes (destination groups).  Extracted from
-            the dendrogram coordinates object.
+        leaf_nodes = Information on the visible terminal nodes (destinations).
+        summary_nodes = Information on the visible collapsed merges (destination groups).
+        merge_nodes = Information on the visible expanded merges (destination groups).
+        tree, expanded = the tree and its initial level of detail; see make_dendrogram()
+        colors = project's color palette matrix.  Projects the standard colors used across the
+            project.
         prefix = an identifying string added to the dict keys for the traces generated.
         params = The parameters dictionary defined at the top of this script.  Provides easy
             access to parameters that might need adjustment.
     """
     new_traces = dict()
+    line = colors.loc[params['shading']['border']['Bracket'], 'grey']
+    fill = colors.loc[params['shading']['fill']['Bracket'], 'grey']
 
     ## draw leaf nodes
     new_traces[prefix + '∆leaf_nodes'] = go.Scatter(
         x = leaf_nodes['dcoord'],
         y = leaf_nodes['icoord'],
         text = leaf_nodes['name'],
-        name = 'leaf_nodes',
-        hoverinfo = 'none', showlegend = False, mode = 'markers+text',
+        hovertext = leaf_nodes['hover'],
+        name = 'leaf_nodes', uid = prefix + '∆leaf_nodes',
+        hoverinfo = 'text', showlegend = False, mode = 'markers+text',
         textfont = dict(color = leaf_nodes['color_line']),
+        hoverlabel = dict(
+            align = 'left',
+            font_color = leaf_nodes['color_line'],
+            bgcolor = leaf_nodes['color_fill'],
+            bordercolor = leaf_nodes['color_line'],
+            ),
         marker = dict(
             line = dict(color = leaf_nodes['color_line'], width = 1.5),
             color = leaf_nodes['color_fill'],
@@ -383,26 +741,38 @@ def label_nodes(trace_dict, leaf_nodes, merge_nodes, prefix:str, params=params):
         visible = params['first_visible'] == int(prefix.split('_')[0])
         )
 
+    ## collapsed merges
+    new_traces[prefix + '∆summary_nodes'] = go.Scatter(
+        x = summary_nodes['dcoord'],
+        y = summary_nodes['icoord'],
+        text = summary_nodes['name'],
+        hovertext = summary_nodes['hover'],
+        customdata = summary_nodes['row'],
+        name = 'summary_nodes', uid = prefix + '∆summary_nodes',
+        hoverinfo = 'text', showlegend = False, mode = 'markers+text',
+        textfont = dict(color = line),
+        hoverlabel = dict(align = 'left', font_color = line, bgcolor = fill, bordercolor = line),
+        marker = dict(line = dict(color = line, width = 1.5), color = fill, size = 11,
+            symbol = 'diamond'),
+        textposition = 'middle left',
+        meta = None if all(expanded) else dict(
+            tree = tree, expanded = expanded, expand_leaves = params['lod']['expand_leaves'],
+            label_height = params['label_height'], too_high = params['too_high']),
+        visible = params['first_visible'] == int(prefix.split('_')[0])
+        )
+
     ## upper merges
     idx = merge_nodes['label_type'] == 'text'
     new_traces[prefix + '∆upper_merge_nodes'] = go.Scatter(
         x = merge_nodes.loc[idx, 'dcoord'],
         y = merge_nodes.loc[idx, 'icoord'],
         text = merge_nodes.loc[idx, 'name'],
-        name = 'upper_merge_nodes',
+        customdata = merge_nodes.loc[idx, 'row'],
+        name = 'upper_merge_nodes', uid = prefix + '∆upper_merge_nodes',
         hoverinfo = 'text', showlegend = False, mode = 'markers+text',
-        textfont = dict(color = merge_nodes.loc[idx, 'color_line']),
-        hoverlabel = dict(
-            align = 'left',
-            font_color = merge_nodes.loc[idx, 'color_line'],
-            bgcolor = merge_nodes.loc[idx, 'color_fill'],
-            bordercolor = merge_nodes.loc[idx, 'color_line'],
-            ),
-        marker = dict(
-            line = dict(color = merge_nodes.loc[idx, 'color_line'], width = 1.5),
-            color = merge_nodes.loc[idx, 'color_fill'],
-            size = 8
-            ),
+        textfont = dict(color = line),
+        hoverlabel = dict(align = 'left', font_color = line, bgcolor = fill, bordercolor = line),
+        marker = dict(line = dict(color = line, width = 1.5), color = fill, size = 8),
         textposition = 'middle left',
         visible = params['first_visible'] == int(prefix.split('_')[0])
         )
@@ -413,20 +783,12 @@ def label_nodes(trace_dict, leaf_nodes, merge_nodes, prefix:str, params=params):
         x = merge_nodes.loc[idx, 'dcoord'],
         y = merge_nodes.loc[idx, 'icoord'],
         text = merge_nodes.loc[idx, 'name'],
-        name = 'lower_merge_nodes',
+        customdata = merge_nodes.loc[idx, 'row'],
+        name = 'lower_merge_nodes', uid = prefix + '∆lower_merge_nodes',
         hoverinfo = 'text', showlegend = False, mode = 'markers',
-        textfont = dict(color = merge_nodes.loc[idx, 'color_line']),
-        hoverlabel = dict(
-            align = 'left',
-            font_color = merge_nodes.loc[idx, 'color_line'],
-            bgcolor = merge_nodes.loc[idx, 'color_fill'],
-            bordercolor = merge_nodes.loc[idx, 'color_line'],
-            ),
-        marker = dict(
-            line = dict(color = merge_nodes.loc[idx, 'color_line'], width = 1.5),
-            color = merge_nodes.loc[idx, 'color_fill'],
-            size = 8
-            ),
+        textfont = dict(color = line),
+        hoverlabel = dict(align = 'left', font_color = line, bgcolor = fill, bordercolor = line),
+        marker = dict(line = dict(color = line, width = 1.5), color = fill, size = 8),
         textposition = 'middle left',
         visible = params['first_visible'] == int(prefix.split('_')[0])
         )
@@ -435,6 +797,7 @@ def label_nodes(trace_dict, leaf_nodes, merge_nodes, prefix:str, params=params):
     return trace_dict
 
 
+@instrument
 def add_slider(trace_dict:dict, colors:pd.DataFrame, params=params) -> list:
     """ Generates slider specifications for the plotly object.
     Input:
@@ -468,34 +831,36 @@ def add_slider(trace_dict:dict, colors:pd.DataFrame, params=params) -> list:
     return slider
 
 
-def write_figure(fig:go.Figure, trace_dict:dict, slider:list):
-    """ Add sliders and traces to a plotly figure.  Write figure as both a self-contained html
-    file and also as an html div section.  The self-contained file is for testing / trouble-
-    shooting.  0_executve_project.py injects the div code into a data dashboard.
+@instrument
+def write_figure(fig:go.Figure, trace_dict:dict, slider:list, debug_html=False, params=params) -> str:
+    """ Add sliders and traces to a plotly figure.  Render figure as an html div section and
+    return it.  a1_execute_project.py injects the div code into a data dashboard.
     Inputs:
         fig = a blank, suitably formatted plotly figure
-        trace_dict = a dict of plotly traces, ready to write into the figure
+        trace_dict = a dict of plotly traces (go objects or plain dicts), ready to write into
+            the figure
         slider = a plotly slider object, defining the relationship between trace visibility
             and the slider's current state.
+        debug_html = bool; if True, also write a debug html page for testing / trouble-
+            shooting.
+        params = The parameters dictionary defined at the top of this script.  params['render']
+            overrides a3_render's serialization settings (e.g. coordinate precision).
     """
-    fig = fig.add_traces([i for i in trace_dict.values()])
     fig = fig.update_layout(sliders = slider)
-    fig.write_html(
-        os.path.join('io_mid', 'PROXIMITY.html'), full_html = True, include_plotlyjs = True)
-    fig.write_html(
-        os.path.join('io_mid', 'PROXIMITY.div'), full_html = False, include_plotlyjs = False)
-    div = '\n'.join(open('io_mid/PROXIMITY.div', 'rt').readlines())
-    return div
+    return render_figure(fig=fig, name='PROXIMITY', debug_html=debug_html,
+        traces=list(trace_dict.values()), post_script=expand_on_click,
+        params={**render_params, **params['render']})
 
 
 ##########==========##########==========##########==========##########==========##########==========
 ## TOP-LEVEL FUNCTIONS
 
 
-def draw_proximity_panel():
+@instrument
+def draw_proximity_panel(debug_html=False) -> str:
     """ draw_proximity_panel() is the main function for this script.  It executes all of the other
     functions.  execute_project.py imports this function to execute the project from start to
-    finish.
+    finish.  Returns the panel as an html div str.
     """
     ## initialize plotly figure
     fig, trace_dict = make_figure()
@@ -504,20 +869,28 @@ def draw_proximity_panel():
     city_list, best_months, colors = import_data()
     city_list = assign_colors(city_list=city_list, colors=colors)
     city_list = project_coordinates(city_list=city_list)
+    city_list['nearby'] = describe_nearby(city_list=city_list)
+    distances = None
 
-    ## generate dendrograms for each month
+    ## generate dendrograms for each month; only the 'ward' backend reads the distance matrix
     for iter_month in best_months.columns:
-        hierarchy_dendrogram, leaf_nodes, merge_nodes = make_dendrogram(
-            city_list=city_list.loc[best_months[iter_month].values], colors=colors)
+        positions = best_months[iter_month].values.nonzero()[0]
+        if params['distance'] == 'haversine' and choose_backend(positions.size) == 'ward':
+            if distances is None: distances = condensed_distances(city_list)
+            subset = subset_distances(distances, city_list.shape[0], positions)
+        else: subset = None
+        tree, expanded, brackets, leaf_nodes, summary_nodes, merge_nodes = make_dendrogram(
+            city_list=city_list.iloc[positions], colors=colors, distances=subset)
         trace_dict = draw_dendrogram(trace_dict=trace_dict,
-                                hierarchy_dendrogram=hierarchy_dendrogram, prefix=iter_month)
-        trace_dict = label_nodes(trace_dict=trace_dict,
-                                leaf_nodes=leaf_nodes, merge_nodes=merge_nodes, prefix=iter_month)
+                                brackets=brackets, tree=tree, prefix=iter_month)
+        trace_dict = label_nodes(trace_dict=trace_dict, leaf_nodes=leaf_nodes,
+                                summary_nodes=summary_nodes, merge_nodes=merge_nodes, tree=tree,
+                                expanded=expanded, colors=colors, prefix=iter_month)
 
-    ## assemble figure and write to disk as html code
+    ## assemble figure and render as html code
     slider = add_slider(trace_dict=trace_dict, colors=colors)
-    write_figure(fig=fig, trace_dict=trace_dict, slider = slider)
-    return None
+    div = write_figure(fig=fig, trace_dict=trace_dict, slider = slider, debug_html = debug_html)
+    return div
 
 
 ##########==========##########==========##########==========##########==========##########==========
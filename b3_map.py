@@ -11,11 +11,13 @@
             as a line of coordinates.
         io_mid/weather_data.xlsx: records the average number of temperate hours per day in each
             destination for periods throughout the year.
+        b5_itinerary: plans the trip drawn as the itinerary layer, shown with its month's weather.
 
     Outputs:
-        io_mid/MAP.html: self-contained, fully-functional html file with all data displays.
-            Used during development to inspect data displays.  Is not tied into the project
-            css file, so some stylistic elements will be of lower quality.
+        io_mid/MAP.html: fully-functional html file with all data displays, which loads the
+            shared plotly.js asset from io_out.  Used during development to inspect data
+            displays.  Is not tied into the project css file, so some stylistic elements will be
+            of lower quality.  Only written when debug_html is True.
         io_mid/MAP.div: html code contained inside a <div> tag, suitable for injection into
             the project's main html product.
     Open GitHub Issues:
@@ -32,10 +34,15 @@ from xml.dom.minidom import parse as xml_parse
 if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')  
 import pandas as pd
 import plotly.graph_objects as go
+from a2_weather import destination_weather
+from a3_render import render_figure, read_sheet, params as render_params
+from a5_instrument import instrument
+from a6_spatial import describe_nearby
+import b5_itinerary
 
 ## define parameters
 params = {
-    'color': pd.read_excel(os.path.join('io_in', 'colors.xlsx'), index_col = 0)
+    'color': read_sheet(os.path.join('io_in', 'colors.xlsx'), index_col = 0)
 }
 
 params['visit_colors'] = {'Photographed': 50, 'Visited': 25, 'Unvisited': 0}
@@ -46,6 +53,10 @@ params.update(dict(
     height = 720 - 10,
     city_size = 2**3,
     route_res = 0.08,
+    render = dict(precision = 4),
+    weather_metric = 'temperate',   # or 'comfort'; see a2_weather.comfort_hours()
+    weather_labels = dict(temperate = 'Temperate', comfort = 'Comfortable'),  # slider and hover
+    months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'],
     ))
 
 ## TODO: Add routes (under city layers)
@@ -54,12 +65,13 @@ params.update(dict(
 ## COMPONENT FUNCTIONS - data shaping
 
 
+@instrument
 def import_city_list():
     """
         TODO
     """
     ## import data
-    city_list = pd.read_excel(
+    city_list = read_sheet(
         os.path.join('io_in', 'city_list.xlsx'), sheet_name= 'Cities', index_col= 0)
 
     ## formulate colors
@@ -72,13 +84,15 @@ def import_city_list():
     city_list['miles'] = city_list['miles'].round(1)
     city_list = city_list.fillna({'miles': 'Data Pending', 'photo_date': 'Never'}).reset_index(drop = True)
     city_list['state_criteria'] = city_list['state_criteria'].str.capitalize()
+    city_list['nearby'] = describe_nearby(city_list = city_list)
 
     ## formulate hover labels
     htxt = '<br>'.join([
         '<b>{city}</b>',
         'Inclusion Criteria: {state_criteria}',
         'Miles Walked: {miles}',
-        'Last Photographed: {photo_date}'
+        'Last Photographed: {photo_date}',
+        '{nearby}'
         ])
     for iter_row in city_list.index:
         city_list.loc[iter_row, 'hover_label'] = htxt.format(**dict(city_list.loc[iter_row]))
@@ -86,19 +100,21 @@ def import_city_list():
     return city_list
 
 
-def add_weather_to_city(city_list):
+@instrument
+def add_weather_to_city(city_list, params=params):
     """
         TODO
     """
-    weather_data = pd.read_excel(os.path.join('io_mid', 'weather_data.xlsx'), index_col = 0)
+    weather_data = destination_weather(city_list, params['weather_metric'])
+    weather_data = weather_data.drop(columns = ['uncertainty', 'source'])
     weather_data.columns = 'W∆' + weather_data.columns
-    city_list = city_list.merge(
-        right = weather_data, how = 'left', left_on = 'noaa_station', right_index = True)
+    city_list = city_list.join(weather_data.astype(float))
     city_list = city_list.round(1)
     ##city_list = city_list.fillna({i:0 for i in weather_data.columns})
     return city_list
 
 
+@instrument
 def import_routes(params = params):
     """
         TODO
@@ -148,6 +164,7 @@ def import_routes(params = params):
 ## COMPONENT FUNCTIONS - render image
 
 
+@instrument
 def make_figure(params = params):
     """
         TODO
@@ -191,9 +208,12 @@ def make_figure(params = params):
     return fig
 
 
+@instrument
 def build_route_trace(routes, trace_dict, hover = True, params = params):
     """
-        TODO
+        Builds one line trace per route segment.  Route traces are numerous and fixed in
+        structure, so they are plain dicts rather than go.Scattergeo objects, which skips
+        plotly's per-property validation.
     """
 
     ## set basic parameters
@@ -217,14 +237,15 @@ def build_route_trace(routes, trace_dict, hover = True, params = params):
             routes.loc[idx, 'trip'].values[0], routes.loc[idx, 'segments'].values[0][2::])
         else: hover_now = None
 
-        route_traces[iter_segment.replace('S∆', set_prefix)] = go.Scattergeo(
-            lat = routes.loc[idx, 'lat'],
-            lon = routes.loc[idx, 'lon'],
+        route_traces[iter_segment.replace('S∆', set_prefix)] = dict(
+            type = 'scattergeo',
+            lat = routes.loc[idx, 'lat'].to_numpy(),
+            lon = routes.loc[idx, 'lon'].to_numpy(),
             hoverinfo = set_hoverinfo,
             hovertemplate = hover_now,
             hoverlabel = dict(
                 align = 'right',
-                font_color = params['color'].loc[50,1],
+                font = dict(color = params['color'].loc[50,1]),
                 bgcolor = params['color'].loc[0,1]
                 ),
             marker = dict(
@@ -241,6 +262,7 @@ def build_route_trace(routes, trace_dict, hover = True, params = params):
     return trace_dict
 
 
+@instrument
 def build_city_trace(city_list, trace_dict, hover = False):
     """
         TODO
@@ -288,6 +310,7 @@ def build_city_trace(city_list, trace_dict, hover = False):
     return trace_dict
 
 
+@instrument
 def build_weather_trace(city_list, trace_dict, params = params):
     """
         TODO
@@ -295,13 +318,15 @@ def build_weather_trace(city_list, trace_dict, params = params):
     ## prepare needed objects
     weather_traces = dict()
     weather_cols = city_list.columns[city_list.columns.str.startswith('W∆')].to_list()
+    label = params['weather_labels'][params['weather_metric']]
 
     ## iteratively add traces for each weather score
     for iter_weather in weather_cols:
 
         ## generate iteration specific hover labels
         city_list['weather_label'] = '<b>' + city_list['city'].copy() + '</b>'
-        city_list['weather_label'] += '<br>Temperate Hours: ' + city_list[iter_weather].astype(str)
+        city_list['weather_label'] += '<br>{0} Hours: '.format(label)
+        city_list['weather_label'] += city_list[iter_weather].astype(str)
         city_list['weather_label'] += '<br>Climate: ' + city_list['climate_major']
         city_list['weather_label'] += '<br>Summer: ' + city_list['climate_summer']
         city_list['weather_label'] += '<br>Winter: ' + city_list['climate_winter']
@@ -337,7 +362,48 @@ def build_weather_trace(city_list, trace_dict, params = params):
     return trace_dict
 
 
-def formulate_slider_bar(trace_dict):
+@instrument
+def build_itinerary_trace(itinerary, month, trace_dict, params = params):
+    """
+        Draws the trip planned by b5_itinerary as a numbered route.  The layer is keyed
+        I∆{month}, so it appears on the slider step for that month's weather.
+    """
+    if itinerary is None: return trace_dict
+    hover = '<b>Stop {0}: {1}</b><br>{2} miles from the last stop<br>{3} miles so far'
+    hover = [
+        hover.format(i, itinerary['city'].iat[i], itinerary['leg_miles'].iat[i],
+            itinerary['total_miles'].iat[i])
+        for i in range(0, itinerary.shape[0])]
+    hover[0] = '<b>Start: {0}</b>'.format(itinerary['city'].iat[0])
+    hover[-1] = '<b>Return: {0}</b><br>{1} miles in total'.format(
+        itinerary['city'].iat[-1], itinerary['total_miles'].iat[-1])
+    trace_dict['I∆{0:02d} Itinerary'.format(month)] = dict(
+        type = 'scattergeo',
+        lat = itinerary['lat'].to_numpy(),
+        lon = itinerary['lon'].to_numpy(),
+        customdata = hover,
+        hovertemplate = '%{customdata}<extra></extra>',
+        hoverlabel = dict(
+            align = 'right',
+            font = dict(color = params['color'].loc[100, 1]),
+            bgcolor = params['color'].loc[0, 1]
+            ),
+        line = dict(color = params['color'].loc[100, 1], width = 2, dash = 'dot'),
+        marker = dict(
+            color = params['color'].loc[0, 1],
+            size = params['city_size'] + 2,
+            line = dict(color = params['color'].loc[100, 1], width = 2)
+            ),
+        name = 'Itinerary',
+        mode = 'lines+markers',
+        visible = False,
+        showlegend = False
+    )
+    return trace_dict
+
+
+@instrument
+def formulate_slider_bar(trace_dict, params = params):
     """
         TODO
     """
@@ -347,18 +413,14 @@ def formulate_slider_bar(trace_dict):
     visibility['Travels:<br>Cities'] = visibility['Layer'].str.startswith('M∆')
     visibility['Travels:<br>Routes'] = (
         visibility['Layer'].str.startswith('R∆') | visibility['Layer'].str.startswith('C∆'))
-    visibility['Temperate:<br>JAN'] = visibility['Layer'].str.startswith('W∆01')
-    visibility['Temperate:<br>FEB'] = visibility['Layer'].str.startswith('W∆02')
-    visibility['Temperate:<br>MAR'] = visibility['Layer'].str.startswith('W∆03')
-    visibility['Temperate:<br>APR'] = visibility['Layer'].str.startswith('W∆04')
-    visibility['Temperate:<br>MAY'] = visibility['Layer'].str.startswith('W∆05')
-    visibility['Temperate:<br>JUN'] = visibility['Layer'].str.startswith('W∆06')
-    visibility['Temperate:<br>JUL'] = visibility['Layer'].str.startswith('W∆07')
-    visibility['Temperate:<br>AUG'] = visibility['Layer'].str.startswith('W∆08')
-    visibility['Temperate:<br>SEP'] = visibility['Layer'].str.startswith('W∆09')
-    visibility['Temperate:<br>OCT'] = visibility['Layer'].str.startswith('W∆10')
-    visibility['Temperate:<br>NOV'] = visibility['Layer'].str.startswith('W∆11')
-    visibility['Temperate:<br>DEC'] = visibility['Layer'].str.startswith('W∆12')
+
+    ## one step per month, labeled with the weather metric, showing that month's weather and
+    ## any itinerary planned for it
+    label = params['weather_labels'][params['weather_metric']]
+    for iter_month, iter_abbreviation in enumerate(params['months'], start = 1):
+        visibility[label + ':<br>' + iter_abbreviation] = (
+            visibility['Layer'].str.startswith('W∆{0:02d}'.format(iter_month)) |
+            visibility['Layer'].str.startswith('I∆{0:02d}'.format(iter_month)))
     visibility = visibility.set_index('Layer')
 
     ## assemble slider steps
@@ -379,21 +441,24 @@ def formulate_slider_bar(trace_dict):
     return slider_bar
 
 
-def write_figure(fig, slider_bar, trace_dict):
+@instrument
+def write_figure(fig, slider_bar, trace_dict, debug_html = False, params = params):
     """
-        TODO
+        Adds the slider bar to the figure and renders it, with all traces, as an html div str.
+        The io_mid/MAP.html debug page is only written when debug_html is True.
     """
-    fig = fig.add_traces([trace_dict[i] for i in trace_dict.keys()])
     fig = fig.update_layout(sliders = slider_bar)
-    fig.write_html('io_mid/MAP.html', full_html = True, include_plotlyjs = True)
-    fig.write_html('io_mid/MAP.div', full_html = False, include_plotlyjs = False)
-    div = '\n'.join(open('io_mid/MAP.div', 'rt').readlines())
-    return div
+    return render_figure(
+        fig = fig, name = 'MAP', debug_html = debug_html,
+        traces = [trace_dict[i] for i in trace_dict.keys()],
+        params = {**render_params, **params['render']}
+        )
 
 ##########==========##########==========##########==========##########==========##########==========
 ## TOP-LEVEL FUNCTIONS
 
-def draw_map_panel():
+@instrument
+def draw_map_panel(debug_html = False):
     """
         TODO
     """
@@ -402,6 +467,7 @@ def draw_map_panel():
     city_list = import_city_list()
     city_list = add_weather_to_city(city_list = city_list)
     routes = import_routes()
+    itinerary, month = b5_itinerary.plan_trip()
 
     ## generate traces
     trace_dict = dict()
@@ -410,11 +476,14 @@ def draw_map_panel():
     trace_dict = build_city_trace(city_list = city_list, trace_dict= trace_dict, hover = True)
     trace_dict = build_city_trace(city_list = city_list, trace_dict= trace_dict, hover = False)
     trace_dict = build_weather_trace(city_list= city_list, trace_dict= trace_dict)
+    trace_dict = build_itinerary_trace(
+        itinerary = itinerary, month = month, trace_dict = trace_dict)
 
     ## formulate slider bar and assemble figure
     slider_bar = formulate_slider_bar(trace_dict = trace_dict)
     fig = make_figure()
-    div = write_figure(fig = fig, slider_bar = slider_bar, trace_dict = trace_dict)
+    div = write_figure(
+        fig = fig, slider_bar = slider_bar, trace_dict = trace_dict, debug_html = debug_html)
     return div
 
 ##########==========##########==========##########==========##########==========##########==========
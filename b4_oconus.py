@@ -6,9 +6,10 @@
         b3_map: imports functions function b3_map in order to keep the two displays synced.
         io_in/color.xlsx: centralized color palette for the project
     Outputs:
-        io_mid/OCONUS.html: self-contained, fully-functional html file with all data displays.
-            Used during development to inspect data displays.  Is not tied into the project
-            css file, so some stylistic elements will be of lower quality.
+        io_mid/OCONUS.html: fully-functional html file with all data displays, which loads the
+            shared plotly.js asset from io_out.  Used during development to inspect data
+            displays.  Is not tied into the project css file, so some stylistic elements will be
+            of lower quality.  Only written when debug_html is True.
         io_mid/OCONUS.div: html code contained inside a <div> tag, suitable for injection into
             the project's main html product.
     Open GitHub Issues:
@@ -25,12 +26,14 @@ if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not De
 import pandas as pd
 import plotly.graph_objects as go
 import b3_map
+from a3_render import render_figure, read_sheet
+from a5_instrument import instrument
 
 ## define parameters
 params = dict()
 params['width']  = 500 - 10
 params['height'] = 118 - 10
-params['color'] = pd.read_excel(os.path.join('io_in', 'colors.xlsx'), index_col = 0)
+params['color'] = read_sheet(os.path.join('io_in', 'colors.xlsx'), index_col = 0)
 params['visit_colors'] =  {'Photographed': 50, 'Visited': 25, 'Unvisited': 0}
 params['visit_borders'] = {'Photographed': 100, 'Visited': 50, 'Unvisited': 25}
 params['city_size'] = b3_map.params['city_size']
@@ -39,6 +42,7 @@ params['city_size'] = b3_map.params['city_size']
 ##########==========##########==========##########==========##########==========##########==========
 ## COMPONENT FUNCTIONS
 
+@instrument
 def extract_oconus_data(city_list):
     """
         TODO
@@ -62,6 +66,7 @@ def extract_oconus_data(city_list):
     return city_list
 
 
+@instrument
 def create_figure(city_list):
     """Creates a plotly figure object with suitable parameters"""
     fig = go.Figure()
@@ -85,6 +90,7 @@ def create_figure(city_list):
     return fig
 
 
+@instrument
 def build_oconus_trace(city_list):
     """
         TODO
@@ -118,21 +124,21 @@ def build_oconus_trace(city_list):
     return trace_dict
 
 
-def write_figure(fig, trace_dict):
+@instrument
+def write_figure(fig, trace_dict, debug_html = False):
     """
-        TODO
+        Adds traces to the figure and renders it as an html div str.  The io_mid/OCONUS.html
+        debug page is only written when debug_html is True.
     """
     fig = fig.add_traces([trace_dict[i] for i in trace_dict.keys()])
-    fig.write_html('io_mid/OCONUS.html', full_html = True, include_plotlyjs = True)
-    fig.write_html('io_mid/OCONUS.div', full_html = False, include_plotlyjs = False)
-    div = '\n'.join(open('io_mid/OCONUS.div', 'rt').readlines())
-    return div
+    return render_figure(fig = fig, name = 'OCONUS', debug_html = debug_html)
 
 
 ##########==========##########==========##########==========##########==========##########==========
 ## TOP-LEVEL FUNCTIONS
 
-def draw_oconus_panel():
+@instrument
+def draw_oconus_panel(debug_html = False):
     """
         TODO
     """
@@ -140,7 +146,7 @@ def draw_oconus_panel():
     city_list = extract_oconus_data(city_list)
     fig = create_figure(city_list)
     trace_dict = build_oconus_trace(city_list)
-    div = write_figure(fig, trace_dict)
+    div = write_figure(fig, trace_dict, debug_html = debug_html)
     return div
 
 ##########==========##########==========##########==========##########==========##########==========
@@ -0,0 +1,445 @@
+"""
+    Purpose: Benchmark the build at scales well beyond the real destination list.  Generates
+        synthetic inputs for 10^2 to 10^5 destinations, runs the weather refinement and each
+        panel against them, and records a5_instrument timings for every stage.  Each run is
+        appended to a history file and compared with the previous run to flag regressions.
+        Everything runs offline; no NOAA downloads are made.
+        benchmark_clustering() separately compares b2_proximity's clustering backends on
+        synthetic destination lists, reporting each one's time and how much worse its clusters
+        are (by Ward's objective) than the best backend's at that size.
+        Each (size, target) pair runs in its own process with a time limit (and optionally a
+        memory limit), so a stage that falls over at scale is recorded as a timeout or error
+        rather than stopping the benchmark.  A target that times out is not retried at larger
+        sizes.
+    Inputs:
+        io_in/city_list.xlsx: the real Cities sheet is resampled (with jittered coordinates and
+            new names) to build synthetic destination lists.  Its palette sheets are copied as-is.
+        io_in/colors.xlsx: copied as-is.
+    Outputs:
+        io_mid/benchmark/n{size}/: a scratch copy of the io_in / io_mid layout for each size,
+            holding the synthetic city_list.xlsx, Travels.kml, and NOAA-format station csvs.
+            Reused on later runs as long as the generator settings are unchanged.
+        io_mid/benchmark_history.jsonl: one line per benchmark run, with per-stage totals for
+            every (size, target) pair.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, io, sys, json, shutil, datetime, platform, subprocess, multiprocessing, queue, resource
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+import numpy as np
+import pandas as pd
+from scipy.cluster import hierarchy
+import b2_proximity
+from a2_weather import write_raw
+from a3_render import write_chunks, write_text
+from a5_instrument import stage, summarize
+from a6_spatial import to_cartesian, condensed_distances
+
+## set parameters
+params = dict(
+    sizes = [10**2, 10**3, 10**4, 10**5],
+    seed = 0,
+    source = os.path.join('io_in', 'city_list.xlsx'),
+    work_dir = os.path.join('io_mid', 'benchmark'),
+    history = os.path.join('io_mid', 'benchmark_history.jsonl'),
+    code_dir = os.path.dirname(os.path.abspath(__file__)),
+
+    ## synthetic inputs
+    jitter_degrees = 1.0,       # sd of the noise added to resampled coordinates
+    max_stations = 400,         # the hourly normals network has a few hundred stations
+    segments_per_destination = 0.1,
+    segments_per_trip = 10,
+    points_per_segment = 200,
+
+    ## timed runs
+    timeout = 15 * 60,          # seconds per (size, target) before the run is abandoned
+    memory_limit_gb = None,     # address-space cap per run; None leaves it unlimited
+    targets = dict(
+        WEATHER = dict(recipe = 'a2_weather.refine_weather_data', requires = []),
+        PROGRESS = dict(recipe = 'b1_progress.draw_progress_panel', requires = []),
+        PROXIMITY = dict(recipe = 'b2_proximity.draw_proximity_panel', requires = ['WEATHER']),
+        MAP = dict(recipe = 'b3_map.draw_map_panel', requires = ['WEATHER']),
+        OCONUS = dict(recipe = 'b4_oconus.draw_oconus_panel', requires = []),
+        ),
+
+    ## regression comparison
+    watch = [
+        'b1_progress.make_waffle', 'b2_proximity.make_hierarchy_linkage',
+        'b2_proximity.name_composite_nodes', 'b3_map.build_route_trace'],
+    regression_ratio = 1.25,    # flag stages at least this much slower than the last run
+    regression_floor = 0.05,    # ignore stages faster than this many seconds in both runs
+
+    ## clustering backends: overrides of b2_proximity.params['cluster'], and the largest size
+    ## each is run at
+    cluster_sizes = [10**3, 5 * 10**3, 2 * 10**4],
+    cluster_configs = dict(
+        ward_ordered = dict(backend = 'ward', optimal_ordering = 10**9, max_size = 2000),
+        ward = dict(backend = 'ward', optimal_ordering = 0, max_size = 5000),
+        nn_chain = dict(backend = 'nn_chain', optimal_ordering = 0, max_size = 10**4),
+        two_level_kmeans = dict(backend = 'two_level', pre_cluster = 'kmeans',
+            optimal_ordering = 0, max_size = 10**5),
+        two_level_grid = dict(backend = 'two_level', pre_cluster = 'grid',
+            optimal_ordering = 0, max_size = 10**5),
+        ),
+    cluster_cut = 50,           # clusters the tree is cut into to score it
+)
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - synthetic inputs
+
+
+def make_cities(size: int, source: pd.DataFrame, rng, params=params) -> pd.DataFrame:
+    """ Resamples the real Cities sheet to the requested size.  Categorical columns keep their
+    real values (so palette lookups by region and criteria still work); coordinates are jittered
+    and city names are made unique.  Names contain no commas, which name_composite_nodes()
+    uses as a separator.
+    """
+    cities = source.sample(n=size, replace=True, random_state=rng).reset_index(drop=True)
+    cities[cities.columns[0]] = range(0, size)
+    cities['city'] = ['Synthetic {0:06d} {1}'.format(i, j) for i, j in enumerate(cities['state'])]
+    jitter = rng.normal(0, params['jitter_degrees'], size=(size, 2))
+    cities['lat'] = (cities['lat'] + jitter[:, 0]).clip(-89, 89).round(6)
+    cities['lon'] = (cities['lon'] + jitter[:, 1]).clip(-179, 179).round(6)
+    return cities
+
+
+def make_stations(cities: pd.DataFrame, rng, params=params) -> pd.DataFrame:
+    """ Places weather stations at a random subset of the synthetic destinations, then assigns
+    each destination its nearest station (in place, via the noaa_station column).
+    Output: stations = DataFrame of station id, lat, lon
+    """
+    count = min(cities.shape[0], params['max_stations'])
+    sites = rng.choice(cities.shape[0], size=count, replace=False)
+    stations = pd.DataFrame(dict(
+        station = ['BMK{0:08d}'.format(i) for i in range(0, count)],
+        lat = cities['lat'].values[sites],
+        lon = cities['lon'].values[sites]
+        ))
+
+    ## nearest station, in blocks so the distance matrix stays small
+    nearest = np.empty(cities.shape[0], dtype=int)
+    for iter_start in range(0, cities.shape[0], 10**4):
+        block = cities.iloc[iter_start:iter_start + 10**4]
+        d_lat = block['lat'].values[:, None] - stations['lat'].values[None, :]
+        d_lon = block['lon'].values[:, None] - stations['lon'].values[None, :]
+        d_lon = d_lon * np.cos(np.radians(block['lat'].values))[:, None]
+        nearest[iter_start:iter_start + block.shape[0]] = (d_lat**2 + d_lon**2).argmin(axis=1)
+    cities['noaa_station'] = stations['station'].values[nearest]
+    return stations
+
+
+def make_station_csv(station: str, lat: float, lon: float, rng) -> pd.DataFrame:
+    """ One year of hourly normals in the layout of the NOAA normals-hourly access csvs.  The
+    temperature follows latitude, season, and time of day, plus noise.
+    """
+    hours = pd.date_range('2010-01-01', periods=365 * 24, freq='h')
+    season = np.cos(2 * np.pi * (hours.dayofyear.values - 200) / 365)
+    diurnal = np.cos(2 * np.pi * (hours.hour.values - 15) / 24)
+    temp = 75 - 1.3 * (abs(lat) - 25) + (10 + 0.5 * max(abs(lat) - 25, 0)) * season
+    temp = (temp + 8 * diurnal + rng.normal(0, 1.5, hours.size)).round(1)
+    return pd.DataFrame({
+        'STATION': station,
+        'DATE': hours.strftime('%m-%dT%H:%M:%S'),
+        'LATITUDE': lat, 'LONGITUDE': lon, 'ELEVATION': 100.0,
+        'NAME': 'SYNTHETIC {0}, XX US'.format(station[-6::]),
+        'month': hours.month, 'day': hours.day, 'hour': hours.hour,
+        'HLY-TEMP-NORMAL': temp,
+        'meas_flag_HLY-TEMP-NORMAL': ' ',
+        'comp_flag_HLY-TEMP-NORMAL': 'S',
+        'years_HLY-TEMP-NORMAL': 15,
+        'HLY-TEMP-10PCTL': (temp - 6).round(1),
+        'HLY-TEMP-90PCTL': (temp + 6).round(1),
+        'HLY-DEWP-NORMAL': (temp - rng.uniform(5, 20, hours.size)).round(1),
+        'HLY-HIDX-NORMAL': (temp + 0.3 * (temp - 80).clip(0)).round(1),
+        'HLY-WCHL-NORMAL': (temp - 0.3 * (50 - temp).clip(0)).round(1),
+        'HLY-WIND-AVGSPD': rng.uniform(4, 15, hours.size).round(1),
+        'HLY-CLOD-PCTOVC': rng.uniform(0, 100, hours.size).round(1),
+        })
+
+
+def make_routes(cities: pd.DataFrame, rng, params=params):
+    """ Yields a Travels.kml archive in chunks: one folder per trip, one LineString placemark per
+    segment.  Each segment is a random walk that starts at a synthetic destination.  Segment
+    names are unique across trips, as in the real archive.
+    """
+    segments = max(1, int(cities.shape[0] * params['segments_per_destination']))
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<kml><Document><Folder><name>Travels</name>\n'
+    for iter_segment in range(0, segments):
+        trip = iter_segment // params['segments_per_trip']
+        if iter_segment % params['segments_per_trip'] == 0:
+            if iter_segment > 0: yield '</Folder>\n'
+            yield '<Folder><name>Trip {0:05d}</name>\n'.format(trip)
+        start = cities.iloc[rng.integers(0, cities.shape[0])]
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(
+            rng.normal(0, 0.2, params['points_per_segment']))
+        lon = start['lon'] + np.cumsum(0.02 * np.cos(heading))
+        lat = start['lat'] + np.cumsum(0.02 * np.sin(heading))
+        yield '<Placemark><name>Trip {0:05d} Day {1:06d}</name><LineString><coordinates>'.format(
+            trip, iter_segment)
+        yield ' '.join('{0:.6f},{1:.6f},0'.format(i, j) for i, j in zip(lon, lat))
+        yield '</coordinates></LineString></Placemark>\n'
+    yield '</Folder>\n</Folder></Document></kml>\n'
+
+
+def generate_inputs(size: int, params=params) -> str:
+    """ Writes the synthetic inputs for one size into its scratch directory, mirroring the
+    project's io_in / io_mid layout.  Skipped when the directory already holds inputs made
+    with the same generator settings.
+    Output: work_dir = the scratch directory for this size
+    """
+    work_dir = os.path.join(params['work_dir'], 'n{0}'.format(size))
+    spec = json.dumps(dict(size = size, **{i: params[i] for i in [
+        'seed', 'jitter_degrees', 'max_stations', 'segments_per_destination',
+        'segments_per_trip', 'points_per_segment']}), sort_keys=True)
+    spec_file = os.path.join(work_dir, 'spec.json')
+    if os.path.exists(spec_file) and open(spec_file, 'rt').read() == spec: return work_dir
+
+    ## start from a clean copy of the directory layout
+    if os.path.exists(work_dir): shutil.rmtree(work_dir)
+    for iter_dir in ['io_in', 'io_mid', os.path.join('io_mid', 'weather_data')]:
+        os.makedirs(os.path.join(work_dir, iter_dir))
+    shutil.copyfile(
+        os.path.join('io_in', 'colors.xlsx'), os.path.join(work_dir, 'io_in', 'colors.xlsx'))
+    rng = np.random.default_rng(params['seed'])
+
+    ## destinations and stations; the palette sheets are copied cell for cell
+    with stage('c1_benchmark.generate.cities') as record:
+        sheets = pd.read_excel(params['source'], sheet_name=None, header=None)
+        source = pd.read_excel(params['source'], sheet_name='Cities')
+        cities = make_cities(size=size, source=source, rng=rng)
+        stations = make_stations(cities=cities, rng=rng)
+        with pd.ExcelWriter(os.path.join(work_dir, 'io_in', 'city_list.xlsx')) as writer:
+            cities.to_excel(writer, sheet_name='Cities', index=False)
+            for iter_sheet in [i for i in sheets.keys() if i != 'Cities']:
+                sheets[iter_sheet].to_excel(
+                    writer, sheet_name=iter_sheet, header=False, index=False)
+        record['rows'] = cities.shape[0]
+
+    ## station csvs, stored the way a2_weather stores downloads
+    with stage('c1_benchmark.generate.stations') as record:
+        for iter_row in stations.itertuples():
+            station_csv = make_station_csv(iter_row.station, iter_row.lat, iter_row.lon, rng)
+            write_raw(iter_row.station, io.BytesIO(station_csv.to_csv(index=False).encode()),
+                data_dir=os.path.join(work_dir, 'io_mid', 'weather_data'))
+        record['rows'] = stations.shape[0]
+
+    ## route archive
+    with stage('c1_benchmark.generate.routes'):
+        write_chunks(
+            os.path.join(work_dir, 'io_in', 'Travels.kml'), make_routes(cities=cities, rng=rng))
+
+    write_text(spec_file, spec)
+    return work_dir
+
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS - timed runs
+
+
+def run_isolated(work_dir: str, recipe: str, results, params=params) -> None:
+    """ Process target: runs one recipe from inside a size's scratch directory and sends back
+    its status and a5_instrument records.  Module-level, so it can be spawned.
+    """
+    if params['memory_limit_gb']:
+        limit = int(params['memory_limit_gb'] * 2**30)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    sys.path.insert(0, params['code_dir'])
+    os.chdir(work_dir)
+    from a4_build import run_recipe
+    from a5_instrument import records
+    try:
+        run_recipe(recipe, dict())
+        results.put(dict(status = 'ok', error = None, records = records))
+    except BaseException as error:
+        results.put(dict(status = 'error', error = repr(error)[0:500], records = records))
+    return None
+
+
+def time_target(work_dir: str, recipe: str, params=params) -> dict:
+    """ Runs one recipe in a fresh process, so imports, caches, and memory start clean at every
+    size, and abandons it after params['timeout'] seconds.
+    Output: result = dict of status ('ok', 'error', 'timeout', or 'crashed'), error, records
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_isolated, args=(work_dir, recipe, results, params))
+    process.start()
+    deadline = datetime.datetime.now() + datetime.timedelta(seconds=params['timeout'])
+    result = None
+    while result is None:
+        try: result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                result = dict(status = 'crashed', records = list(),
+                    error = 'process exited with code {0}'.format(process.exitcode))
+            elif datetime.datetime.now() > deadline:
+                result = dict(status = 'timeout', records = list(),
+                    error = 'exceeded {0} s'.format(params['timeout']))
+    process.join(timeout=5)
+    if process.is_alive(): process.kill()
+    return result
+
+
+def compare_runs(current: dict, previous: dict, params=params) -> list:
+    """ Lists stages that got slower since the previous run, matched on (size, target, stage).
+    Stages under params['regression_floor'] seconds in both runs are ignored as noise.
+    """
+    if previous is None: return list()
+    before = {
+        (i['size'], i['target'], j['stage']): j['wall_s']
+        for i in previous['results'] for j in i['stages']}
+    regressions = list()
+    for iter_result in current['results']:
+        for iter_stage in iter_result['stages']:
+            key = (iter_result['size'], iter_result['target'], iter_stage['stage'])
+            if key not in before: continue
+            if max(before[key], iter_stage['wall_s']) < params['regression_floor']: continue
+            ratio = iter_stage['wall_s'] / max(before[key], 1e-4)
+            if ratio >= params['regression_ratio']:
+                regressions.append(dict(
+                    size = key[0], target = key[1], stage = key[2], before_s = before[key],
+                    after_s = iter_stage['wall_s'], ratio = round(ratio, 2)))
+    return regressions
+
+
+def read_last_run(params=params):
+    """Returns the most recent run in the history file, or None if there is none."""
+    if not os.path.exists(params['history']): return None
+    with open(params['history'], 'rt', encoding='utf-8') as f:
+        lines = [i for i in f.read().splitlines() if i.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def tabulate(run: dict, params=params) -> pd.DataFrame:
+    """Seconds per size for each target and each watched stage, for printing."""
+    rows = list()
+    for iter_result in run['results']:
+        recipe = params['targets'][iter_result['target']]['recipe']
+        rows.append(dict(
+            stage = iter_result['target'], size = iter_result['size'],
+            value = iter_result['status'] if iter_result['status'] != 'ok' else
+                next((i['wall_s'] for i in iter_result['stages'] if i['stage'] == recipe), None)))
+        for iter_stage in iter_result['stages']:
+            if iter_stage['stage'] in params['watch']:
+                rows.append(dict(
+                    stage = iter_stage['stage'], size = iter_result['size'],
+                    value = iter_stage['wall_s']))
+    if not rows: return pd.DataFrame()
+    return pd.DataFrame(rows).pivot_table(
+        index='stage', columns='size', values='value', aggfunc='first')
+
+
+def ward_cost(coords: np.ndarray, linkage: np.ndarray, clusters: int) -> float:
+    """ Ward's objective for a tree cut into the given number of clusters: the total squared
+    distance (miles^2) from each point to its cluster's centroid.  Lower is better.
+    """
+    groups = hierarchy.fcluster(linkage, t=clusters, criterion='maxclust')
+    centroids = pd.DataFrame(coords).groupby(groups).transform('mean').to_numpy()
+    return float(((coords - centroids)**2).sum())
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+def benchmark_clustering(sizes=None, params=params) -> pd.DataFrame:
+    """ Times each of params['cluster_configs'] on synthetic destination lists and scores the
+    tree it builds by ward_cost(), relative to the best config at the same size (1.0 = best).
+    Configs are skipped above their max_size.
+    Inputs:
+        sizes = list of destination counts; defaults to params['cluster_sizes']
+        params = The parameters dictionary defined at the top of this script.
+    Output: results = one row per (size, config) with seconds and cost_ratio
+    """
+    source = pd.read_excel(params['source'], sheet_name='Cities')
+    rows = list()
+    for iter_size in sorted(sizes or params['cluster_sizes']):
+        rng = np.random.default_rng(params['seed'])
+        cities = make_cities(size=iter_size, source=source, rng=rng)
+        cities = b2_proximity.project_coordinates(cities)
+        coords = to_cartesian(cities)
+        for iter_name, iter_config in params['cluster_configs'].items():
+            if iter_size > iter_config['max_size']: continue
+            cluster = {**b2_proximity.params['cluster'], **iter_config}
+            config = dict(b2_proximity.params, cluster=cluster)
+            with stage('c1_benchmark.cluster.' + iter_name) as record:
+                distances = None
+                if b2_proximity.choose_backend(iter_size, params=config) == 'ward':
+                    distances = condensed_distances(cities)
+                linkage = b2_proximity.make_hierarchy_linkage(cities, distances, params=config)
+            rows.append(dict(size = iter_size, config = iter_name, seconds = record['wall_s'],
+                cost = ward_cost(coords, linkage[['left', 'right', 'distance', 'leaves']].to_numpy(
+                    dtype=float), clusters=params['cluster_cut'])))
+            print('n={0:<7} {1:<17} {2:>9.2f} s'.format(iter_size, iter_name, record['wall_s']))
+
+    results = pd.DataFrame(rows)
+    results['cost_ratio'] = (
+        results['cost'] / results.groupby('size')['cost'].transform('min')).round(3)
+    return results.drop(columns='cost')
+
+
+def run_benchmark(sizes=None, params=params) -> dict:
+    """ Generates inputs and times every target at each size, appends the run to the history
+    file, and compares it with the previous run.
+    Inputs:
+        sizes = list of destination counts; defaults to params['sizes']
+        params = The parameters dictionary defined at the top of this script.
+    Output: run = dict with run metadata, per-(size, target) results, and regressions
+    """
+    previous = read_last_run()
+    try: commit = subprocess.run(
+        ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError: commit = ''
+    run = dict(
+        written = datetime.datetime.now().isoformat(timespec='seconds'),
+        commit = commit or None,
+        python = sys.version.split(' ')[0],
+        platform = platform.platform(),
+        cpu_count = os.cpu_count(),
+        timeout = params['timeout'],
+        results = list()
+        )
+
+    failed = dict()
+    for iter_size in sorted(sizes or params['sizes']):
+        work_dir = generate_inputs(size=iter_size)
+        status = dict()
+        for iter_target, iter_spec in params['targets'].items():
+            result = dict(status = 'skipped', error = None, records = list())
+            if iter_target in failed:
+                result['error'] = 'timed out at n={0}'.format(failed[iter_target])
+            elif any(status.get(i) != 'ok' for i in iter_spec['requires']):
+                result['error'] = 'requires ' + ', '.join(iter_spec['requires'])
+            else:
+                result = time_target(work_dir=work_dir, recipe=iter_spec['recipe'])
+            if result['status'] in ['timeout', 'crashed']: failed[iter_target] = iter_size
+            status[iter_target] = result['status']
+            run['results'].append(dict(
+                size = iter_size, target = iter_target, status = result['status'],
+                error = result['error'], stages = summarize(result['records'])))
+            print('n={0:<7} {1:<10} {2}'.format(iter_size, iter_target, result['status']))
+
+    run['regressions'] = compare_runs(current=run, previous=previous)
+    with open(params['history'], 'at', encoding='utf-8') as f:
+        f.write(json.dumps(run, default=str) + '\n')
+    return run
+
+
+##########==========##########==========##########==========##########==========##########==========
+## CODE TESTS
+
+if __name__ == '__main__' and sys.argv[1:2] == ['clustering']:
+    results = benchmark_clustering(sizes=[int(i) for i in sys.argv[2::]])
+    print(results.pivot_table(index='config', columns='size', values=['seconds', 'cost_ratio']))
+
+elif __name__ == '__main__':
+    run = run_benchmark(sizes=[int(i) for i in sys.argv[1::]])
+    print(tabulate(run).to_string())
+    for iter_regression in run['regressions']: print('REGRESSION:', iter_regression)
+    if run['regressions']: sys.exit(1)
+
+##########==========##########==========##########==========##########==========##########==========
@@ -0,0 +1,203 @@
+"""
+    Purpose: Measures the dashboard's client-side cost.  Loads each panel's io_mid debug page in a
+        local headless browser and records the time to first render, then scripts every slider
+        step and records how long plotly.js takes to apply it (the restyle / update call) and to
+        paint the next frame.  Used to check that trace-count reductions actually help users.
+        Runs offline: pages are opened from disk, plotly.js is the shared copy in io_out, and any
+        request that is not for a local file is blocked.
+        Needs the optional playwright package and a browser build:
+            pip install playwright && python -m playwright install chromium
+    Inputs:
+        io_mid/{PANEL}.div: the panel divs of the latest build.
+        io_out/plotly.{hash}.js: the shared plotly.js asset the debug pages load.
+    Outputs:
+        io_mid/{PANEL}.html: debug pages, rewritten from the divs on every run (see
+            a3_render.wrap_debug_page()).
+        io_mid/render_report.json: per panel, the load and first-render times and the latency of
+            each slider step (every repeat, plus the median).
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, json, pathlib, datetime, statistics
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+from a3_render import read_text, write_text, wrap_debug_page
+from a5_instrument import instrument
+try: from playwright.sync_api import sync_playwright
+except ImportError: sync_playwright = None
+
+## set parameters
+params = dict(
+    panels = ['PROGRESS', 'PROXIMITY', 'MAP', 'OCONUS'],
+    browser = 'chromium',   # playwright browser type: chromium, firefox, or webkit
+    viewport = dict(width = 1280, height = 1000),
+    repeats = 3,            # passes through every slider step, after the first render
+    timeout_ms = 120 * 1000,
+    report = os.path.join('io_mid', 'render_report.json')
+)
+
+## runs before any page script: wraps Plotly.newPlot() as soon as plotly.js defines it, so the
+## first render can be timed from navigation start
+hook_newplot = '''
+(() => {
+    let plotly;
+    Object.defineProperty(window, 'Plotly', {
+        configurable: true,
+        get: () => plotly,
+        set: (value) => {
+            const newPlot = value.newPlot;
+            value.newPlot = function () {
+                const start = performance.now();
+                return newPlot.apply(this, arguments).then((gd) => {
+                    requestAnimationFrame(() => requestAnimationFrame(() => {
+                        window.firstRender = {
+                            newplot_start_ms: start,
+                            newplot_end_ms: performance.now()
+                        };
+                    }));
+                    return gd;
+                });
+            };
+            plotly = value;
+        }
+    });
+})();
+'''
+
+## applies each step of the figure's first slider the way the slider itself does, timing the
+## plotly.js call and the next painted frame separately
+step_through_slider = '''
+async ({repeats}) => {
+    const gd = document.querySelector('.plotly-graph-div');
+    const frame = () => new Promise((resolve) =>
+        requestAnimationFrame(() => requestAnimationFrame(resolve)));
+    const steps = ((gd.layout.sliders || [])[0] || {}).steps || [];
+    const timings = steps.map((step) => ({label: step.label, method: step.method,
+        call_ms: [], frame_ms: []}));
+    for (let r = 0; r < repeats; r++) {
+        for (let i = 0; i < steps.length; i++) {
+            if (!(steps[i].method in Plotly)) continue;
+            const start = performance.now();
+            await Plotly[steps[i].method](gd, ...steps[i].args);
+            const called = performance.now();
+            await frame();
+            timings[i].call_ms.push(called - start);
+            timings[i].frame_ms.push(performance.now() - start);
+        }
+    }
+    return {traces: gd.data.length, steps: timings};
+}
+'''
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS
+
+
+def prepare_page(name: str) -> str:
+    """ Returns the panel's debug page, rewritten from its current io_mid div on every run, so a
+    page left over from an older build (or an earlier debug_html run) is never the one timed.
+    """
+    file_address = os.path.join('io_mid', name + '.html')
+    write_text(file_address, wrap_debug_page(read_text(os.path.join('io_mid', name + '.div'))))
+    return file_address
+
+
+def block_remote(route) -> None:
+    """Playwright route handler: lets local files through and aborts everything else."""
+    if route.request.url.startswith('file:'): route.continue_()
+    else: route.abort()
+    return None
+
+
+def median_ms(values: list):
+    """Median of a list of millisecond timings, rounded; None for an empty list."""
+    return round(statistics.median(values), 2) if values else None
+
+
+@instrument
+def time_page(browser, file_address: str, params=params) -> dict:
+    """ Opens one page in a fresh browser context (so nothing is cached between panels), waits
+    for the first render, then steps through the slider params['repeats'] times.
+    Output: result = dict of page timings and per-step latencies, in milliseconds
+    """
+    context = browser.new_context(viewport = params['viewport'])
+    context.route('**/*', block_remote)
+    context.add_init_script(hook_newplot)
+    page = context.new_page()
+    page.set_default_timeout(params['timeout_ms'])
+    try:
+        page.goto(pathlib.Path(file_address).resolve().as_uri(), wait_until = 'load')
+        page.wait_for_function('window.firstRender !== undefined')
+        first = page.evaluate('''() => ({
+            ...window.firstRender,
+            load_ms: performance.getEntriesByType('navigation')[0].loadEventEnd
+        })''')
+        slider = page.evaluate(step_through_slider, dict(repeats = params['repeats']))
+    finally:
+        context.close()
+
+    for iter_step in slider['steps']:
+        iter_step['median_call_ms'] = median_ms(iter_step['call_ms'])
+        iter_step['median_frame_ms'] = median_ms(iter_step['frame_ms'])
+    frames = [j for i in slider['steps'] for j in i['frame_ms']]
+    return dict(
+        page = file_address,
+        traces = slider['traces'],
+        load_ms = round(first['load_ms'], 2),
+        time_to_first_render_ms = round(first['newplot_end_ms'], 2),
+        newplot_ms = round(first['newplot_end_ms'] - first['newplot_start_ms'], 2),
+        median_step_ms = median_ms(frames),
+        max_step_ms = round(max(frames), 2) if frames else None,
+        steps = slider['steps']
+    )
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+@instrument
+def run_render_benchmark(panels=None, params=params) -> dict:
+    """ Times first render and slider steps for each panel's page in a headless browser and
+    writes the results to params['report'].
+    Inputs:
+        panels = list of panel names; defaults to params['panels']
+        params = The parameters dictionary defined at the top of this script.
+    Output: report = dict of browser metadata and per-panel results
+    """
+    if sync_playwright is None:
+        raise ImportError('The render benchmark needs playwright: '
+            'pip install playwright && python -m playwright install chromium')
+    pages = {i: prepare_page(i) for i in (panels or params['panels'])}
+    with sync_playwright() as playwright:
+        browser = getattr(playwright, params['browser']).launch(headless = True)
+        report = dict(
+            written = datetime.datetime.now().isoformat(timespec='seconds'),
+            browser = params['browser'] + ' ' + browser.version,
+            viewport = params['viewport'],
+            repeats = params['repeats'],
+            panels = dict()
+            )
+        try:
+            for iter_name, iter_page in pages.items():
+                report['panels'][iter_name] = time_page(browser, iter_page)
+                result = report['panels'][iter_name]
+                print('{0:<10} first render {1:>9} ms  median step {2:>8} ms  ({3} traces)'.format(
+                    iter_name, result['time_to_first_render_ms'], result['median_step_ms'],
+                    result['traces']))
+        finally:
+            browser.close()
+    write_text(params['report'], json.dumps(report, indent = 1))
+    return report
+
+
+##########==========##########==========##########==========##########==========##########==========
+## CODE TESTS
+
+if __name__ == '__main__':
+    run_render_benchmark(panels = sys.argv[1::])
+
+##########==========##########==========##########==========##########==========##########==========
@@ -0,0 +1,198 @@
+"""
+    Purpose: Serves the dashboard locally the way a static host would, so page-weight work can be
+        measured as users receive it.  Each file in io_out is served with a strong ETag and
+        answered with 304 Not Modified when the browser already has it.  Content-hashed assets
+        (e.g. plotly.{hash}.js) are marked immutable, so they are cached for a year and never
+        revalidated; everything else (e.g. roadtrips.html) is revalidated on every load.
+        Compressible files are sent brotli- or gzip-encoded, whichever the browser accepts, using
+        the .br / .gz variants publish_asset() writes when they are current, and compressing the
+        rest once per version of the file (at the same settings) otherwise.  Every request is
+        logged with the bytes sent and how long the server took to send them.
+        Runs alongside watch mode (a1_execute_project.py watch): a rebuilt page is picked up on
+        the next request.
+    Inputs:
+        io_out: the rendered dashboard and its static assets.
+    Outputs:
+        io_mid/serve_log.jsonl: one JSON object per request: time, method, path, status,
+            encoding, bytes sent, and latency.
+    Open GitHub Issues:
+        # None.  This file is good to go.
+"""
+##########==========##########==========##########==========##########==========##########==========
+## INITIALIZE
+
+## import packages
+import os, sys, re, json, time, hashlib, mimetypes, threading, posixpath
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+if not sys.prefix.endswith('.venv'): raise Exception('Virtual Environment Not Detected')
+from a3_render import compress_bytes, params as render_params
+
+## set parameters
+params = dict(
+    directory = render_params['asset_dir'],
+    host = '127.0.0.1',
+    port = 8000,
+    index = 'roadtrips.html',
+    encodings = dict(br = ('brotli', '.br'), gzip = ('gzip', '.gz')),   # in order of preference
+    compressible = ['.html', '.css', '.js', '.json', '.svg', '.txt'],
+    immutable = r'\.[0-9a-f]{' + str(render_params['hash_length']) + r'}\.\w+$',
+    log = os.path.join('io_mid', 'serve_log.jsonl')
+)
+file_cache = dict()     # file address: (mtime, size, representations); see load_file()
+log_lock = threading.Lock()
+
+##########==========##########==========##########==========##########==========##########==========
+## COMPONENT FUNCTIONS
+
+
+def load_file(file_address: str, params=params) -> dict:
+    """ Every representation of a file the server can send, as dict of content coding ('identity',
+    'br', 'gzip'): dict(body, etag).  Memoized on the file's modification time and size, so each
+    version of a file is read, hashed, and compressed once.  Each coding gets its own strong ETag,
+    as HTTP requires of differently encoded bodies.
+    """
+    stat = os.stat(file_address)
+    cached = file_cache.get(file_address)
+    if (cached is not None) and (cached[0:2] == (stat.st_mtime_ns, stat.st_size)): return cached[2]
+
+    with open(file_address, 'rb') as f: body = f.read()
+    etag = hashlib.sha256(body).hexdigest()[0:16]
+    representations = dict(identity = dict(body = body, etag = '"' + etag + '"'))
+    if os.path.splitext(file_address)[1] in params['compressible']:
+        for iter_coding, (iter_method, iter_ext) in params['encodings'].items():
+            variant = file_address + iter_ext
+            if os.path.exists(variant) and os.stat(variant).st_mtime_ns >= stat.st_mtime_ns:
+                with open(variant, 'rb') as f: encoded = f.read()
+            else: encoded = compress_bytes(body, iter_method)
+            if (encoded is None) or (len(encoded) >= len(body)): continue
+            representations[iter_coding] = dict(
+                body = encoded, etag = '"' + etag + '-' + iter_coding + '"')
+    file_cache[file_address] = (stat.st_mtime_ns, stat.st_size, representations)
+    return representations
+
+
+def choose_encoding(accept_encoding: str, available: list, params=params) -> str:
+    """ Picks the most preferred content coding (see params['encodings']) that the request's
+    Accept-Encoding header allows, or 'identity'.
+    """
+    accepted = dict()
+    for iter_part in (accept_encoding or '').lower().split(','):
+        coding, _, quality = iter_part.strip().partition(';')
+        quality = quality.strip()
+        try: accepted[coding.strip()] = float(quality[2::]) if quality.startswith('q=') else 1.0
+        except ValueError: accepted[coding.strip()] = 0.0
+    for iter_coding in params['encodings'].keys():
+        if iter_coding not in available: continue
+        if accepted.get(iter_coding, accepted.get('*', 0.0)) > 0: return iter_coding
+    return 'identity'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """ Whether an If-None-Match header matches a representation's ETag: '*' matches anything,
+    and tags are compared weakly (a W/ prefix is ignored), as RFC 9110 requires for this header.
+    """
+    tags = [i.strip() for i in (if_none_match or '').split(',')]
+    if '*' in tags: return True
+    return etag in [i[2::] if i.startswith('W/') else i for i in tags]
+
+
+def resolve_path(url: str, params=params):
+    """ Maps a request URL to a file in params['directory'], or None if it names no file there.
+    Paths that would climb out of the directory are refused.
+    """
+    path = posixpath.normpath(unquote(urlsplit(url).path))
+    parts = [i for i in path.split('/') if i not in ('', '.')]
+    if '..' in parts: return None
+    file_address = os.path.join(params['directory'], *(parts or [params['index']]))
+    return file_address if os.path.isfile(file_address) else None
+
+
+def write_log(entry: dict, params=params) -> None:
+    """Prints one request's log line and appends it to params['log']."""
+    print('{status} {method:<4} {path:<40} {encoding:<8} {bytes:>11,} B {latency_ms:>8.1f} ms'
+        .format(**entry))
+    with log_lock, open(params['log'], 'at') as f: f.write(json.dumps(entry) + '\n')
+    return None
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    """ Answers GET and HEAD requests for the files in params['directory']; see the module
+    docstring for the caching and compression rules.
+    """
+    server_version = 'roadtrips-dev'
+    protocol_version = 'HTTP/1.1'   # keep-alive, as a static host would
+
+    def do_GET(self): self.respond(send_body = True)
+
+    def do_HEAD(self): self.respond(send_body = False)
+
+    def respond(self, send_body: bool, params=params) -> None:
+        started = time.perf_counter()
+        status, coding, sent = 404, 'identity', 0
+        file_address = resolve_path(self.path)
+        if file_address is None:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            representations = load_file(file_address)
+            coding = choose_encoding(
+                self.headers.get('Accept-Encoding'), list(representations.keys()))
+            representation = representations[coding]
+            status = 304 if etag_matches(
+                self.headers.get('If-None-Match'), representation['etag']) else 200
+            content_type = mimetypes.guess_type(file_address)[0] or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type.endswith(('javascript', 'json')):
+                content_type += '; charset=utf-8'
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('ETag', representation['etag'])
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable'
+                if re.search(params['immutable'], file_address) else 'no-cache')
+            if len(representations) > 1: self.send_header('Vary', 'Accept-Encoding')
+            if coding != 'identity': self.send_header('Content-Encoding', coding)
+            if status == 200: self.send_header('Content-Length', str(len(representation['body'])))
+            self.end_headers()
+            if send_body and (status == 200):
+                self.wfile.write(representation['body'])
+                sent = len(representation['body'])
+        self.wfile.flush()
+        write_log(dict(
+            time = round(time.time(), 3), method = self.command, path = self.path,
+            status = status, encoding = coding, bytes = sent,
+            latency_ms = round(1000 * (time.perf_counter() - started), 2)))
+        return None
+
+    def log_request(self, code='-', size='-'): return None     # write_log() covers requests
+
+
+##########==========##########==========##########==========##########==========##########==========
+## TOP-LEVEL FUNCTIONS
+
+
+def serve_dashboard(port=None, params=params) -> None:
+    """ Serves params['directory'] at http://host:port/ until interrupted.  Every file is loaded
+    (and compressed where needed) before the first request, so logged latencies reflect serving
+    rather than first-time compression.
+    """
+    for iter_file in os.listdir(params['directory']):
+        if os.path.isfile(os.path.join(params['directory'], iter_file)):
+            load_file(os.path.join(params['directory'], iter_file))
+    server = ThreadingHTTPServer((params['host'], port or params['port']), DashboardHandler)
+    print('Serving {0} at http://{1}:{2}/ (Ctrl+C to stop)...'.format(
+        params['directory'], *server.server_address[0:2]))
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+    return None
+
+
+##########==========##########==========##########==========##########==========##########==========
+## CODE TESTS
+
+if __name__ == '__main__':
+    serve_dashboard(port = int(sys.argv[1]) if sys.argv[1:] else None)
+
+##########==========##########==========##########==========##########==========##########==========